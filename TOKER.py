@@ -6,6 +6,7 @@ from werkzeug.exceptions import HTTPException
 
 from models import Sesh
 from models import db
+from utils.db_utils import configure_sqlite_pragmas
 from utils.doc_utils import to_pretty_json
 from utils.setup_utils import load_config
 from utils.utils import success_response_dict, error_response, log_kv, LOG_DEBUG, LOG_ERROR
@@ -19,6 +20,7 @@ with app.app_context():
     current_app.config = app.config
 
 # Set up the database after configuration application.
+configure_sqlite_pragmas(app.config.get('SQLITE_PRAGMAS'))
 db.init_app(app)
 db.app = app
 Sesh.configure(bind=db.engine)
@@ -35,7 +37,18 @@ from routes.analytics import analytics_bp
 from routes.frontend import frontend_bp
 from routes.trade import trade_bp, trade_docs, TradeStatus
 from routes.transfer import transfer_bp, transfer_docs
+from routes.history import history_bp, history_docs
+from routes.gas import gas_bp, gas_docs
 from models.contract import TokenStatus, ContractStatus
+from models.history import TransferKind
+from ether.contract_cache import load_contract_interface
+
+# Load the compiled contract while the worker starts instead of on the first contract issue.
+if not app.config.get('USE_MOCK', False):
+    try:
+        load_contract_interface()
+    except Exception as e:
+        log_kv(LOG_ERROR, {'error': 'could not load compiled contract', 'exception': str(e)}, exception=True)
 
 # Registering blueprints.
 app.register_blueprint(collector_bp)
@@ -49,6 +62,8 @@ app.register_blueprint(analytics_bp)
 app.register_blueprint(frontend_bp)
 app.register_blueprint(trade_bp)
 app.register_blueprint(transfer_bp)
+app.register_blueprint(history_bp)
+app.register_blueprint(gas_bp)
 
 
 @app.before_request
@@ -88,10 +103,10 @@ def docs():
     """
     app.jinja_env.filters['tojson_pretty'] = to_pretty_json
     blueprint_doc_list = [collector_docs, issuer_docs, contract_docs, login_docs, ping_docs, claim_docs, explore_docs,
-                          trade_docs, transfer_docs]
+                          trade_docs, transfer_docs, history_docs, gas_docs]
     return render_template('documentation.html', bp_docs=blueprint_doc_list,
                            base_resp=success_response_dict({}),
-                           enums=[TradeStatus, ContractStatus, TokenStatus])
+                           enums=[TradeStatus, ContractStatus, TokenStatus, TransferKind])
 
 
 if __name__ == '__main__':
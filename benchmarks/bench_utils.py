@@ -0,0 +1,123 @@
+"""
+Shared helpers for the benchmark scripts. Every benchmark runs against a throw away sqlite database built from
+create_statements.sql and the migrations so nothing ever touches temp.db.
+
+Run a benchmark from the repository root, ex: python -m benchmarks.dataquery_bench
+"""
+import os
+import sqlite3
+import tempfile
+from time import perf_counter
+
+from flask import Flask
+from sqlalchemy.engine import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from processes.migrate import get_migrations
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CREATE_STATEMENTS = os.path.join(ROOT_PATH, 'create_statements.sql')
+
+
+def make_db_file():
+    """
+    Creates a new sqlite file with the application schema, fully migrated.
+    :return: path to the database file.
+    """
+    fd, path = tempfile.mkstemp(prefix='toker_bench_', suffix='.db')
+    os.close(fd)
+    con = sqlite3.connect(path)
+    for script in [CREATE_STATEMENTS] + [m_path for _, _, m_path in get_migrations()]:
+        with open(script) as fp:
+            con.executescript(fp.read())
+    con.commit()
+    con.close()
+    return path
+
+
+def make_session(path=None):
+    """
+    Creates a session bound to a benchmark database.
+    :param path: sqlite file to use, a new one is created if not given.
+    :return: Tuple of (Session factory, database path)
+    """
+    path = path if path is not None else make_db_file()
+    session = sessionmaker(bind=create_engine('sqlite:///' + path))
+    return session, path
+
+
+def seed(sesh, num_contracts=50, tokens_per_contract=100, num_collectors=20, constraints_per_contract=5):
+    """
+    Fills the benchmark database with issued contracts, tokens and constraints.
+    :param sesh: session to insert with.
+    :param num_contracts: number of contracts to create.
+    :param tokens_per_contract: number of tokens under each contract.
+    :param num_collectors: number of collectors to create.
+    :param constraints_per_contract: number of code, time and location constraints on each contract.
+    :return: None
+    """
+    sesh.execute("INSERT INTO issuers(username, password, i_hash, i_priv_key) VALUES ('bench', 'pw', '0x1', 'key')")
+    sesh.execute("INSERT INTO collectors(username, password, c_hash, c_priv_key) VALUES (:u, 'pw', '0x2', 'key')",
+                 [{'u': 'collector_{}'.format(c)} for c in range(num_collectors)])
+    sesh.execute("""
+    INSERT INTO contracts(i_id, con_tx, con_addr, con_abi, name, description, num_created, pic_location, status,
+      metadata_location)
+    VALUES (1, '0xaa', '0xbb', '{"abi": []}', :name, :description, :num_created, 'default.png', 'S', 'meta.json')
+    """, [{'name': 'contract {}'.format(c), 'description': 'benchmark contract {}'.format(c),
+           'num_created': tokens_per_contract} for c in range(num_contracts)])
+    sesh.execute("INSERT INTO tokens(con_id, t_hash, status) VALUES (:con_id, 'temp_hash', 'N')",
+                 [{'con_id': c} for c in range(1, num_contracts + 1) for _ in range(tokens_per_contract)])
+
+    constraint_binds = [{'con_id': c, 'n': n} for c in range(1, num_contracts + 1)
+                        for n in range(constraints_per_contract)]
+    sesh.execute("INSERT INTO unique_code_claim(con_id, code) VALUES (:con_id, 'CODE' || (10 + :n))",
+                 constraint_binds)
+    sesh.execute("""
+    INSERT INTO time_claim(con_id, start, end) VALUES (:con_id, '2018-01-01 00:00:00', '2030-01-01 00:00:00')
+    """, constraint_binds)
+    # Only every other contract gets a location so the include_nearby filter has something to do.
+    location_binds = [b for b in constraint_binds if b['con_id'] % 2 == 0]
+    if location_binds:
+        sesh.execute("""
+        INSERT INTO location_claim(con_id, latitude, longitude, radius)
+        VALUES (:con_id, 40.76 + :n / 100.0, -111.89 + :n / 100.0, 1000)
+        """, location_binds)
+    sesh.commit()
+
+
+def bench_app():
+    """
+    Flask application used for request contexts, the schemas build urls off of request.url_root.
+    :return: Flask app.
+    """
+    return Flask('benchmarks', root_path=ROOT_PATH)
+
+
+def time_per_call(fn, iterations):
+    """
+    Times the given function.
+    :param fn: function to call with no arguments.
+    :param iterations: number of times to call it.
+    :return: mean microseconds per call.
+    """
+    fn()
+    start = perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (perf_counter() - start) / iterations * 1000000
+
+
+def print_table(title, header, rows):
+    """
+    Prints benchmark results as an aligned table.
+    :param title: Title printed above the table.
+    :param header: List of column names.
+    :param rows: List of row lists.
+    :return: None
+    """
+    widths = [max(len(str(v)) for v in col) for col in zip(header, *rows)]
+    print('\n' + title)
+    print('  '.join(str(h).ljust(w) for h, w in zip(header, widths)))
+    print('  '.join('-' * w for w in widths))
+    for row in rows:
+        print('  '.join(str(v).ljust(w) for v, w in zip(row, widths)))
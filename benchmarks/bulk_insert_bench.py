@@ -0,0 +1,59 @@
+"""
+Benchmark of contract creation in the database: inserting the contract, its tokens and the qr code locations.
+
+"before" replays the old per token path: one insert plus a select last_insert_rowid() for every token and one
+UpdateQRCODE per token. "after" is insert_bulk_tokens with the batched UpdateQRCODE. Each run is rolled back so the
+database stays the same size between runs.
+
+usage: python -m benchmarks.bulk_insert_bench [iterations]
+"""
+import sys
+
+from benchmarks.bench_utils import make_session, seed, time_per_call, print_table
+from models.contract import InsertNewContract, UpdateQRCODE, insert_bulk_tokens
+
+TOKEN_COUNTS = (10, 100, 1000)
+
+CONTRACT_DEETS = {'i_id': 1, 'con_tx': '0xaa', 'con_abi': '{"abi": []}', 'name': 'bench', 'description': 'bench',
+                  'tradable': 1, 'num_created': 0, 'pic_location': 'default.png', 'qr_code_claimable': 1,
+                  'gas_price': 1, 'metadata_location': 'meta.json', 'sender': None}
+
+LEGACY_INSERT_TOKEN = "INSERT INTO tokens(con_id, t_hash, status) values(:con_id, :tok_hash, 'N');"
+
+
+def legacy_create(num_to_create, sesh):
+    InsertNewContract().execute(CONTRACT_DEETS, sesh=sesh)
+    con_id = sesh.execute("select last_insert_rowid() as 'con_id'").fetchone()['con_id']
+    t_ids = []
+    for _ in range(num_to_create):
+        sesh.execute(LEGACY_INSERT_TOKEN, {'con_id': con_id, 'tok_hash': 'temp_hash'})
+        t_ids.append(sesh.execute("select last_insert_rowid() as 't_id'").fetchone()['t_id'])
+    for t_id in t_ids:
+        UpdateQRCODE().execute({'qr_code_location': 'qr.png', 'con_id': con_id, 't_id': t_id}, sesh=sesh)
+    sesh.rollback()
+
+
+def bulk_create(num_to_create, sesh):
+    con_id, t_ids = insert_bulk_tokens(num_to_create, CONTRACT_DEETS, sesh)
+    UpdateQRCODE().execute([{'qr_code_location': 'qr.png', 'con_id': con_id, 't_id': t_id} for t_id in t_ids],
+                           sesh=sesh)
+    sesh.rollback()
+
+
+def main(iterations):
+    session, _ = make_session()
+    sesh = session()
+    seed(sesh)
+
+    rows = []
+    for num in TOKEN_COUNTS:
+        before = time_per_call(lambda: legacy_create(num, sesh), iterations)
+        after = time_per_call(lambda: bulk_create(num, sesh), iterations)
+        rows.append([num, '{:.0f}'.format(before), '{:.0f}'.format(after), '{:.1f}x'.format(before / after)])
+
+    print_table('contract creation, {} iterations (us per contract)'.format(iterations),
+                ['tokens', 'before', 'after', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
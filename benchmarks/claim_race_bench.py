@@ -0,0 +1,148 @@
+"""
+Stress benchmark of many collectors claiming tokens of one contract at the same moment (a flash drop).
+
+Worker processes (standing in for the uwsgi workers) each run several claimer threads that all start together and
+claim one token after another, each claim in its own transaction, until they have made their share of claims. There are
+more claims than tokens, so the drop sells out part way through.
+
+"select then update" replays the old claim path: GetAvailableToken picks a token, GetTokenInfo runs, and SetToken
+writes the owner. "queue_claim" is the current path, where the insert into claim_outbox picks the token under the write
+lock. A double allocation is a claim that was told it got a token another claim also got. The benchmark fails if
+queue_claim double allocates or turns a claim away while tokens are left.
+
+usage: python -m benchmarks.claim_race_bench [tokens] [workers] [threads_per_worker]
+"""
+import multiprocessing
+import os
+import sys
+import threading
+from time import perf_counter
+
+from sqlalchemy.exc import OperationalError
+
+from benchmarks.bench_utils import ROOT_PATH, make_session, seed, print_table
+from models.claim import GetAvailableToken, GetTokenInfo, SetToken
+from models.contract import TokenStatus
+from routes.claim import queue_claim
+from utils.db_utils import configure_sqlite_pragmas
+from utils.setup_utils import load_config
+
+CON_ID = 1
+NUM_COLLECTORS = 50
+
+# Claims made for every token in the drop.
+OVERSUBSCRIPTION = 1.5
+
+
+def select_then_update(sesh, c_id):
+    avail_token = GetAvailableToken().execute_n_fetchone({'con_id': CON_ID}, sesh=sesh)
+    token_info = GetTokenInfo().execute_n_fetchone({'con_id': CON_ID, 'c_id': c_id}, sesh=sesh)
+    if not avail_token or not token_info:
+        return None
+    SetToken().execute({'con_id': CON_ID, 't_id': avail_token['t_id'], 'c_id': c_id, 'latitude': 40.76,
+                        'longitude': -111.89, 'gas_price': 1, 't_hash': '0xbench', 'sender': None,
+                        'new_status': TokenStatus.CLAIMED.value}, sesh=sesh)
+    return avail_token['t_id']
+
+
+def atomic_queue(sesh, c_id):
+    if not GetTokenInfo().execute_n_fetchone({'con_id': CON_ID, 'c_id': c_id}, sesh=sesh):
+        return None
+    queued = queue_claim(CON_ID, c_id, 40.76, -111.89, sesh=sesh)
+    return queued[1] if queued else None
+
+
+CLAIM_PATHS = {'select then update': select_then_update, 'queue_claim': atomic_queue}
+
+
+def claimer(session, path_name, num_claims, start, outcomes):
+    claim = CLAIM_PATHS[path_name]
+    sesh = session()
+    start.wait()
+    for n in range(num_claims):
+        try:
+            outcomes.append(('won', claim(sesh, n % NUM_COLLECTORS + 1)))
+            sesh.commit()
+        except OperationalError:
+            sesh.rollback()
+            outcomes.append(('locked', None))
+    sesh.close()
+
+
+def worker(path, pragmas, path_name, threads, claims_per_thread, start, results):
+    configure_sqlite_pragmas(pragmas)
+    session, _ = make_session(path)
+    outcomes = []
+    local_start = threading.Barrier(threads)
+    start.wait()
+
+    def run():
+        claimer(session, path_name, claims_per_thread, local_start, outcomes)
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put(outcomes)
+
+
+def run_path(path_name, pragmas, num_tokens, num_workers, threads):
+    """
+    Runs a flash drop through one claim path against a new database.
+    :return: Tuple of (seconds, claims won, double allocations, sold out answers, locked errors, tokens left, claims)
+    """
+    configure_sqlite_pragmas(pragmas)
+    session, path = make_session()
+    seed(session(), num_contracts=1, tokens_per_contract=num_tokens, num_collectors=NUM_COLLECTORS,
+         constraints_per_contract=1)
+
+    claims_per_thread = int(num_tokens * OVERSUBSCRIPTION / (num_workers * threads)) + 1
+    start = multiprocessing.Barrier(num_workers + 1)
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=worker, args=(path, pragmas, path_name, threads, claims_per_thread,
+                                                            start, results))
+               for _ in range(num_workers)]
+    for process in workers:
+        process.start()
+    start.wait()
+    began = perf_counter()
+    outcomes = [outcome for _ in workers for outcome in results.get()]
+    elapsed = perf_counter() - began
+    for process in workers:
+        process.join()
+
+    sesh = session()
+    left = sesh.execute("SELECT count(*) FROM tokens WHERE owner_c_id IS NULL").scalar()
+    sesh.close()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    won = [t_id for kind, t_id in outcomes if kind == 'won' and t_id is not None]
+    sold_out = sum(1 for kind, t_id in outcomes if kind == 'won' and t_id is None)
+    locked = sum(1 for kind, _ in outcomes if kind == 'locked')
+    return elapsed, len(won), len(won) - len(set(won)), sold_out, locked, left, len(outcomes)
+
+
+def main(num_tokens=1000, num_workers=5, threads=8):
+    pragmas = load_config(ROOT_PATH).get('SQLITE_PRAGMAS') or {}
+
+    rows, failed = [], False
+    for path_name in CLAIM_PATHS:
+        elapsed, won, doubles, sold_out, locked, left, attempts = run_path(path_name, pragmas, num_tokens,
+                                                                           num_workers, threads)
+        rows.append([path_name, attempts, won, doubles, sold_out, locked, left, round(attempts / elapsed)])
+        if path_name == 'queue_claim':
+            failed = doubles or won != num_tokens or left
+
+    print_table('flash drop of {} tokens, {} workers x {} claimers'.format(num_tokens, num_workers, threads),
+                ['path', 'claims', 'won', 'double allocations', 'sold out', 'locked', 'tokens left', 'claims/s'],
+                rows)
+    if failed:
+        print('\nFAILED: queue_claim double allocated or turned claims away while tokens were left')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:4]]))
@@ -0,0 +1,81 @@
+"""
+Benchmark of the claim constraint checks POST /claim runs before it queues a claim.
+
+"before" replays the old validators: every check queries its table and loads the rows through the constraint schema,
+the time check parsing both ends of every interval with strptime. "after" runs the current validators against the
+per process constraint cache, once cold (the cache is cleared before every claim) and once warm. The benchmark fails if
+a warm check still sends a query.
+
+usage: python -m benchmarks.constraint_cache_bench [iterations] [constraints_per_contract]
+"""
+import sys
+from datetime import datetime
+
+from flask import g
+from sqlalchemy import event
+
+from benchmarks.bench_utils import make_session, seed, bench_app, time_per_call, print_table
+from models.constraints import GetUniqueCodeConstraints, GetTimeConstraints, GetLocationConstraints, near_enough, \
+    validate_uni_code_constraints, validate_time_constraints, validate_location_constraints, constraint_cache
+
+CON_ID = 2
+CLAIM_TIME = datetime(2020, 6, 1, 12, 0, 0)
+CLAIM_LOCATION = {'latitude': 40.76, 'longitude': -111.89}
+
+
+def legacy_checks(code, time, location):
+    ucs = GetUniqueCodeConstraints().execute_n_fetchall({'con_id': CON_ID})
+    code_ok = not ucs or (code is not None and any(code == uc['code'] for uc in ucs))
+    tcs = GetTimeConstraints().execute_n_fetchall({'con_id': CON_ID}, load_out=True)
+    time_ok = not tcs or (time is not None and any(tc['start'] < time < tc['end'] for tc in tcs))
+    lcs = GetLocationConstraints().execute_n_fetchall({'con_id': CON_ID})
+    location_ok = not lcs or (bool(location) and any(near_enough(lc['latitude'], lc['longitude'],
+                                                                 location['latitude'], location['longitude'],
+                                                                 lc['radius']) for lc in lcs))
+    return code_ok and time_ok and location_ok
+
+
+def cached_checks(code, time, location):
+    return (validate_uni_code_constraints(CON_ID, code) and validate_time_constraints(CON_ID, time) and
+            validate_location_constraints(CON_ID, location))
+
+
+def cold_checks(code, time, location):
+    constraint_cache.clear()
+    return cached_checks(code, time, location)
+
+
+def main(iterations=2000, constraints_per_contract=20):
+    session, _ = make_session()
+    sesh = session()
+    seed(sesh, num_contracts=4, tokens_per_contract=1, num_collectors=1,
+         constraints_per_contract=constraints_per_contract)
+
+    queries = []
+    event.listen(sesh.get_bind(), 'before_cursor_execute', lambda *args: queries.append(1))
+
+    rows, failed = [], False
+    with bench_app().app_context():
+        g.sesh = sesh
+        code = 'CODE{}'.format(10 + constraints_per_contract - 1)
+        for name, checks in (('before', legacy_checks), ('after, cold', cold_checks), ('after, warm', cached_checks)):
+            if not checks(code, CLAIM_TIME, CLAIM_LOCATION):
+                print('{} rejected a valid claim'.format(name))
+                failed = True
+            del queries[:]
+            us = time_per_call(lambda: checks(code, CLAIM_TIME, CLAIM_LOCATION), iterations)
+            per_claim = len(queries) / (iterations + 1)
+            rows.append([name, '{:.1f}'.format(us), '{:.1f}'.format(per_claim)])
+            if name == 'after, warm' and queries:
+                failed = True
+
+    print_table('claim constraint checks, {} of each constraint on the contract'.format(constraints_per_contract),
+                ['validators', 'us/claim', 'queries/claim'], rows)
+    if failed:
+        print('\nFAILED: warm checks sent queries or a valid claim was rejected')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:3]]))
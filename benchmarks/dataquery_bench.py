@@ -0,0 +1,96 @@
+"""
+Microbenchmark of the per call overhead of DataQuery on the claim and explore paths.
+
+"before" replays what DataQuery used to do on every call: build the sql, wrap it with text() and throw it away,
+build a new schema instance and hand the raw sql string to the session (which wraps it in text() again).
+"after" is the current DataQuery which compiles once per query class and shares the schema.
+
+usage: python -m benchmarks.dataquery_bench [iterations]
+"""
+import os
+import sys
+
+from sqlalchemy.sql import text
+
+from benchmarks.bench_utils import make_session, seed, bench_app, time_per_call, print_table
+from models.claim import GetAvailableToken, GetTokenInfo
+from models.constraints import GetUniqueCodeConstraints, GetTimeConstraints, GetLocationConstraints
+from models.contract import GetAllContracts
+from utils.utils import log_kv, LOG_DEBUG
+
+
+def legacy_fetchall(query_factory, binds, sesh, load_out=False):
+    query = query_factory()
+    text(query.sql_text)
+    schema = type(query.schema_out)()
+    log_kv(LOG_DEBUG, {'message': 'executing query', 'sql_text': query.sql_text, 'binds': binds})
+    rows = list(map(dict, sesh.execute(query.sql_text, binds).fetchall()))
+    return schema.load(rows, many=True) if load_out else schema.dump(rows, many=True)
+
+
+def legacy_fetchone(query_factory, binds, sesh):
+    query = query_factory()
+    text(query.sql_text)
+    schema = type(query.schema_out)()
+    log_kv(LOG_DEBUG, {'message': 'executing query', 'sql_text': query.sql_text, 'binds': binds})
+    row = sesh.execute(query.sql_text, binds).fetchone()
+    return None if row is None else schema.dump(dict(row))
+
+
+def main(iterations):
+    session, path = make_session()
+    sesh = session()
+    seed(sesh)
+
+    claim_binds = {'con_id': 7, 'c_id': 3}
+    explore_binds = {'include_nearby': 1, 'keyword': 'contract 1'}
+
+    cases = [
+        ('claim', 'GetAvailableToken',
+         lambda: legacy_fetchone(GetAvailableToken, claim_binds, sesh),
+         lambda: GetAvailableToken().execute_n_fetchone(claim_binds, sesh=sesh)),
+        ('claim', 'GetTokenInfo',
+         lambda: legacy_fetchone(GetTokenInfo, claim_binds, sesh),
+         lambda: GetTokenInfo().execute_n_fetchone(claim_binds, sesh=sesh)),
+        ('claim', 'GetUniqueCodeConstraints',
+         lambda: legacy_fetchall(GetUniqueCodeConstraints, claim_binds, sesh),
+         lambda: GetUniqueCodeConstraints().execute_n_fetchall(claim_binds, sesh=sesh)),
+        ('claim', 'GetTimeConstraints',
+         lambda: legacy_fetchall(GetTimeConstraints, claim_binds, sesh, load_out=True),
+         lambda: GetTimeConstraints().execute_n_fetchall(claim_binds, sesh=sesh, load_out=True)),
+        ('claim', 'GetLocationConstraints',
+         lambda: legacy_fetchall(GetLocationConstraints, claim_binds, sesh),
+         lambda: GetLocationConstraints().execute_n_fetchall(claim_binds, sesh=sesh)),
+        ('explore', 'GetAllContracts',
+         lambda: legacy_fetchall(lambda: GetAllContracts(False), explore_binds, sesh),
+         lambda: GetAllContracts(False).execute_n_fetchall(explore_binds, sesh=sesh)),
+        ('explore', 'GetAllContracts(keyword)',
+         lambda: legacy_fetchall(lambda: GetAllContracts(True), explore_binds, sesh),
+         lambda: GetAllContracts(True).execute_n_fetchall(explore_binds, sesh=sesh)),
+    ]
+
+    rows = []
+    totals = {}
+    with bench_app().test_request_context():
+        for path_name, name, before, after in cases:
+            before_us = time_per_call(before, iterations)
+            after_us = time_per_call(after, iterations)
+            total = totals.setdefault(path_name, [0, 0])
+            total[0] += before_us
+            total[1] += after_us
+            rows.append([path_name, name, '{:.1f}'.format(before_us), '{:.1f}'.format(after_us),
+                         '{:.2f}x'.format(before_us / after_us)])
+
+    for path_name, (before_us, after_us) in totals.items():
+        rows.append([path_name, 'TOTAL', '{:.1f}'.format(before_us), '{:.1f}'.format(after_us),
+                     '{:.2f}x'.format(before_us / after_us)])
+
+    print_table('DataQuery per call overhead ({} iterations)'.format(iterations),
+                ['path', 'query', 'before (us)', 'after (us)', 'speedup'], rows)
+
+    sesh.close()
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,115 @@
+"""
+Benchmark of the location math in utils.geo against calling mpu.haversine_distance once per fence, with 10k fences.
+
+"claim check" is one collector checked against every fence while standing outside all of them, the worst case for
+validate_location_constraints. "proximity" ranks contracts of two fences each by their nearest fence, what
+/explore/proximity does. "analytics" counts the claims inside each fence for a batch of claimed tokens. The benchmark
+fails if the two ways disagree on any distance by more than a millimeter or on whether a point is inside a fence.
+
+usage: python -m benchmarks.geo_bench [fences] [iterations]
+"""
+import random
+import sys
+
+import mpu
+import numpy as np
+
+from benchmarks.bench_utils import time_per_call, print_table
+from utils.geo import FenceSet, nearest_per_key
+
+# Fences are scattered over a box around Salt Lake City, each a few hundred meters to a few kilometers across.
+CENTER = (40.76, -111.89)
+SPREAD = 0.5
+OUTSIDE = (CENTER[0] + 5, CENTER[1] + 5)
+BATCH_POINTS = 50
+
+
+def make_fences(num_fences):
+    rand = random.Random(num_fences)
+    return [(CENTER[0] + rand.uniform(-SPREAD, SPREAD), CENTER[1] + rand.uniform(-SPREAD, SPREAD),
+             rand.uniform(100, 2000)) for _ in range(num_fences)]
+
+
+def mpu_m(lat1, long1, lat2, long2):
+    return mpu.haversine_distance((lat1, long1), (lat2, long2)) * 1000
+
+
+def mpu_contains(fences, lat, long):
+    return any(mpu_m(f_lat, f_long, lat, long) <= radius for f_lat, f_long, radius in fences)
+
+
+def mpu_proximity(fences, keys, lat, long):
+    nearest = {}
+    for key, (f_lat, f_long, _) in zip(keys, fences):
+        distance = mpu_m(f_lat, f_long, lat, long)
+        if key not in nearest or distance < nearest[key]:
+            nearest[key] = distance
+    return sorted(nearest.items(), key=lambda item: item[1])
+
+
+def numpy_proximity(fence_set, keys, lat, long):
+    distances = fence_set.distances(lat, long)
+    return [(keys[i], distances[i]) for i in nearest_per_key(keys, distances)]
+
+
+def mpu_count_within(fences, points):
+    return [sum(1 for lat, long in points if mpu_m(f_lat, f_long, lat, long) <= radius)
+            for f_lat, f_long, radius in fences]
+
+
+def check_agreement(fences, fence_set, keys, points):
+    """
+    :return: list of what the two ways disagree on, empty when they agree.
+    """
+    problems = []
+    lat, long = points[0]
+    mpu_distances = np.array([mpu_m(f_lat, f_long, lat, long) for f_lat, f_long, _ in fences])
+    worst = float(np.abs(mpu_distances - fence_set.distances(lat, long)).max())
+    if worst > 1e-3:
+        problems.append('distances differ by up to {:.6f} m'.format(worst))
+    inside = fence_set.contains_many([p[0] for p in points], [p[1] for p in points])
+    if [mpu_contains(fences, p_lat, p_long) for p_lat, p_long in points] != inside.tolist():
+        problems.append('contains differs')
+    if [int(c) for c in fence_set.count_within([p[0] for p in points], [p[1] for p in points])] != \
+            mpu_count_within(fences, points):
+        problems.append('count_within differs')
+    if [key for key, _ in mpu_proximity(fences, keys, lat, long)] != \
+            [int(key) for key, _ in numpy_proximity(fence_set, keys, lat, long)]:
+        problems.append('proximity order differs')
+    return problems
+
+
+def main(num_fences=10000, iterations=20):
+    fences = make_fences(num_fences)
+    fence_set = FenceSet.from_rows(fences)
+    keys = np.arange(num_fences, dtype=np.int64) // 2
+    rand = random.Random(0)
+    # Half the batch stands on a fence so both inside and outside are exercised.
+    points = [(lat, long) for lat, long, _ in fences[:BATCH_POINTS // 2]] + \
+             [(CENTER[0] + rand.uniform(-SPREAD, SPREAD), CENTER[1] + rand.uniform(-SPREAD, SPREAD))
+              for _ in range(BATCH_POINTS - BATCH_POINTS // 2)]
+    lats, longs = [p[0] for p in points], [p[1] for p in points]
+
+    rows = []
+    for name, before, after, runs in (
+            ('claim check', lambda: mpu_contains(fences, *OUTSIDE), lambda: fence_set.contains(*OUTSIDE),
+             iterations),
+            ('proximity', lambda: mpu_proximity(fences, keys.tolist(), *CENTER),
+             lambda: numpy_proximity(fence_set, keys, *CENTER), iterations),
+            ('analytics, {} claims'.format(BATCH_POINTS), lambda: mpu_count_within(fences, points),
+             lambda: fence_set.count_within(lats, longs), max(1, iterations // 10))):
+        before_us = time_per_call(before, runs)
+        after_us = time_per_call(after, runs)
+        rows.append([name, '{:.0f}'.format(before_us), '{:.0f}'.format(after_us),
+                     '{:.0f}x'.format(before_us / after_us)])
+
+    print_table('geo fence math over {} fences'.format(num_fences), ['case', 'mpu us', 'numpy us', 'speedup'], rows)
+    problems = check_agreement(fences, fence_set, keys, points)
+    if problems:
+        print('\nFAILED: ' + ', '.join(problems))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:3]]))
@@ -0,0 +1,59 @@
+"""
+Query count regression check for the issuer dashboard (GET /contract).
+
+Calls the endpoint for issuers with more and more contracts and counts the statements sent to sqlite. The count must
+stay at EXPECTED_QUERIES no matter how many contracts the issuer has, the script exits non zero when it does not.
+
+usage: python -m benchmarks.issuer_dashboard_bench
+"""
+import sys
+from time import perf_counter
+
+from sqlalchemy import event
+
+from benchmarks.bench_utils import make_session, seed, bench_app, print_table
+from models import Sesh
+from routes.contract import Contract
+from utils.verify_utils import generate_jwt
+
+# GetContractsByIssuerID plus one query per constraint type.
+EXPECTED_QUERIES = 4
+CONTRACT_COUNTS = (1, 10, 100, 500)
+
+
+def count_dashboard_queries(num_contracts):
+    """
+    Seeds a new database with num_contracts contracts for one issuer and loads their dashboard.
+    :param num_contracts: number of contracts the issuer has.
+    :return: Tuple of (number of statements executed, milliseconds taken)
+    """
+    session, _ = make_session()
+    seed(session(), num_contracts=num_contracts, tokens_per_contract=10)
+    engine = session.kw['bind']
+    Sesh.configure(bind=engine)
+
+    statements = []
+    event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    with bench_app().test_request_context(headers={'Authorization': generate_jwt({'i_id': 1})}):
+        start = perf_counter()
+        response = Contract().get()
+        elapsed = (perf_counter() - start) * 1000
+        assert len(response.get_json()['resp_data']['contracts']) == num_contracts
+    return len(statements), elapsed
+
+
+def main():
+    rows = []
+    failed = False
+    for num in CONTRACT_COUNTS:
+        queries, elapsed = count_dashboard_queries(num)
+        failed = failed or queries != EXPECTED_QUERIES
+        rows.append([num, queries, '{:.1f}'.format(elapsed)])
+
+    print_table('GET /contract (expected {} queries)'.format(EXPECTED_QUERIES), ['contracts', 'queries', 'ms'], rows)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
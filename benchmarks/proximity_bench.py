@@ -0,0 +1,83 @@
+"""
+Benchmark of /explore/proximity as the number of location constrained contracts grows.
+
+Contracts get one fence each, scattered over a square that grows with their number so there is always about one fence
+per FENCE_AREA_KM2 square kilometers, the way more contracts means more cities rather than a denser one. A collector in
+the middle asks for the nearest LIMIT contracts, once with every fence scored ("no radius") and once with radius
+SEARCH_RADIUS, where only the fences the r-tree finds around the collector are read. The benchmark fails if the two
+disagree on the contracts within the radius, or if the radius search at the largest size takes more than FLAT_FACTOR
+times as long as at the smallest.
+
+usage: python -m benchmarks.proximity_bench [iterations] [sizes...]
+"""
+import math
+import random
+import sys
+
+from flask import g
+
+from benchmarks.bench_utils import make_session, seed, bench_app, time_per_call, print_table
+from models.contract import contracts_by_proximity
+
+CENTER = (40.76, -111.89)
+FENCE_AREA_KM2 = 4
+SEARCH_RADIUS = 5000
+LIMIT = 20
+FLAT_FACTOR = 3
+
+
+def place_fences(sesh, num_contracts):
+    """
+    Replaces the seeded location constraints with one scattered fence per contract.
+    :param sesh: session to insert with.
+    :param num_contracts: number of contracts seeded.
+    :return: None
+    """
+    half_side_km = math.sqrt(num_contracts * FENCE_AREA_KM2) / 2
+    d_lat = half_side_km / 111.2
+    d_long = d_lat / math.cos(math.radians(CENTER[0]))
+    rand = random.Random(num_contracts)
+    sesh.execute("DELETE FROM location_claim")
+    sesh.execute("""
+    INSERT INTO location_claim(con_id, latitude, longitude, radius) VALUES (:con_id, :latitude, :longitude, 100)
+    """, [{'con_id': con_id, 'latitude': CENTER[0] + rand.uniform(-d_lat, d_lat),
+           'longitude': CENTER[1] + rand.uniform(-d_long, d_long)} for con_id in range(1, num_contracts + 1)])
+    sesh.commit()
+
+
+def main(iterations=20, *sizes):
+    sizes = sizes or (1000, 10000, 50000)
+    rows, radius_us, failed = [], [], False
+    with bench_app().test_request_context():
+        for size in sizes:
+            session, _ = make_session()
+            g.sesh = session()
+            seed(g.sesh, num_contracts=size, tokens_per_contract=1, num_collectors=1, constraints_per_contract=1)
+            place_fences(g.sesh, size)
+
+            everything = contracts_by_proximity(*CENTER)
+            nearby = contracts_by_proximity(*CENTER, radius=SEARCH_RADIUS, limit=LIMIT)
+            expected = [c['con_id'] for c in everything if c['distance'] <= SEARCH_RADIUS][:LIMIT]
+            if [c['con_id'] for c in nearby] != expected:
+                print('radius search disagrees with scoring every fence at {} contracts'.format(size))
+                failed = True
+
+            full = time_per_call(lambda: contracts_by_proximity(*CENTER, limit=LIMIT), iterations)
+            radius_us.append(time_per_call(lambda: contracts_by_proximity(*CENTER, radius=SEARCH_RADIUS, limit=LIMIT),
+                                           iterations))
+            rows.append([size, '{:.0f}'.format(full), '{:.0f}'.format(radius_us[-1]), len(nearby)])
+            g.sesh.close()
+
+    print_table('/explore/proximity, nearest {} within {} m'.format(LIMIT, SEARCH_RADIUS),
+                ['contracts', 'no radius us', 'radius us', 'returned'], rows)
+    if radius_us[-1] > FLAT_FACTOR * radius_us[0]:
+        print('\nradius search slowed down {:.1f}x'.format(radius_us[-1] / radius_us[0]))
+        failed = True
+    if failed:
+        print('\nFAILED: radius search disagreed or did not stay flat')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:]]))
@@ -0,0 +1,150 @@
+"""
+Concurrency benchmark of the sqlite pragma profile.
+
+Several reader and writer processes (standing in for the uwsgi workers and upact) hammer the same database file for
+a fixed amount of time, once with sqlite's defaults (rollback journal) and once with the SQLITE_PRAGMAS profile from
+configs/config.yml. Readers run the claim path lookups, writers claim tokens one transaction at a time.
+
+usage: python -m benchmarks.sqlite_pragma_bench [seconds] [readers] [writers]
+"""
+import multiprocessing
+import os
+import queue
+import random
+import sys
+from time import perf_counter
+
+from sqlalchemy.exc import OperationalError
+
+from benchmarks.bench_utils import ROOT_PATH, make_session, seed, print_table
+from models.claim import GetTokenInfo, SetToken
+from models.collector import GetCollection
+from utils.db_utils import configure_sqlite_pragmas
+from utils.setup_utils import load_config
+
+NUM_CONTRACTS = 50
+TOKENS_PER_CONTRACT = 200
+NUM_COLLECTORS = 20
+
+# Seconds past the end of the run a worker has to report back before the benchmark gives up on it.
+WORKER_TIMEOUT = 60
+
+
+def reader(path, pragmas, seconds):
+    configure_sqlite_pragmas(pragmas)
+    session, _ = make_session(path)
+    sesh = session()
+    done, locked = 0, 0
+    end = perf_counter() + seconds
+    while perf_counter() < end:
+        try:
+            GetTokenInfo().execute_n_fetchone({'con_id': random.randint(1, NUM_CONTRACTS),
+                                               'c_id': random.randint(1, NUM_COLLECTORS)}, sesh=sesh, schema_out=False)
+            GetCollection().execute_n_fetchall({'c_id': random.randint(1, NUM_COLLECTORS)}, sesh=sesh,
+                                               schema_out=False)
+            sesh.commit()
+            done += 1
+        except OperationalError:
+            sesh.rollback()
+            locked += 1
+    return 'read', done, locked
+
+
+def writer(path, pragmas, seconds):
+    configure_sqlite_pragmas(pragmas)
+    session, _ = make_session(path)
+    sesh = session()
+    done, locked = 0, 0
+    end = perf_counter() + seconds
+    while perf_counter() < end:
+        con_id = random.randint(1, NUM_CONTRACTS)
+        t_id = (con_id - 1) * TOKENS_PER_CONTRACT + random.randint(1, TOKENS_PER_CONTRACT)
+        try:
+            SetToken().execute({'con_id': con_id, 't_id': t_id, 'c_id': random.randint(1, NUM_COLLECTORS),
+                                'new_status': 'P', 't_hash': '0xbench', 'latitude': 40.76, 'longitude': -111.89,
+                                'gas_price': 1, 'sender': '0xbench'}, sesh=sesh)
+            sesh.commit()
+            done += 1
+        except OperationalError:
+            sesh.rollback()
+            locked += 1
+    return 'write', done, locked
+
+
+def report(work, path, pragmas, seconds, results):
+    """
+    Runs a reader or writer in a worker process and puts its counts on results, or the error that stopped it so the
+    parent doesn't wait on it forever.
+    """
+    try:
+        results.put(work(path, pragmas, seconds))
+    except Exception as e:
+        results.put(('error', '{} in {}: {}'.format(type(e).__name__, work.__name__, e), 0))
+
+
+def run_profile(pragmas, seconds, num_readers, num_writers):
+    """
+    Runs the workload against a new database with the given pragma profile.
+    :return: dict of kind to [operations, locked errors]
+    :raises RuntimeError: if a worker failed or never reported back.
+    """
+    configure_sqlite_pragmas(pragmas)
+    session, path = make_session()
+    seed(session(), num_contracts=NUM_CONTRACTS, tokens_per_contract=TOKENS_PER_CONTRACT,
+         num_collectors=NUM_COLLECTORS)
+
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=report, args=(reader, path, pragmas, seconds, results))
+               for _ in range(num_readers)]
+    workers += [multiprocessing.Process(target=report, args=(writer, path, pragmas, seconds, results))
+                for _ in range(num_writers)]
+    for worker in workers:
+        worker.start()
+
+    totals, errors = {'read': [0, 0], 'write': [0, 0]}, []
+    for _ in workers:
+        try:
+            kind, done, locked = results.get(timeout=seconds + WORKER_TIMEOUT)
+        except queue.Empty:
+            errors.append('a worker did not report back within {}s of the end of the run'.format(WORKER_TIMEOUT))
+            break
+        if kind == 'error':
+            errors.append(done)
+            continue
+        totals[kind][0] += done
+        totals[kind][1] += locked
+    for worker in workers:
+        worker.join(WORKER_TIMEOUT)
+        if worker.is_alive():
+            worker.terminate()
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    if errors:
+        raise RuntimeError('; '.join(errors))
+    return totals
+
+
+def main(seconds, num_readers, num_writers):
+    profiles = [('sqlite defaults', {}),
+                ('config.yml', load_config(ROOT_PATH).get('SQLITE_PRAGMAS') or {})]
+
+    rows = []
+    for name, pragmas in profiles:
+        try:
+            totals = run_profile(pragmas, seconds, num_readers, num_writers)
+        except RuntimeError as e:
+            print('FAILED: {} profile: {}'.format(name, e))
+            return 1
+        rows.append([name, '{:.0f}'.format(totals['read'][0] / seconds), '{:.0f}'.format(totals['write'][0] / seconds),
+                     totals['read'][1] + totals['write'][1]])
+
+    print_table('{} readers, {} writers for {}s'.format(num_readers, num_writers, seconds),
+                ['profile', 'reads/s', 'writes/s', 'locked errors'], rows)
+    return 0
+
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:]]
+    sys.exit(main(*(args + [5, 4, 2][len(args):])))
@@ -0,0 +1,153 @@
+"""
+Benchmark of one upact sweep over a large backlog of pending token claims.
+
+A simulated node runs in its own process on a unix socket and answers every JSON-RPC request (a whole batch counts as
+one) after a fixed latency, with a successful receipt for each transaction. The sweep is run once one chunk at a time
+and once on a thread pool, each against a fresh database of pending claims, and every token is checked to have been
+marked mined.
+
+usage: python -m benchmarks.upact_bench [tokens] [latency_ms] [workers]
+"""
+import contextlib
+import io
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps, loads
+from time import perf_counter, sleep
+
+from sqlalchemy.engine import create_engine
+
+from benchmarks.bench_utils import ROOT_PATH, make_session, seed, print_table
+from ether.geth_keeper import GethKeeper, NodeConnectionPool, RPC_BATCH_SIZE
+from models.contract import TokenStatus
+from processes import upact
+from utils.db_utils import configure_sqlite_pragmas
+from utils.setup_utils import load_config
+
+TOKENS_PER_CONTRACT = 100
+
+
+def receipt(tx_hash):
+    return {'transactionHash': tx_hash, 'transactionIndex': '0x0', 'blockHash': '0x' + '11' * 32,
+            'blockNumber': '0x10', 'from': '0x' + '22' * 20, 'to': '0x' + '33' * 20, 'cumulativeGasUsed': '0x5208',
+            'gasUsed': '0x5208', 'contractAddress': None, 'logs': [], 'logsBloom': '0x00', 'status': '0x1'}
+
+
+def answer(request):
+    if request['method'] == 'eth_getTransactionReceipt':
+        result = receipt(request['params'][0])
+    elif request['method'] == 'eth_blockNumber':
+        result = '0x10'
+    else:
+        return {'jsonrpc': '2.0', 'id': request['id'], 'error': {'code': -32601, 'message': 'not simulated'}}
+    return {'jsonrpc': '2.0', 'id': request['id'], 'result': result}
+
+
+def handle(conn, latency):
+    buf = b''
+    with conn:
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                return
+            buf += data
+            try:
+                request = loads(buf.decode())
+            except ValueError:
+                continue
+            buf = b''
+            sleep(latency)
+            response = [answer(r) for r in request] if isinstance(request, list) else answer(request)
+            conn.sendall(dumps(response).encode())
+
+
+def simulated_node(path, latency, ready):
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(64)
+    ready.set()
+    while True:
+        conn, _ = server.accept()
+        threading.Thread(target=handle, args=(conn, latency), daemon=True).start()
+
+
+def make_pending_db(num_tokens):
+    """
+    Builds a database where every token has a claim waiting to be mined.
+    :param num_tokens: number of pending claims.
+    :return: database path.
+    """
+    session, path = make_session()
+    sesh = session()
+    seed(sesh, num_contracts=max(1, num_tokens // TOKENS_PER_CONTRACT), tokens_per_contract=TOKENS_PER_CONTRACT,
+         num_collectors=1, constraints_per_contract=1)
+    sesh.execute("UPDATE tokens SET status = :status, t_hash = printf('%064x', t_id)",
+                 {'status': TokenStatus.CLAIMED.value})
+    sesh.commit()
+    sesh.close()
+    return path
+
+
+def run_sweep(node_path, num_tokens, workers):
+    """
+    Times one upact sweep.
+    :param node_path: socket of the simulated node.
+    :param num_tokens: number of pending claims.
+    :param workers: threads to sweep with, 1 runs the chunks one after another.
+    :return: Tuple of (seconds, tokens left pending)
+    """
+    path = make_pending_db(num_tokens)
+    upact.Session.configure(bind=create_engine('sqlite:///' + path))
+    upact.geth = GethKeeper(pool=NodeConnectionPool(node_path, size=workers))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = perf_counter()
+            if workers == 1:
+                upact.sweep()
+            else:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    upact.sweep(executor)
+            elapsed = perf_counter() - start
+
+        sesh = upact.Session()
+        left = sesh.execute("SELECT count(*) FROM tokens WHERE status != :status",
+                            {'status': TokenStatus.CLAIM_MINED.value}).scalar()
+        sesh.close()
+        return elapsed, left
+    finally:
+        os.remove(path)
+
+
+def main(num_tokens=10000, latency_ms=20, workers=4):
+    configure_sqlite_pragmas(load_config(ROOT_PATH).get('SQLITE_PRAGMAS'))
+
+    node_path = os.path.join(tempfile.mkdtemp(prefix='toker_node_'), 'geth.ipc')
+    ready = multiprocessing.Event()
+    node = multiprocessing.Process(target=simulated_node, args=(node_path, latency_ms / 1000, ready), daemon=True)
+    node.start()
+    ready.wait()
+
+    rows = []
+    try:
+        for num_workers in (1, workers):
+            elapsed, left = run_sweep(node_path, num_tokens, num_workers)
+            rows.append([num_workers, round(elapsed, 2), round(num_tokens / elapsed), left])
+    finally:
+        node.terminate()
+
+    print_table('upact sweep of {} pending claims, {} ms node latency, chunks of {}, batches of {}'
+                .format(num_tokens, latency_ms, upact.RECEIPT_CHUNK_SIZE, RPC_BATCH_SIZE),
+                ['workers', 'seconds', 'tokens/s', 'left pending'], rows)
+    if any(row[-1] for row in rows):
+        print('\nFAILED: some tokens were not marked mined')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:4]]))
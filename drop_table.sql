@@ -1,6 +1,12 @@
+drop table token_owners;
+drop table indexer_checkpoints;
+drop table token_transfers;
+drop table external_transfers;
+drop table claim_outbox;
 drop table issuers;
 drop table collectors;
 drop table contracts;
+drop table location_claim_rtree;
 drop table location_claim;
 drop table time_claim;
 drop table unique_code_claim;
@@ -9,6 +15,11 @@ drop table trade;
 drop table trade_item;
 
 
+delete from token_owners;
+delete from indexer_checkpoints;
+delete from token_transfers;
+delete from external_transfers;
+delete from claim_outbox;
 delete from issuers;
 delete from collectors;
 delete from contracts;
@@ -0,0 +1,120 @@
+"""
+Cache of the compiled issuer contract so issuing a contract never waits on solc.
+
+Artifacts are keyed by a hash of the contract source and the solc version. Each process keeps the ones it has loaded
+in memory and every compile is written to ARTIFACT_DIR, so new workers start warm. Prebuild at deploy time with:
+
+    python -m ether.contract_cache
+"""
+import glob
+import hashlib
+import os
+import threading
+from json import dump, load
+
+from solc import compile_source, get_solc_version
+
+from ether.contract_source import CONTRACT
+from utils.utils import log_kv, LOG_INFO, LOG_WARNING
+
+CONTRACT_NAME = '<stdin>:issuer_contract'
+ARTIFACT_DIR = os.getenv('CONTRACT_ARTIFACT_DIR',
+                         os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build'))
+
+_artifacts = {}
+_artifacts_lock = threading.Lock()
+_solc_version = None
+_solc_version_checked = False
+
+
+def get_source_hash(source):
+    """ Hashes the contract source
+
+    :param source: Solidity source code
+    :return: hex digest of the source
+    """
+    return hashlib.sha256(source.encode('utf8')).hexdigest()
+
+
+def get_compiler_version():
+    """ Gets the version of the installed solc, looked up once per process
+
+    :return: version string or None if solc is not installed
+    """
+    global _solc_version, _solc_version_checked
+    if not _solc_version_checked:
+        try:
+            _solc_version = str(get_solc_version())
+        except Exception as e:
+            log_kv(LOG_WARNING, {'warning': 'could not get solc version', 'exception': str(e)})
+        _solc_version_checked = True
+    return _solc_version
+
+
+def get_artifact_path(source_hash, version):
+    return os.path.join(ARTIFACT_DIR, 'issuer_contract-{}-solc-{}.json'.format(source_hash[:16], version))
+
+
+def _read_artifact(source_hash, version):
+    """ Reads the artifact from disk. Without a solc version any artifact built from the same source is used.
+
+    :return: contract interface dictionary or None if there is none on disk
+    """
+    if version is not None:
+        paths = [get_artifact_path(source_hash, version)]
+    else:
+        paths = sorted(glob.glob(get_artifact_path(source_hash, '*')), key=os.path.getmtime, reverse=True)
+
+    for path in paths:
+        try:
+            with open(path) as fp:
+                return load(fp)
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def _write_artifact(source_hash, version, interface):
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    path = get_artifact_path(source_hash, version)
+
+    # Write then rename so other workers never read half an artifact.
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as fp:
+        dump(interface, fp)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_contract_interface(source=CONTRACT):
+    """ Gets the abi and bytecode of the contract, from memory, then disk, compiling it only if neither has it
+
+    :param source: Solidity source code - default: ether/contract_source.CONTRACT
+    :return: Dictionary with the contract's 'abi' and 'bin'
+    """
+    source_hash = get_source_hash(source)
+    version = get_compiler_version()
+    key = (source_hash, version)
+
+    interface = _artifacts.get(key)
+    if interface is not None:
+        return interface
+
+    with _artifacts_lock:
+        interface = _artifacts.get(key)
+        if interface is None:
+            interface = _read_artifact(source_hash, version)
+            if interface is None:
+                if version is None:
+                    raise RuntimeError('No compiled contract for this source and solc is not installed')
+                log_kv(LOG_INFO, {'message': 'compiling contract', 'source_hash': source_hash, 'solc': version})
+                compiled = compile_source(source)[CONTRACT_NAME]
+                interface = {'abi': compiled['abi'], 'bin': compiled['bin']}
+                _write_artifact(source_hash, version, interface)
+            _artifacts[key] = interface
+    return interface
+
+
+if __name__ == '__main__':
+    load_contract_interface()
+    print(get_artifact_path(get_source_hash(CONTRACT), get_compiler_version()))
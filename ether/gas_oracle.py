@@ -0,0 +1,114 @@
+import os
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+from utils.utils import log_kv, LOG_WARNING
+
+# Gas price used when the node can't be sampled and nothing was sampled before.
+MAX_GAS_PRICE = 2000000000
+
+# Bounds every estimate is clamped to, so a burst of overpaying transactions can't drain the hot wallets.
+MIN_GAS_PRICE = int(os.getenv('MIN_GAS_PRICE', 1000000000))
+GAS_PRICE_CAP = int(os.getenv('GAS_PRICE_CAP', 20000000000))
+
+# Seconds an estimate is served before the node is sampled again, about one block.
+GAS_ORACLE_TTL = float(os.getenv('GAS_ORACLE_TTL', 15))
+
+# Number of recent blocks whose transactions are sampled.
+GAS_ORACLE_BLOCKS = int(os.getenv('GAS_ORACLE_BLOCKS', 20))
+
+# Fewest sampled transactions the percentiles are trusted with, below that the node's eth_gasPrice is used.
+GAS_ORACLE_MIN_SAMPLES = 10
+
+# Percentile of recently paid gas prices each kind of transaction bids. Claims are watched by a collector in the app,
+# trades sit between two collectors, deploys and mints are only picked up later by upact.
+GAS_TIERS = OrderedDict([('deploy', 40), ('trade', 60), ('claim', 75)])
+
+
+def percentile(values, pct):
+    """ Returns the nearest rank percentile of sorted values
+
+    :param values: sorted list of numbers
+    :param pct: percentile between 0 and 100
+    :return: the value at that percentile
+    """
+    return values[int(round(pct / 100 * (len(values) - 1)))]
+
+
+def clamp_gas_price(gas_price):
+    return max(MIN_GAS_PRICE, min(GAS_PRICE_CAP, int(gas_price)))
+
+
+class GasOracle(object):
+    """ Gas price estimates for each tier, cached for GAS_ORACLE_TTL seconds
+
+    One oracle is shared by every request of a worker process. Only one thread samples the node at a time, the others
+    keep getting the previous estimates meanwhile instead of waiting on it.
+    """
+
+    def __init__(self, sample, ttl=GAS_ORACLE_TTL):
+        """
+        :param sample: callable returning (list of gas prices paid in recent blocks, node's eth_gasPrice or None)
+        :param ttl: seconds an estimate is served for
+        """
+        self._sample = sample
+        self._ttl = ttl
+        self._refresh_lock = threading.Lock()
+        # (monotonic time sampled, estimates), swapped as a whole so readers never need the lock.
+        self._current = None
+
+    def _is_fresh(self, current):
+        return current is not None and monotonic() - current[0] < self._ttl
+
+    def _estimate(self):
+        """ Samples the node and works out the price of each tier
+
+        :return: Dictionary of tier prices plus where they came from
+        """
+        try:
+            paid, node_price = self._sample()
+        except Exception as e:
+            log_kv(LOG_WARNING, {'warning': 'could not sample gas prices', 'exception': str(e)})
+            if self._current is not None:
+                return self._current[1]
+            paid, node_price = [], None
+
+        if len(paid) >= GAS_ORACLE_MIN_SAMPLES:
+            paid = sorted(paid)
+            tiers = {tier: clamp_gas_price(percentile(paid, pct)) for tier, pct in GAS_TIERS.items()}
+            source = 'blocks'
+        elif node_price:
+            tiers = {tier: clamp_gas_price(node_price) for tier in GAS_TIERS}
+            source = 'node'
+        else:
+            tiers = {tier: MAX_GAS_PRICE for tier in GAS_TIERS}
+            source = 'fallback'
+        return {**tiers, 'node_gas_price': node_price, 'sampled_transactions': len(paid), 'source': source}
+
+    def estimates(self):
+        """ Returns the current estimates, sampling the node if they are older than the ttl
+
+        :return: Dictionary of the price in wei of each tier, node_gas_price, sampled_transactions, source and age
+        """
+        current = self._current
+        if not self._is_fresh(current):
+            # Wait for another thread's sample only when there is nothing to serve yet.
+            if self._refresh_lock.acquire(blocking=current is None):
+                try:
+                    current = self._current
+                    if not self._is_fresh(current):
+                        current = self._current = (monotonic(), self._estimate())
+                finally:
+                    self._refresh_lock.release()
+            else:
+                current = self._current
+        return {**current[1], 'age': round(monotonic() - current[0], 3)}
+
+    def price(self, tier):
+        """ Returns the gas price to bid for a tier
+
+        :param tier: one of GAS_TIERS
+        :return: gas price in wei
+        """
+        return self.estimates()[tier]
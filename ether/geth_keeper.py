@@ -1,14 +1,27 @@
+import hashlib
 import os
+import socket
+import threading
 from binascii import hexlify, unhexlify
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
-from json import dumps, loads
+from json import JSONDecodeError, dumps, loads
 from uuid import uuid4
 from random import randint
 
-from solc import compile_source
+from eth_abi import decode_abi
+from hexbytes import HexBytes
 from web3 import Web3, IPCProvider
 from web3.contract import ConciseContract
-from ether.contract_source import CONTRACT
+from web3.middleware.pythonic import receipt_formatter, to_integer_if_hex
+from web3.providers.ipc import PersistantSocket
+from web3.utils.abi import get_abi_output_types
+from web3.utils.threads import Timeout
+from eth_utils import to_bytes
+from ether.contract_cache import load_contract_interface
+from ether.gas_oracle import GasOracle, MAX_GAS_PRICE, GAS_ORACLE_BLOCKS, GAS_TIERS
+from ether.signing import LocalSigner, SignedSend, SIGNING_MODE
 
 # To use correctly install python3 and set as interpreter
 # Install geth with the rinkeby test network and pip install web3
@@ -25,12 +38,31 @@ from ether.contract_source import CONTRACT
 
 # IPC_LOCATION = '/home/anna/.ethereum/rinkeby/geth.ipc'
 # IPC_LOCATION = '/home/stone/.ethereum/rinkeby/geth.ipc'
-from utils.utils import log_kv, LOG_ERROR, USE_ROOT
+from utils.utils import log_kv, LOG_ERROR, LOG_WARNING, USE_ROOT
 
 IPC_LOCATION = os.getenv('IPC_LOC', '/usr/apps/Ethereum/rinkeby/geth.ipc')
 
+# Number of IPC connections each worker process keeps open to the node.
+NODE_POOL_SIZE = int(os.getenv('GETH_POOL_SIZE', 4))
+
+# Bounds of the per process contract cache, parsed ABIs and contract instances bound to an address.
+CONTRACT_CACHE_ABIS = 16
+CONTRACT_CACHE_INSTANCES = 256
+
+# Json file listing the hot wallets transactions are spread over as [{"address": ..., "password": ...}, ...]. The
+# root account is always part of the pool.
+HOT_WALLETS_FILE = os.getenv('HOT_WALLETS_FILE')
+
+# Most requests sent to the node in a single JSON-RPC batch.
+RPC_BATCH_SIZE = int(os.getenv('GETH_BATCH_SIZE', 100))
+
+# Topic of the contract's Transfer(address indexed _from, address indexed _to, uint256 indexed _token_id) event.
+TRANSFER_TOPIC = Web3.toHex(Web3.sha3(text='Transfer(address,address,uint256)'))
+
+# Requests that must never be sent twice, they are not retried after a socket error.
+NON_IDEMPOTENT_METHODS = ('eth_sendTransaction', 'eth_sendRawTransaction', 'personal_sendTransaction')
+
 ACCT_UNLOCK_DUR = 5
-MAX_GAS_PRICE = 2000000000
 
 
 class GethException(Exception):
@@ -48,13 +80,17 @@ class GethException(Exception):
         log_kv(LOG_ERROR, {'error': self.message, 'exception': self.exception}, exception=True)
 
 
+class TransactionRejected(GethException):
+    """ The node answered a send with an error, so the transaction was never taken and can safely be sent again """
+
+
 class MockGethKeeper(object):
 
     def create_account(self, *args, **kwargs):
         return 0, 123
 
     def issue_contract(self, *args, **kwargs):
-        return hexlify(b'a2'), '{}', randint(0, MAX_GAS_PRICE)
+        return hexlify(b'a2'), '{}', randint(0, MAX_GAS_PRICE), None
 
     def check_contract_mine(self, *args, **kwargs):
         return True, True, 123
@@ -65,6 +101,18 @@ class MockGethKeeper(object):
     def claim_token(self, *args, **kwargs):
         return hexlify(b'a2'), randint(0, MAX_GAS_PRICE)
 
+    def prepare_claim(self, *args, **kwargs):
+        return SignedSend(None, 0, b'a2', b'a2'), randint(0, MAX_GAS_PRICE)
+
+    def discard_signed(self, *args, **kwargs):
+        pass
+
+    def send_signed(self, signed, *args, **kwargs):
+        return hexlify(signed.hash)
+
+    def transaction_state(self, *args, **kwargs):
+        return 'pending'
+
     def get_users_token_id(self, *args, **kwargs):
         return -1
 
@@ -72,22 +120,527 @@ class MockGethKeeper(object):
         # raise GethException('yeet', 'yeet')
         return 10
 
+    def gas_prices(self, *args, **kwargs):
+        return {**{tier: MAX_GAS_PRICE for tier in GAS_TIERS}, 'node_gas_price': None, 'sampled_transactions': 0,
+                'source': 'fallback', 'age': 0}
 
-class GethKeeper(object):
+
+class ConnectionStats(object):
+    """ Thread-safe counters of the socket connections a NodeConnectionPool has opened
+
+    **Attributes**:
+        * connects: Number of sockets opened to the node.
+        * reconnects: Number of requests that failed with a socket error and dropped their socket.
+    """
 
     def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.reconnects = 0
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self):
+        with self._lock:
+            return {'connects': self.connects, 'reconnects': self.reconnects}
+
+
+class CountingSocket(PersistantSocket):
+    """ PersistantSocket that records every socket it opens. """
+
+    def __init__(self, ipc_path, stats):
+        super().__init__(ipc_path)
+        self._stats = stats
+
+    def _open(self):
+        sock = super()._open()
+        self._stats.count('connects')
+        return sock
+
+
+class ReconnectingIPCProvider(IPCProvider):
+    """ IPCProvider that keeps its socket open between requests and opens a new one after a socket error
+
+    A request that fails with a socket error or times out is retried once on a new socket, unless it could have sent a
+    transaction. Unlike the stock provider a socket closed by the node fails straight away instead of at the timeout.
+    """
+
+    def __init__(self, ipc_path, stats, **kwargs):
+        super().__init__(ipc_path, **kwargs)
+        self._stats = stats
+        self._socket = CountingSocket(self.ipc_path, stats)
+
+    def make_request(self, method, params):
+        return self._send(self.encode_rpc_request(method, params), method, method not in NON_IDEMPOTENT_METHODS)
+
+    def make_batch_request(self, calls):
+        """ Sends several requests to the node in one JSON-RPC batch
+
+        :param calls: list of (method, params) tuples
+        :return: list of the raw response objects, in the same order as calls
+        """
+        ids = [next(self.request_counter) for _ in calls]
+        request = to_bytes(text=dumps([{'jsonrpc': '2.0', 'method': method, 'params': params, 'id': request_id}
+                                       for request_id, (method, params) in zip(ids, calls)]))
+        retry = not any(method in NON_IDEMPOTENT_METHODS for method, _ in calls)
+        responses = self._send(request, 'batch', retry)
+
+        # A batch the node could not take at all is answered with a single error object rather than an array, every
+        # request in it gets that error.
+        if isinstance(responses, dict):
+            error = responses.get('error') or {'message': 'invalid batch response from node'}
+            return [{'jsonrpc': '2.0', 'id': request_id, 'error': error} for request_id in ids]
+
+        # The node may answer a batch in any order.
+        by_id = {response.get('id'): response for response in responses if isinstance(response, dict)}
+        return [by_id.get(request_id, {'error': {'message': 'no response from node'}}) for request_id in ids]
+
+    def _send(self, request, method, retry):
+        while True:
+            try:
+                # Any error closes the socket on the way out so the next attempt connects again.
+                with self._lock, self._socket as sock:
+                    sock.sendall(request)
+                    return self._read_response(sock)
+            except (OSError, Timeout) as e:
+                self._stats.count('reconnects')
+                log_kv(LOG_WARNING, {'warning': 'lost connection to node', 'method': method, 'exception': str(e)})
+                if not retry:
+                    raise
+                retry = False
+
+    def _read_response(self, sock):
+        raw_response = b""
+        with Timeout(self.timeout) as timeout:
+            while True:
+                try:
+                    chunk = sock.recv(4096)
+                except socket.timeout:
+                    timeout.sleep(0)
+                    continue
+                if chunk == b"":
+                    raise ConnectionResetError('node closed the connection')
+
+                raw_response += chunk
+                try:
+                    return self.decode_rpc_response(raw_response)
+                except ValueError:
+                    # Partial response, keep reading.
+                    timeout.sleep(0)
+
+
+class NodeConnectionPool(object):
+    """ Small pool of Web3 connections to the node shared by every thread of a worker process
+
+    Each connection holds its own IPC socket and only serves one request at a time, so the pool lets up to size
+    threads talk to the node at once. Connections are created the first time they are handed out.
+    """
+
+    def __init__(self, ipc_location=IPC_LOCATION, size=NODE_POOL_SIZE):
+        self._ipc_location = ipc_location
+        self._size = max(1, size)
+        self._connections = []
+        self._next = 0
+        self._lock = threading.Lock()
+        self.stats = ConnectionStats()
+
+    def _connect(self):
+        from web3.middleware import geth_poa_middleware
+        w3 = Web3(ReconnectingIPCProvider(self._ipc_location, self.stats))
+
+        # Apply the 'extraData' formatting patch for working on the rinkeby network
+        w3.middleware_stack.inject(geth_poa_middleware, layer=0)
+        return w3
+
+    def get(self):
+        """ Hands out the pool's connections round robin
+
+        :return: Web3 instance
+        """
+        with self._lock:
+            if len(self._connections) < self._size:
+                try:
+                    self._connections.append(self._connect())
+                except Exception as e:
+                    raise GethException(str(e), 'Could not establish connection to node')
+                return self._connections[-1]
+
+            self._next = (self._next + 1) % self._size
+            return self._connections[self._next]
+
+
+class ContractCache(object):
+    """ Bounded LRU cache of web3 contract objects
+
+    Contract classes are keyed by a hash of the ABI json so it is only parsed once, instances by the address they are
+    bound to. Both are also keyed by the connection they were built on so each pool connection keeps its own.
+    """
+
+    def __init__(self, max_abis=CONTRACT_CACHE_ABIS, max_instances=CONTRACT_CACHE_INSTANCES):
+        self._max_abis = max_abis
+        self._max_instances = max_instances
+        self._factories = OrderedDict()
+        self._instances = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'abi_hits': 0, 'abi_misses': 0, 'instance_hits': 0, 'instance_misses': 0}
+
+    @staticmethod
+    def _lru_get(cache, key):
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+    @staticmethod
+    def _lru_put(cache, key, value, max_size):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > max_size:
+            cache.popitem(last=False)
+
+    def get_factory(self, w3, json_abi, concise=False):
+        """ Returns the contract class for the ABI, parsing the json only the first time it is seen
+
+        :param w3: Web3 connection the class talks through
+        :param json_abi: The contract's ABI as a json string
+        :param concise: True for a ConciseContract class
+        :return: Contract class
+        """
+        key = (w3, hashlib.sha1(json_abi.encode('utf8')).digest(), concise)
+        with self._lock:
+            factory = self._lru_get(self._factories, key)
+            self._stats['abi_hits' if factory is not None else 'abi_misses'] += 1
+        if factory is None:
+            factory_class = ConciseContract if concise else w3.eth.defaultContractFactory
+            factory = w3.eth.contract(abi=loads(json_abi)['abi'], ContractFactoryClass=factory_class)
+            with self._lock:
+                self._lru_put(self._factories, key, factory, self._max_abis)
+        return factory
+
+    def get_instance(self, w3, json_abi, contract_addr, concise=False):
+        """ Returns the contract bound to the address, building it from the cached class the first time
+
+        :param w3: Web3 connection the contract talks through
+        :param json_abi: The contract's ABI as a json string
+        :param contract_addr: Checksummed address of the contract
+        :param concise: True for a ConciseContract instance
+        :return: Contract instance
+        """
+        key = (w3, contract_addr, hashlib.sha1(json_abi.encode('utf8')).digest(), concise)
+        with self._lock:
+            contract = self._lru_get(self._instances, key)
+            self._stats['instance_hits' if contract is not None else 'instance_misses'] += 1
+        if contract is None:
+            contract = self.get_factory(w3, json_abi, concise)(contract_addr)
+            with self._lock:
+                self._lru_put(self._instances, key, contract, self._max_instances)
+        return contract
+
+    def stats(self):
+        """ Returns the hit and miss counters and current sizes of the cache
+
+        :return: Dictionary of counters
+        """
+        with self._lock:
+            return {**self._stats, 'abis': len(self._factories), 'instances': len(self._instances)}
+
+
+class WalletPool(object):
+    """ Funded accounts the keeper sends transactions from
+
+    The contract only lets the account that deployed it send, mint or kill its tokens, so the pool spreads work by
+    contract: each deployment goes out from the wallet with the fewest pending transactions and everything after that
+    is sent from the wallet recorded on the contract. A sender of None always means the root account.
+    """
+
+    def __init__(self, root_acct, root_password, wallets=()):
+        """
+        :param root_acct: checksummed address of the root account
+        :param root_password: password of the root account
+        :param wallets: (address, password) pairs of the other hot wallets
+        """
+        self.root = root_acct
+        self._passwords = OrderedDict([(root_acct, root_password)])
+        for address, password in wallets:
+            self._passwords[Web3.toChecksumAddress(address)] = password
+
+        self._lock = threading.Lock()
+        self._next = 0
+        self._in_flight = {address: 0 for address in self._passwords}
+
+    @classmethod
+    def from_file(cls, root_acct, root_password, path=HOT_WALLETS_FILE):
+        """ Builds the pool from a HOT_WALLETS_FILE, just the root account if there isn't one
+
+        :param root_acct: checksummed address of the root account
+        :param root_password: password of the root account
+        :param path: json file of [{"address": ..., "password": ...}, ...]
+        :return: WalletPool
+        """
+        wallets = []
+        if path:
+            with open(path) as fp:
+                wallets = [(wallet['address'], wallet['password']) for wallet in loads(fp.read())]
+        return cls(root_acct, root_password, wallets)
+
+    @property
+    def addresses(self):
+        return list(self._passwords)
+
+    def resolve(self, sender):
+        """ Returns the address and password to send from
+
+        :param sender: address recorded for the contract, None for the root account
+        :return: Tuple - (address, password)
+        """
+        address = Web3.toChecksumAddress(sender) if sender else self.root
+        try:
+            return address, self._passwords[address]
+        except KeyError:
+            raise GethException('', message='{} is not one of the configured hot wallets'.format(address))
+
+    def least_pending(self, w3):
+        """ Picks the wallet with the fewest transactions waiting to be mined
+
+        Pending counts come from the node plus the sends this process has in flight. Ties are broken round robin so an
+        idle pool still spreads new contracts over every wallet.
+
+        :param w3: Web3 connection to ask the node through
+        :return: address of the chosen wallet
+        """
+        addresses = self.addresses
+        if len(addresses) == 1:
+            return addresses[0]
+
+        pending = {address: w3.eth.getTransactionCount(address, 'pending') -
+                   w3.eth.getTransactionCount(address, 'latest') for address in addresses}
+        with self._lock:
+            start, self._next = self._next, (self._next + 1) % len(addresses)
+            ordered = addresses[start:] + addresses[:start]
+            return min(ordered, key=lambda address: pending[address] + self._in_flight[address])
+
+    @contextmanager
+    def sending(self, address):
+        """ Counts a send from the wallet as in flight for the duration of the block
+
+        :param address: wallet address
+        :return: None
+        """
+        with self._lock:
+            self._in_flight[address] = self._in_flight.get(address, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight[address] -= 1
+
+    def stats(self):
+        """ Returns the number of sends in flight from each wallet
+
+        :return: Dictionary of address to count
+        """
+        with self._lock:
+            return dict(self._in_flight)
+
+
+class GethKeeper(object):
+
+    def __init__(self, pool=None, signer=None, wallets=None, gas_oracle=None):
+        """
+        :param pool: NodeConnectionPool to talk to the node through - default: a new pool to IPC_LOCATION
+        :param signer: LocalSigner to sign transactions with - default: one when GETH_SIGNING is 'local', otherwise
+                       transactions are sent by unlocking the account on the node
+        :param wallets: WalletPool to send from - default: the root account plus any wallets in HOT_WALLETS_FILE
+        :param gas_oracle: GasOracle pricing transactions sent without a gas_price - default: one sampling this node
+        """
+        self._pool = pool if pool is not None else NodeConnectionPool()
+        self._contracts = ContractCache()
+        if signer is None and SIGNING_MODE == 'local':
+            signer = LocalSigner()
+        self._signer = signer
+
+        # Set the root funding account
+        self._root_acct = Web3.toChecksumAddress('0xff95b24806e3d93afc628c4bb684fd245e9853e9')
+        self._root_priv_key = 'jhensley1234'
+        self._wallets = wallets if wallets is not None else WalletPool.from_file(self._root_acct,
+                                                                                   self._root_priv_key)
+        self._gas_oracle = gas_oracle if gas_oracle is not None else GasOracle(self.sample_gas_prices)
+
+    @property
+    def _w3(self):
+        return self._pool.get()
+
+    def _transact(self, function, transaction, password):
+        """ Sends a transaction from transaction['from'], signed in process when the keeper has a signer
+
+        :param function: ContractFunction or ContractConstructor to call, None for a plain eth transfer
+        :param transaction: transaction parameters, must contain 'from'
+        :param password: password of the sending account
+        :return: transaction hash
+        """
+        w3 = self._w3
+        with self._wallets.sending(transaction['from']):
+            if self._signer is not None:
+                return self._signer.send(w3, function, transaction, password)
+
+            w3.personal.unlockAccount(transaction['from'], password, duration=ACCT_UNLOCK_DUR)
+            try:
+                if function is not None:
+                    return function.transact(transaction)
+                return w3.eth.sendTransaction(transaction)
+            finally:
+                w3.personal.lockAccount(transaction['from'])
+
+    def _sign(self, function, transaction, password):
+        """ Builds and signs a transaction from transaction['from'] without sending it
+
+        With a local signer the key signs in process and the nonce comes from its NonceManager. Otherwise the node
+        signs with eth_signTransaction at the account's pending nonce, so only one unsent transaction per account
+        should be signed at a time.
+
+        :param function: ContractFunction to call
+        :param transaction: transaction parameters, must contain 'from'
+        :param password: password of the sending account
+        :return: SignedSend
+        """
+        w3 = self._w3
+        if self._signer is not None:
+            return self._signer.sign(w3, function, transaction, password)
+
+        sender = transaction['from']
+        transaction = function.buildTransaction(transaction)
+        transaction.pop('chainId', None)
+        nonce = w3.eth.getTransactionCount(sender, 'pending')
+        params = {key: hex(value) if isinstance(value, int) else value
+                  for key, value in dict(transaction, nonce=nonce).items()}
+        w3.personal.unlockAccount(sender, password, duration=ACCT_UNLOCK_DUR)
         try:
-            from web3.middleware import geth_poa_middleware
-            self._w3 = Web3(IPCProvider(IPC_LOCATION))
+            raw = HexBytes(w3.manager.request_blocking('eth_signTransaction', [params])['raw'])
+        finally:
+            w3.personal.lockAccount(sender)
+        return SignedSend(sender, nonce, raw, Web3.sha3(raw))
+
+    def discard_signed(self, signed):
+        """ Gives back the nonce of a signed transaction that is never going to be sent
 
-            # Apply the 'extraData' formatting patch for working on the rinkeby network
-            self._w3.middleware_stack.inject(geth_poa_middleware, layer=0)
+        :param signed: SignedSend from _sign
+        :return: None
+        """
+        if self._signer is not None:
+            self._signer.release(signed)
+
+    def send_signed(self, signed, rebroadcast=False):
+        """ Sends a signed transaction
 
-            # Set the root funding account
-            self._root_acct = self._w3.toChecksumAddress('0xff95b24806e3d93afc628c4bb684fd245e9853e9')
-            self._root_priv_key = 'jhensley1234'
+        :param signed: SignedSend from one of the prepare methods
+        :param rebroadcast: True when the transaction may already have been sent, its nonce is then left alone
+        :return: The transaction hash, hexlified
+        :raise TransactionRejected: the node answered with an error, it did not take the transaction
+        :raise GethException: the send failed some other way, the transaction may or may not have reached the node
+        """
+        w3 = self._w3
+        try:
+            with self._wallets.sending(signed.sender):
+                if self._signer is not None and not rebroadcast:
+                    tx_hash = self._signer.send_raw(w3, signed)
+                else:
+                    tx_hash = w3.eth.sendRawTransaction(signed.raw_transaction)
+            return hexlify(tx_hash)
+        except ValueError as e:
+            if isinstance(e, JSONDecodeError):
+                raise GethException(str(e), message='Could not read the reply to a sent transaction')
+            raise TransactionRejected(str(e), message='Node rejected the transaction')
         except Exception as e:
-            raise GethException(str(e), 'Could not establish connection to node')
+            raise GethException(str(e), message='Could not send transaction')
+
+    def transaction_state(self, tx_hash):
+        """ Finds out how far a sent transaction got
+
+        :param tx_hash: transaction hash as stored in the database (hexlified, no 0x)
+        :return: 'mined', 'pending' or 'unknown' when the node has never seen it or dropped it
+        """
+        try:
+            tx_hash = unhexlify(tx_hash)
+            if self._w3.eth.getTransactionReceipt(tx_hash):
+                return 'mined'
+            return 'pending' if self._w3.eth.getTransaction(tx_hash) else 'unknown'
+        except Exception as e:
+            raise GethException(str(e), message='Could not check transaction state')
+
+    def _batch(self, calls):
+        """ Sends read only requests to the node in batches of at most RPC_BATCH_SIZE
+
+        Falls back to one request at a time when the provider can't batch.
+
+        :param calls: list of (method, params) tuples
+        :return: list of (result, error) tuples in the same order as calls, error is None on success
+        """
+        w3 = self._w3
+        provider = w3.providers[0]
+        if not hasattr(provider, 'make_batch_request'):
+            return [(w3.manager.request_blocking(method, params), None) for method, params in calls]
+
+        results = []
+        for start in range(0, len(calls), RPC_BATCH_SIZE):
+            for response in provider.make_batch_request(calls[start:start + RPC_BATCH_SIZE]):
+                if 'error' in response:
+                    results.append((None, response['error']))
+                else:
+                    results.append((response.get('result'), None))
+        return results
+
+    def connection_stats(self):
+        """ Returns the connection counters of the keeper's pool
+
+        :return: Dictionary of connects and reconnects
+        """
+        return self._pool.stats.as_dict()
+
+    def contract_cache_stats(self):
+        """ Returns the hit and miss counters of the keeper's contract cache
+
+        :return: Dictionary of counters
+        """
+        return self._contracts.stats()
+
+    def wallet_stats(self):
+        """ Returns the number of sends in flight from each hot wallet
+
+        :return: Dictionary of address to count
+        """
+        return self._wallets.stats()
+
+    def gas_prices(self):
+        """ Returns the current gas price estimates of each tier
+
+        :return: Dictionary of the price in wei of each tier, node_gas_price, sampled_transactions, source and age
+        """
+        return self._gas_oracle.estimates()
+
+    def sample_gas_prices(self, num_blocks=GAS_ORACLE_BLOCKS):
+        """ Gets the gas prices paid in the most recent blocks, and the node's own suggestion, with one batch
+
+        Transactions sent from the hot wallets are left out so the estimates don't just echo what was bid before.
+
+        :param num_blocks: number of blocks to sample
+        :return: Tuple - (list of gas prices in wei, eth_gasPrice in wei or None)
+        """
+        try:
+            head = self.block_number()
+            calls = [('eth_getBlockByNumber', [hex(number), True])
+                     for number in range(max(0, head - num_blocks + 1), head + 1)]
+            results = self._batch(calls + [('eth_gasPrice', [])])
+
+            own = {address.lower() for address in self._wallets.addresses}
+            paid = [to_integer_if_hex(tx['gasPrice'])
+                    for block, error in results[:-1] if block
+                    for tx in block['transactions'] if tx['from'].lower() not in own]
+            node_price, error = results[-1]
+            return paid, to_integer_if_hex(node_price) if error is None and node_price else None
+        except Exception as e:
+            raise GethException(str(e), message='Could not sample gas prices')
 
     def create_account(self):
         """ Creates an ethereum account and returns the account number and private key
@@ -103,7 +656,7 @@ class GethKeeper(object):
 
     def issue_contract(self, issuer_acct_num, issuer_name='', name='', symbol='TOKE', desc='',
                        img_url='', num_tokes=0, code_reqs=None, date_reqs=None, loc_reqs=None,
-                       tradable=False, metadata_uri='', gas_price=MAX_GAS_PRICE):
+                       tradable=False, metadata_uri='', gas_price=None):
         """ Creates, compiles, and deploys a smart contract with the given attributes
 
         :param issuer_acct_num: The issuer's account hash
@@ -120,42 +673,39 @@ class GethKeeper(object):
                           - default: None
         :param tradable: Boolean indicating if the token is transferrable or not - default: False
         :param metadata_uri: URI of the contract's metadata file - default: Empty String
-        :param gas_price: Willing gas price to pay - default: MAX_GAS_PRICE (2000000000)
-        :return: Tuple - (transaction_hash, json_abi) as (string, string)
+        :param gas_price: Willing gas price to pay - default: the oracle's deploy tier
+        :return: Tuple - (transaction_hash, json_abi, gas_price, sender), sender is the hot wallet that deployed the
+                 contract and has to send every later transaction on it
         """
         code_reqs = [bytes(code, 'utf8') for code in code_reqs] if code_reqs else []
         date_reqs = [int(date) for date in date_reqs] if date_reqs else []
         loc_reqs = [int(loc * 1000000) for loc in loc_reqs] if loc_reqs else []
 
         try:
-            # Compile the source code
-            contract_source_code = CONTRACT
-            compiled_sol = compile_source(contract_source_code)
-            contract_interface = compiled_sol['<stdin>:issuer_contract']
+            # Get the compiled contract, only compiles if it has never been built for this source and solc.
+            contract_interface = load_contract_interface()
 
         except Exception as e:
             raise GethException(str(e), message=str(e))
 
         try:
-            # Normalize issuer account and unlock the root account
+            # Normalize issuer account
             issuer_acct_num = self._w3.toChecksumAddress(issuer_acct_num)
-            self._w3.personal.unlockAccount(self._root_acct, self._root_priv_key, duration=ACCT_UNLOCK_DUR)
 
             # Instantiate, deploy, and get the transaction hash of the contract
             contract = self._w3.eth.contract(abi=contract_interface['abi'], bytecode=contract_interface['bin'])
 
-            # Call the constructor of the contract
-            tx_hash = contract.constructor(issuer_acct_num, issuer_name, name, symbol, desc, img_url,
-                                           num_tokes, code_reqs, date_reqs, loc_reqs, tradable, metadata_uri) \
-                .transact({'from': self._root_acct, 'gasPrice': gas_price})
-
-            # Lock the issuer's account back up and return the transaction hash
-            self._w3.personal.lockAccount(self._root_acct)
+            # Call the constructor of the contract from the least busy hot wallet
+            constructor = contract.constructor(issuer_acct_num, issuer_name, name, symbol, desc, img_url,
+                                               num_tokes, code_reqs, date_reqs, loc_reqs, tradable, metadata_uri)
+            sender, password = self._wallets.resolve(self._wallets.least_pending(self._w3))
+            gas_price = gas_price or self._gas_oracle.price('deploy')
+            tx_hash = self._transact(constructor, {'from': sender, 'gasPrice': gas_price}, password)
 
             # Create the json string of the ABI and return
             abi_dict = {'abi': contract_interface['abi']}
             json_abi = dumps(abi_dict)
-            return hexlify(tx_hash), json_abi, gas_price
+            return hexlify(tx_hash), json_abi, gas_price, sender
         except Exception as e:
             raise GethException(str(e), message=str(e))
 
@@ -196,6 +746,101 @@ class GethKeeper(object):
         except Exception as e:
             raise GethException(str(e), message='Could not check transaction receipt')
 
+    def block_number(self):
+        """ Returns the number of the most recent block the node has
+
+        :return: Integer block number
+        """
+        try:
+            return self._w3.eth.blockNumber
+        except Exception as e:
+            raise GethException(str(e), message='Could not get block number')
+
+    def get_receipts(self, tx_hashes):
+        """ Gets the receipts of many transactions with batched requests
+
+        :param tx_hashes: transaction hashes as stored in the database (hexlified, no 0x)
+        :return: list of receipts in the same order, None for transactions that are not mined yet
+        """
+        try:
+            calls = [('eth_getTransactionReceipt', ['0x' + hexlify(unhexlify(tx_hash)).decode()])
+                     for tx_hash in tx_hashes]
+            receipts = []
+            for tx_hash, (receipt, error) in zip(tx_hashes, self._batch(calls)):
+                if error is not None:
+                    log_kv(LOG_WARNING, {'warning': 'could not get transaction receipt', 'tx_hash': tx_hash,
+                                         'error': error})
+                receipts.append(receipt_formatter(receipt) if receipt else None)
+            return receipts
+        except Exception as e:
+            raise GethException(str(e), message='Could not check transaction receipts')
+
+    def get_balances(self, addresses):
+        """ Gets the eth balance of many accounts with batched requests
+
+        :param addresses: account addresses
+        :return: list of balances in ether in the same order, rounded like get_eth_balance
+        """
+        try:
+            calls = [('eth_getBalance', [self._w3.toChecksumAddress(address), 'latest']) for address in addresses]
+            balances = []
+            for result, error in self._batch(calls):
+                if error is not None:
+                    raise ValueError(error.get('message'))
+                balances.append(round(to_integer_if_hex(result) / 1000000000000000000, 8))
+            return balances
+        except Exception as e:
+            raise GethException(str(e), message='Could not get eth balances')
+
+    def owners_of(self, contract_addr, json_abi, token_ids):
+        """ Gets the owners of many tokens of a contract with batched calls
+
+        :param contract_addr: The address of the contract
+        :param json_abi: The ABI for the contract
+        :param token_ids: The token_ids of interest
+        :return: list of owner addresses in the same order, the zero address for unowned tokens
+        """
+        try:
+            contract_addr = self._w3.toChecksumAddress(contract_addr)
+            contract = self._contracts.get_instance(self._w3, json_abi, contract_addr)
+            functions = [contract.functions.getUserFromTokenID(token_id) for token_id in token_ids]
+            calls = [('eth_call', [{'to': contract_addr, 'data': function._encode_transaction_data()}, 'latest'])
+                     for function in functions]
+
+            owners = []
+            for function, (result, error) in zip(functions, self._batch(calls)):
+                if error is not None:
+                    raise ValueError(error.get('message'))
+                owner, = decode_abi(get_abi_output_types(function.abi), HexBytes(result))
+                owners.append(self._w3.toChecksumAddress(owner))
+            return owners
+        except Exception as e:
+            raise GethException(str(e), message='Could not get token owners')
+
+    def get_transfer_logs(self, contract_addrs, from_block, to_block):
+        """ Gets the Transfer events the given contracts emitted in a range of blocks
+
+        :param contract_addrs: addresses of the contracts
+        :param from_block: first block of the range
+        :param to_block: last block of the range, inclusive
+        :return: list of dictionaries with con_addr, t_id, from, to, tx_hash, block_number and log_index, in chain order
+        """
+        try:
+            logs = self._w3.eth.getLogs({'fromBlock': from_block, 'toBlock': to_block,
+                                         'address': [self._w3.toChecksumAddress(addr) for addr in contract_addrs],
+                                         'topics': [TRANSFER_TOPIC]})
+            transfers = [{'con_addr': log['address'],
+                          'from': self._w3.toChecksumAddress(log['topics'][1][-20:]),
+                          'to': self._w3.toChecksumAddress(log['topics'][2][-20:]),
+                          't_id': int.from_bytes(log['topics'][3], 'big'),
+                          'tx_hash': hexlify(log['transactionHash']),
+                          'block_number': log['blockNumber'],
+                          'log_index': log['logIndex']}
+                         for log in logs if len(log['topics']) == 4 and not log.get('removed')]
+            return sorted(transfers, key=lambda transfer: (transfer['block_number'], transfer['log_index']))
+        except Exception as e:
+            raise GethException(str(e), message='Could not get transfer logs')
+
     def get_contract_instance(self, json_abi, contract_address):
         """ Returns a read-only instance of the contract specified by the given abi at the given address
 
@@ -208,13 +853,12 @@ class GethKeeper(object):
         """
         try:
             contract_address = self._w3.toChecksumAddress(contract_address)
-            contract_abi = loads(json_abi)['abi']
-            return self._w3.eth.contract(abi=contract_abi, address=contract_address,
-                                         ContractFactoryClass=ConciseContract)
+            return self._contracts.get_instance(self._w3, json_abi, contract_address, concise=True)
         except Exception as e:
             raise GethException(str(e), message='Could not get contract instance')
 
-    def claim_token(self, contract_addr, json_abi, user_address, token_id, code=None, gas_price=MAX_GAS_PRICE):
+    def claim_token(self, contract_addr, json_abi, user_address, token_id, code=None, gas_price=None,
+                    sender=None):
         """ Function for a user to claim a token
 
         :param contract_addr: The address of the contract
@@ -222,37 +866,61 @@ class GethKeeper(object):
         :param user_address: The receiving user's address
         :param token_id: The id of the token  !!! Can't be 0 !!!
         :param code: The unique identifier the user is using to claim - default: None
-        :param gas_price: The gas price to use - default: MAX_GAS_PRICE (2000000000)
+        :param gas_price: The gas price to use - default: the oracle's claim tier
+        :param sender: The hot wallet that deployed the contract - default: None, the root account
         :return: The address of the transaction
         """
         try:
-            # Convert the addresses
-            contract_addr = self._w3.toChecksumAddress(contract_addr)
-            user_address = self._w3.toChecksumAddress(user_address)
+            function, sender, password, gas_price = self._claim_function(contract_addr, json_abi, user_address,
+                                                                         token_id, code, gas_price, sender)
+            tx_hash = self._transact(function, {'from': sender, 'gasPrice': gas_price}, password)
+            return hexlify(tx_hash), gas_price
+        except Exception as e:
+            raise GethException(str(e), message='Could not send token')
 
-            # Get the contract
-            contract_abi = loads(json_abi)['abi']
-            contract = self._w3.eth.contract(address=contract_addr, abi=contract_abi)
+    def prepare_claim(self, contract_addr, json_abi, user_address, token_id, code=None, gas_price=None,
+                      sender=None):
+        """ Signs a claim without sending it, so its hash can be recorded first. Send it with send_signed.
+
+        :param contract_addr: The address of the contract
+        :param json_abi: The contract's application binary interface as a json string
+        :param user_address: The receiving user's address
+        :param token_id: The id of the token  !!! Can't be 0 !!!
+        :param code: The unique identifier the user is using to claim - default: None
+        :param gas_price: The gas price to use - default: the oracle's claim tier
+        :param sender: The hot wallet that deployed the contract - default: None, the root account
+        :return: Tuple - (SignedSend, gas_price)
+        """
+        try:
+            function, sender, password, gas_price = self._claim_function(contract_addr, json_abi, user_address,
+                                                                         token_id, code, gas_price, sender)
+            return self._sign(function, {'from': sender, 'gasPrice': gas_price}, password), gas_price
+        except Exception as e:
+            raise GethException(str(e), message='Could not sign token claim')
 
-            # Unlock the issuers account
-            self._w3.personal.unlockAccount(self._root_acct, self._root_priv_key, duration=ACCT_UNLOCK_DUR)
+    def _claim_function(self, contract_addr, json_abi, user_address, token_id, code, gas_price, sender):
+        """ Works out the sendToken call of a claim and who sends it
 
-            # Get the claim requirements to send
-            code = bytes(code, 'utf8') if code else bytes('000000', 'utf8')
-            date = int((datetime.now() - datetime(1970, 1, 1)).total_seconds())
+        :return: Tuple - (ContractFunction, sender, password, gas_price)
+        """
+        # Convert the addresses
+        contract_addr = self._w3.toChecksumAddress(contract_addr)
+        user_address = self._w3.toChecksumAddress(user_address)
 
-            # Send the token specified by token_id to the user
-            tx_hash = contract.functions.sendToken(user_address, token_id, code, date).transact(
-                {'from': self._root_acct, 'gasPrice': gas_price})
+        # Get the contract
+        contract = self._contracts.get_instance(self._w3, json_abi, contract_addr)
 
-            # Lock the issuers account and return
-            self._w3.personal.lockAccount(self._root_acct)
-            return hexlify(tx_hash), gas_price
-        except Exception as e:
-            raise GethException(str(e), message='Could not send token')
+        # Get the claim requirements to send
+        code = bytes(code, 'utf8') if code else bytes('000000', 'utf8')
+        date = int((datetime.now() - datetime(1970, 1, 1)).total_seconds())
+
+        # Send the token specified by token_id to the user
+        sender, password = self._wallets.resolve(sender)
+        gas_price = gas_price or self._gas_oracle.price('claim')
+        return contract.functions.sendToken(user_address, token_id, code, date), sender, password, gas_price
 
     def mint_token(self, contract_addr, json_abi, token_id, collector_address=None, metadata_uri='',
-                   gas_price=MAX_GAS_PRICE):
+                   gas_price=None, sender=None):
         """ Mints a new token and optionally gives it to the given collector
 
         :param contract_addr: The address of the contract
@@ -260,7 +928,8 @@ class GethKeeper(object):
         :param token_id: The ID of the token to create
         :param collector_address: The address of the collector to receive the token - default: None
         :param metadata_uri: The URI of the token metadata - default: Empty String
-        :param gas_price: The gas_price to use in the transaction
+        :param gas_price: The gas_price to use in the transaction - default: the oracle's deploy tier
+        :param sender: The hot wallet that deployed the contract - default: None, the root account
         :return: The address of the transaction
         """
         try:
@@ -270,19 +939,16 @@ class GethKeeper(object):
                 collector_address = self._w3.toChecksumAddress(collector_address)
 
             # Get the contract
-            contract_abi = loads(json_abi)['abi']
-            contract = self._w3.eth.contract(address=contract_addr, abi=contract_abi)
-
-            # Unlock the issuers account
-            self._w3.personal.unlockAccount(self._root_acct, self._root_priv_key, duration=ACCT_UNLOCK_DUR)
+            contract = self._contracts.get_instance(self._w3, json_abi, contract_addr)
 
             # Call the mint token functions, sending to a collector if one is given
             if collector_address:
-                tx_hash = contract.functions.mint_and_send(collector_address, token_id, metadata_uri).transact(
-                    {'from': self._root_acct, 'gasPrice': gas_price})
+                function = contract.functions.mint_and_send(collector_address, token_id, metadata_uri)
             else:
-                tx_hash = contract.functions.mint(token_id, metadata_uri).transact(
-                    {'from': self._root_acct, 'gasPrice': gas_price})
+                function = contract.functions.mint(token_id, metadata_uri)
+            sender, password = self._wallets.resolve(sender)
+            gas_price = gas_price or self._gas_oracle.price('deploy')
+            tx_hash = self._transact(function, {'from': sender, 'gasPrice': gas_price}, password)
             return hexlify(tx_hash), gas_price
         except Exception as e:
             raise GethException(str(e), message='Could not mint token')
@@ -297,9 +963,7 @@ class GethKeeper(object):
         """
         contract_addr = self._w3.toChecksumAddress(contract_addr)
         try:
-            contract_abi = loads(json_abi)['abi']
-            contract = self._w3.eth.contract(address=contract_addr, abi=contract_abi,
-                                             ContractFactoryClass=ConciseContract)
+            contract = self._contracts.get_instance(self._w3, json_abi, contract_addr, concise=True)
             return contract.getUserFromTokenID(token_id)
         except Exception as e:
             raise GethException(str(e), message='Could not get an instance of the contract')
@@ -319,7 +983,7 @@ class GethKeeper(object):
             raise GethException(str(e), message='Could not get eth balance')
 
     def perform_transfer(self, contract_addr, json_abi, token_id, src_acct, dest_acct, src_priv_key=None,
-                         gas_price=MAX_GAS_PRICE):
+                         gas_price=None, sender=None):
         """ Transfers the given token from the src_acct to dest_acct
 
         :param contract_addr: The address of the contract
@@ -328,7 +992,9 @@ class GethKeeper(object):
         :param src_acct: The address of the source account
         :param dest_acct: The address of the destination account
         :param src_priv_key: The private key of the source account
-        :param gas_price: The gas_price to use
+        :param gas_price: The gas_price to use - default: the oracle's trade tier
+        :param sender: The hot wallet that deployed the contract, pays when USE_ROOT is set - default: None, the root
+                       account
         :return A touple of (addr of transaction, gas_price)
         """
         # Make sure we have the correct arguments
@@ -340,66 +1006,79 @@ class GethKeeper(object):
         try:
             contract_addr = self._w3.toChecksumAddress(contract_addr)
 
-            contract_abi = loads(json_abi)['abi']
-            contract = self._w3.eth.contract(address=contract_addr, abi=contract_abi)
-            paying_acct, paying_priv_key = (self._root_acct, self._root_priv_key) if USE_ROOT else (
-                src_acct, src_priv_key)
-            self._w3.personal.unlockAccount(paying_acct, paying_priv_key, duration=ACCT_UNLOCK_DUR)
-            tx_hash = contract.functions.safeTransferFrom(src_acct, dest_acct, token_id).transact(
-                {'from': paying_acct, 'gasPrice': gas_price})
-            self._w3.personal.lockAccount(paying_acct)
+            contract = self._contracts.get_instance(self._w3, json_abi, contract_addr)
+            paying_acct, paying_priv_key = self._wallets.resolve(sender) if USE_ROOT else (src_acct, src_priv_key)
+            gas_price = gas_price or self._gas_oracle.price('trade')
+            tx_hash = self._transact(contract.functions.safeTransferFrom(src_acct, dest_acct, token_id),
+                                     {'from': paying_acct, 'gasPrice': gas_price}, paying_priv_key)
             return hexlify(tx_hash), gas_price
         except Exception as e:
             raise GethException(str(e), message='Could not transfer token')
 
-    def send_eth(self, eth_amt, src_acct, dest_acct, src_priv_key, gas_price=MAX_GAS_PRICE):
+    def send_eth(self, eth_amt, src_acct, dest_acct, src_priv_key, gas_price=None):
         """ Sends the given eth amount to the given dest_addr from the given src_addr
 
         :param eth_amt: The amount of ethereum to send
         :param src_acct: The address of the source account
         :param dest_acct: The address of the destination account
         :param src_priv_key: The private key of the source account
-        :param gas_price: The gasPrice value to use
+        :param gas_price: The gasPrice value to use - default: the oracle's trade tier
         """
         src_acct = self._w3.toChecksumAddress(src_acct)
         dest_acct = self._w3.toChecksumAddress(dest_acct)
 
         # Perform the transfer
         try:
+            gas_price = gas_price or self._gas_oracle.price('trade')
             transaction = {
                 'to': dest_acct,
                 'from': src_acct,
                 'value': self._w3.toWei(eth_amt, 'ether'),
                 'gasPrice': gas_price
             }
-            self._w3.personal.unlockAccount(src_acct, src_priv_key, duration=ACCT_UNLOCK_DUR)
-            self._w3.eth.sendTransaction(transaction)
-            self._w3.personal.lockAccount(src_acct)
+            self._transact(None, transaction, src_priv_key)
         except Exception as e:
             raise GethException(str(e), message='Could not transfer ethereum')
 
-    def kill_contract(self, contract_addr, json_abi, gas_price=MAX_GAS_PRICE):
+    def kill_contract(self, contract_addr, json_abi, gas_price=None, sender=None):
         """ Kills the given contract
 
         :param contract_addr: The address of the contract
         :param json_abi: The contract's application binary interface as a json string
-        :param gas_price: The gas price to use - default: MAX_GAS_PRICE (2000000000)
+        :param gas_price: The gas price to use - default: the oracle's deploy tier
+        :param sender: The hot wallet that deployed the contract - default: None, the root account
         :return: The transaction hash of calling the kill function
         """
         try:
             # Get the contract
-            contract_abi = loads(json_abi)['abi']
             contract_addr = self._w3.toChecksumAddress(contract_addr)
-            contract = self._w3.eth.contract(address=contract_addr, abi=contract_abi)
-
-            # Unlock the issuers account
-            self._w3.personal.unlockAccount(self._root_acct, self._root_priv_key, duration=ACCT_UNLOCK_DUR)
+            contract = self._contracts.get_instance(self._w3, json_abi, contract_addr)
 
-            # Send the token specified by token_id to the user
-            tx_hash = contract.functions.kill().transact({'from': self._root_acct, 'gasPrice': gas_price})
-
-            # Lock the issuers account and return
-            self._w3.personal.lockAccount(self._root_acct)
+            # Kill the contract from the account that deployed it
+            sender, password = self._wallets.resolve(sender)
+            gas_price = gas_price or self._gas_oracle.price('deploy')
+            tx_hash = self._transact(contract.functions.kill(), {'from': sender, 'gasPrice': gas_price}, password)
             return hexlify(tx_hash)
         except Exception as e:
             raise GethException(str(e), message='Could not kill contract!!!')
+
+
+_keeper = None
+_keeper_pid = None
+_keeper_lock = threading.Lock()
+
+
+def get_geth_keeper():
+    """ Returns the GethKeeper of this process, creating it on first use
+
+    Forked workers each get their own keeper since sockets can't be shared across processes.
+
+    :return: GethKeeper
+    """
+    global _keeper, _keeper_pid
+    if _keeper is None or _keeper_pid != os.getpid():
+        with _keeper_lock:
+            if _keeper is None or _keeper_pid != os.getpid():
+                _keeper = GethKeeper()
+                _keeper_pid = os.getpid()
+    return _keeper
@@ -0,0 +1,234 @@
+"""
+Offline transaction signing for GethKeeper.
+
+In the default 'personal' mode every write unlocks the sending account on the node, transacts and locks it again.
+With GETH_SIGNING=local the keeper decrypts the sender's keystore file once per process, signs transactions itself
+and sends them with eth_sendRawTransaction. Nonces are handed out by a NonceManager so threads and uwsgi workers
+sending from the same account never reuse one.
+"""
+import fcntl
+import glob
+import os
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from json import JSONDecodeError, dump, load
+
+from eth_account import Account
+from web3.utils.transactions import fill_transaction_defaults
+
+from utils.utils import log_kv, LOG_INFO, LOG_WARNING
+
+SIGNING_MODE = os.getenv('GETH_SIGNING', 'personal')
+KEYSTORE_DIR = os.getenv('KEYSTORE_DIR', '/usr/apps/Ethereum/rinkeby/keystore')
+NONCE_DIR = os.getenv('NONCE_DIR', '/usr/apps/Ethereum/rinkeby/nonces')
+
+# Rinkeby. Given up front so signing never has to ask the node for net_version.
+CHAIN_ID = int(os.getenv('CHAIN_ID', 4))
+
+# Node errors that mean our nonce is behind the chain.
+STALE_NONCE_ERRORS = ('nonce too low', 'known transaction', 'replacement transaction underpriced')
+
+
+# A transaction signed in process. hash is known before it is sent, it is the keccak of raw_transaction.
+SignedSend = namedtuple('SignedSend', ['sender', 'nonce', 'raw_transaction', 'hash'])
+
+
+class NonceManager(object):
+    """ Hands out transaction nonces per account
+
+    The next nonce of each account lives in a small json file in nonce_dir, every reservation happens under an
+    exclusive flock on that file so it is shared by every thread and worker process on the host. Nonces whose
+    transaction never made it to the node are released and handed out again before new ones, so they don't leave a
+    gap that would hold up every later transaction. A nonce is only released when the node has said no to its
+    transaction, if the send fails any other way the transaction may be out there and the account is resynced instead.
+    """
+
+    def __init__(self, nonce_dir=NONCE_DIR):
+        self._nonce_dir = nonce_dir
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked_state(self, address):
+        """ Opens the nonce file of the account under an exclusive lock
+
+        :param address: account address
+        :return: the state dictionary, written back when the block exits without an error
+        """
+        os.makedirs(self._nonce_dir, exist_ok=True)
+        path = os.path.join(self._nonce_dir, '{}.json'.format(address.lower()))
+        with self._lock, open(path, 'a+') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                fp.seek(0)
+                try:
+                    state = load(fp)
+                except ValueError:
+                    state = {'next': None, 'released': []}
+
+                yield state
+
+                fp.seek(0)
+                fp.truncate()
+                dump(state, fp)
+                fp.flush()
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def reserve(self, w3, address):
+        """ Reserves the next nonce of the account
+
+        The caller gives it back with release if its transaction never reached the node.
+
+        :param w3: Web3 connection, only used the first time the account is seen or after a resync
+        :param address: account address
+        :return: the nonce to use
+        """
+        with self._locked_state(address) as state:
+            if state['released']:
+                nonce = min(state['released'])
+                state['released'].remove(nonce)
+            else:
+                if state['next'] is None:
+                    state['next'] = w3.eth.getTransactionCount(address, 'pending')
+                nonce = state['next']
+                state['next'] += 1
+        return nonce
+
+    def release(self, address, nonce):
+        """ Gives back a nonce whose transaction was never sent
+
+        :param address: account address
+        :param nonce: the nonce to give back
+        :return: None
+        """
+        with self._locked_state(address) as state:
+            if state['next'] is not None and nonce == state['next'] - 1:
+                state['next'] = nonce
+            elif state['next'] is not None and nonce < state['next'] and nonce not in state['released']:
+                state['released'].append(nonce)
+
+    def resync(self, address):
+        """ Forgets the local state of the account, the next reservation asks the node again
+
+        :param address: account address
+        :return: None
+        """
+        log_kv(LOG_WARNING, {'warning': 'resyncing nonce with node', 'address': address})
+        with self._locked_state(address) as state:
+            state['next'] = None
+            state['released'] = []
+
+
+class LocalSigner(object):
+    """ Signs transactions in process with keys decrypted from the node's keystore files
+
+    Decrypting a keystore is deliberately slow so each key is only decrypted once per process.
+    """
+
+    def __init__(self, keystore_dir=KEYSTORE_DIR, nonces=None, chain_id=CHAIN_ID):
+        self._keystore_dir = keystore_dir
+        self._nonces = nonces if nonces is not None else NonceManager()
+        self._chain_id = chain_id
+        self._keys = {}
+        self._keys_lock = threading.Lock()
+
+    def get_key(self, address, password):
+        """ Gets the private key of the account from its keystore file
+
+        :param address: account address
+        :param password: password the keystore was created with
+        :return: private key bytes
+        """
+        address = address.lower().replace('0x', '')
+        key = self._keys.get(address)
+        if key is None:
+            with self._keys_lock:
+                key = self._keys.get(address)
+                if key is None:
+                    paths = glob.glob(os.path.join(self._keystore_dir, '*--{}'.format(address)))
+                    if not paths:
+                        raise ValueError('No keystore file for account 0x{}'.format(address))
+                    with open(paths[0]) as fp:
+                        key = Account.decrypt(load(fp), password)
+                    self._keys[address] = key
+                    log_kv(LOG_INFO, {'message': 'loaded key for local signing', 'address': address})
+        return key
+
+    def sign(self, w3, function, transaction, password):
+        """ Builds and signs a transaction, reserving its nonce
+
+        The nonce stays reserved once this returns, hand the result to send_raw which decides whether to give it back.
+
+        :param w3: Web3 connection to build through
+        :param function: ContractFunction or ContractConstructor to call, None for a plain eth transfer
+        :param transaction: transaction parameters, must contain 'from'
+        :param password: password of the sending account's keystore
+        :return: SignedSend
+        """
+        sender = transaction['from']
+        key = self.get_key(sender, password)
+
+        # Fill in the gas before taking a nonce so the reservation is only held while signing and sending.
+        transaction = dict(transaction, chainId=self._chain_id)
+        if function is not None:
+            transaction = function.buildTransaction(transaction)
+        else:
+            transaction = fill_transaction_defaults(w3, transaction)
+
+        nonce = self._nonces.reserve(w3, sender)
+        try:
+            signed = w3.eth.account.signTransaction(dict(transaction, nonce=nonce), key)
+        except Exception:
+            self._nonces.release(sender, nonce)
+            raise
+        return SignedSend(sender, nonce, signed.rawTransaction, signed.hash)
+
+    def release(self, signed):
+        """ Gives back the nonce of a signed transaction that is never going to be sent
+
+        :param signed: SignedSend from sign
+        :return: None
+        """
+        self._nonces.release(signed.sender, signed.nonce)
+
+    def send_raw(self, w3, signed):
+        """ Sends a signed transaction
+
+        Only a rejection from the node gives the nonce back, unless it says the nonce is stale. Any other failure may
+        have happened after the node took the transaction, so the nonce stays used and the account is resynced with
+        the node's pending count.
+
+        :param w3: Web3 connection to send through
+        :param signed: SignedSend from sign
+        :return: transaction hash
+        """
+        try:
+            return w3.eth.sendRawTransaction(signed.raw_transaction)
+        except ValueError as e:
+            if isinstance(e, JSONDecodeError) or any(err in str(e) for err in STALE_NONCE_ERRORS):
+                self._nonces.resync(signed.sender)
+            else:
+                self._nonces.release(signed.sender, signed.nonce)
+            raise
+        except Exception:
+            self._nonces.resync(signed.sender)
+            raise
+
+    def send(self, w3, function, transaction, password):
+        """ Builds, signs and sends a transaction
+
+        :param w3: Web3 connection to send through
+        :param function: ContractFunction or ContractConstructor to call, None for a plain eth transfer
+        :param transaction: transaction parameters, must contain 'from'
+        :param password: password of the sending account's keystore
+        :return: transaction hash
+        """
+        for attempt in (1, 2):
+            try:
+                return self.send_raw(w3, self.sign(w3, function, transaction, password))
+            except ValueError as e:
+                # Someone else sent from the account (ex: the geth console), catch up with the node and try again.
+                if attempt == 2 or not any(err in str(e) for err in STALE_NONCE_ERRORS):
+                    raise
+                self._nonces.resync(transaction['from'])
@@ -0,0 +1,29 @@
+-- Secondary indexes for the hot queries in models/*.py and processes/upact.py.
+
+-- Claims: GetAvailableToken, GetTokenInfo, DoesCollectorOwnToken, GetAllQRCodes.
+CREATE INDEX IF NOT EXISTS idx_tokens_con_id_owner_c_id ON tokens(con_id, owner_c_id);
+-- Collections: GetCollection.
+CREATE INDEX IF NOT EXISTS idx_tokens_owner_c_id_status ON tokens(owner_c_id, status);
+-- upact: GetPendingTokens. Explore: GetAllTradableContracts.
+CREATE INDEX IF NOT EXISTS idx_tokens_status ON tokens(status);
+
+-- Issuer dashboard: GetContractsByIssuerID.
+CREATE INDEX IF NOT EXISTS idx_contracts_i_id ON contracts(i_id);
+-- upact: GetPendingContracts.
+CREATE INDEX IF NOT EXISTS idx_contracts_status ON contracts(status);
+
+-- upact: GetPendingTradeTRIDs.
+CREATE INDEX IF NOT EXISTS idx_trade_status ON trade(status);
+-- GetActiveTradeRequests, GetTrades.
+CREATE INDEX IF NOT EXISTS idx_trade_trader_c_id_status ON trade(trader_c_id, status);
+CREATE INDEX IF NOT EXISTS idx_trade_tradee_c_id_status ON trade(tradee_c_id, status);
+
+-- GetTradeItems, GetTradeItemsByTRID, UpdateTradeItem, UpdateTradeItemGasCost.
+CREATE INDEX IF NOT EXISTS idx_trade_item_tr_id ON trade_item(tr_id, con_id, t_id);
+-- CheckActiveTradeItem, InvalidateTradeRequests.
+CREATE INDEX IF NOT EXISTS idx_trade_item_con_id_t_id ON trade_item(con_id, t_id);
+
+-- Constraint lookups and the explore include_nearby filter.
+CREATE INDEX IF NOT EXISTS idx_location_claim_con_id ON location_claim(con_id);
+CREATE INDEX IF NOT EXISTS idx_time_claim_con_id ON time_claim(con_id);
+CREATE INDEX IF NOT EXISTS idx_unique_code_claim_con_id ON unique_code_claim(con_id);
@@ -0,0 +1,6 @@
+-- Account each transaction was sent from when the keeper has a pool of hot wallets. A contract is deployed by one
+-- wallet and every later claim, mint, transfer and kill on it has to come from that same wallet. NULL is the root
+-- account, which sent everything before the pool existed.
+ALTER TABLE contracts ADD COLUMN sender VARCHAR(42);
+ALTER TABLE tokens ADD COLUMN sender VARCHAR(42);
+ALTER TABLE trade_item ADD COLUMN sender VARCHAR(42);
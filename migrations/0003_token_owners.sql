@@ -0,0 +1,21 @@
+-- On-chain ownership kept up to date by processes/indexer.py from the contracts' Transfer events.
+CREATE TABLE IF NOT EXISTS token_owners (
+con_id INTEGER NOT NULL,
+t_id INTEGER NOT NULL,
+owner VARCHAR(42) NOT NULL,
+block_number INTEGER NOT NULL,
+log_index INTEGER NOT NULL,
+PRIMARY KEY (con_id, t_id),
+FOREIGN KEY (con_id) REFERENCES contracts(con_id)
+);
+-- Ownership lookups by wallet.
+CREATE INDEX IF NOT EXISTS idx_token_owners_owner ON token_owners(owner);
+-- Trade validation and external transfers: GetIndexedOwners.
+CREATE INDEX IF NOT EXISTS idx_token_owners_t_id ON token_owners(t_id);
+
+-- Last block the indexer has processed for each contract.
+CREATE TABLE IF NOT EXISTS indexer_checkpoints (
+con_id INTEGER PRIMARY KEY,
+block_number INTEGER NOT NULL,
+FOREIGN KEY (con_id) REFERENCES contracts(con_id)
+);
@@ -0,0 +1,30 @@
+-- Append-only provenance of every token: claims, completed trades and transfers out to external wallets.
+CREATE TABLE IF NOT EXISTS token_transfers (
+tt_id INTEGER PRIMARY KEY AUTOINCREMENT,
+con_id INTEGER NOT NULL,
+t_id INTEGER NOT NULL,
+from_c_id INTEGER,
+to_c_id INTEGER,
+to_address VARCHAR(42),
+kind CHAR(1) NOT NULL,
+tx_hash TEXT,
+tr_id INTEGER,
+ts DATE DEFAULT (strftime('%Y-%m-%d %H:%M:%S')),
+FOREIGN KEY (con_id) REFERENCES contracts(con_id),
+FOREIGN KEY (t_id) REFERENCES tokens(t_id),
+FOREIGN KEY (from_c_id) REFERENCES collectors(c_id),
+FOREIGN KEY (to_c_id) REFERENCES collectors(c_id),
+FOREIGN KEY (tr_id) REFERENCES trade(tr_id)
+);
+
+-- History is paged by tt_id, which is handed out in insert order so it follows ts and is unique for the cursor.
+-- GetTokenHistory.
+CREATE INDEX IF NOT EXISTS idx_token_transfers_con_id_t_id ON token_transfers(con_id, t_id, tt_id);
+-- GetCollectorHistory.
+CREATE INDEX IF NOT EXISTS idx_token_transfers_from_c_id ON token_transfers(from_c_id, tt_id);
+CREATE INDEX IF NOT EXISTS idx_token_transfers_to_c_id ON token_transfers(to_c_id, tt_id);
+
+CREATE TRIGGER IF NOT EXISTS token_transfers_append_only BEFORE UPDATE ON token_transfers
+BEGIN
+  SELECT RAISE(ABORT, 'token_transfers is append only');
+END;
@@ -0,0 +1,22 @@
+-- Claims waiting to be sent to the chain by processes/submitter.py. The token is reserved for the collector when the
+-- claim is queued, the submitter sends it and moves the token on to CLAIMED for upact to confirm.
+CREATE TABLE IF NOT EXISTS claim_outbox (
+cl_id INTEGER PRIMARY KEY AUTOINCREMENT,
+con_id INTEGER NOT NULL,
+t_id INTEGER NOT NULL,
+c_id INTEGER NOT NULL,
+code TEXT,
+status CHAR(1) NOT NULL DEFAULT 'Q',
+attempts INTEGER NOT NULL DEFAULT 0,
+last_error TEXT,
+tx_hash TEXT,
+queued_ts DATE DEFAULT (strftime('%Y-%m-%d %H:%M:%S')),
+next_attempt_ts DATE DEFAULT (strftime('%Y-%m-%d %H:%M:%S')),
+submitted_ts DATE,
+FOREIGN KEY (con_id) REFERENCES contracts(con_id),
+FOREIGN KEY (t_id) REFERENCES tokens(t_id),
+FOREIGN KEY (c_id) REFERENCES collectors(c_id)
+);
+
+-- GetQueuedClaims, the queue is drained in cl_id order.
+CREATE INDEX IF NOT EXISTS idx_claim_outbox_status ON claim_outbox(status, cl_id);
@@ -0,0 +1,30 @@
+-- R*Tree over the centers of the location constraints so /explore/proximity only looks at the fences in a box around
+-- the collector. Every entry is the single point of its fence's center, the triggers below keep it in step with
+-- location_claim so nothing else has to write to it.
+CREATE VIRTUAL TABLE IF NOT EXISTS location_claim_rtree USING rtree(lc_id, min_lat, max_lat, min_long, max_long);
+
+INSERT INTO location_claim_rtree(lc_id, min_lat, max_lat, min_long, max_long)
+SELECT lc_id, latitude, latitude, longitude, longitude
+FROM location_claim
+WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+  AND lc_id NOT IN (SELECT lc_id FROM location_claim_rtree);
+
+CREATE TRIGGER IF NOT EXISTS location_claim_rtree_insert AFTER INSERT ON location_claim
+WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL
+BEGIN
+  INSERT INTO location_claim_rtree(lc_id, min_lat, max_lat, min_long, max_long)
+  VALUES (new.lc_id, new.latitude, new.latitude, new.longitude, new.longitude);
+END;
+
+CREATE TRIGGER IF NOT EXISTS location_claim_rtree_update AFTER UPDATE OF latitude, longitude ON location_claim
+BEGIN
+  DELETE FROM location_claim_rtree WHERE lc_id = old.lc_id;
+  INSERT INTO location_claim_rtree(lc_id, min_lat, max_lat, min_long, max_long)
+  SELECT new.lc_id, new.latitude, new.latitude, new.longitude, new.longitude
+  WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS location_claim_rtree_delete AFTER DELETE ON location_claim
+BEGIN
+  DELETE FROM location_claim_rtree WHERE lc_id = old.lc_id;
+END;
@@ -0,0 +1,4 @@
+-- The submitter signs a claim and records it here before sending, so a claim whose send or write back failed part
+-- way is looked up by tx_hash and, if the node never got it, sent again byte for byte instead of as a new transaction.
+ALTER TABLE claim_outbox ADD COLUMN raw_tx TEXT;
+ALTER TABLE claim_outbox ADD COLUMN gas_price INTEGER;
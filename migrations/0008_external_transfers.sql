@@ -0,0 +1,18 @@
+-- Transfers out to external wallets waiting to be mined. upact appends each one to token_transfers once its receipt
+-- succeeds, so the append-only history never holds a transfer that didn't happen.
+CREATE TABLE IF NOT EXISTS external_transfers (
+et_id INTEGER PRIMARY KEY AUTOINCREMENT,
+con_id INTEGER NOT NULL,
+t_id INTEGER NOT NULL,
+from_c_id INTEGER NOT NULL,
+to_address VARCHAR(42) NOT NULL,
+tx_hash TEXT NOT NULL,
+status CHAR(1) NOT NULL DEFAULT 'P',
+ts DATE DEFAULT (strftime('%Y-%m-%d %H:%M:%S')),
+FOREIGN KEY (con_id) REFERENCES contracts(con_id),
+FOREIGN KEY (t_id) REFERENCES tokens(t_id),
+FOREIGN KEY (from_c_id) REFERENCES collectors(c_id)
+);
+
+-- GetPendingExternalTransfers.
+CREATE INDEX IF NOT EXISTS idx_external_transfers_status ON external_transfers(status, et_id);
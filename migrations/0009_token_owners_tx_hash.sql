@@ -0,0 +1,4 @@
+-- Transaction of the transfer each token_owners row was indexed from. get_chain_owners only trusts the index for a
+-- token when this is the last transaction the backend sent for it, so rows indexed before this column existed are
+-- checked on the node until their token moves again.
+ALTER TABLE token_owners ADD COLUMN tx_hash TEXT;
@@ -1,3 +1,5 @@
+from enum import Enum
+
 from marshmallow import Schema, fields
 from models.constraints import validate_code, CONSTRAINT_DATETIME_FORMAT, LocationConstraint
 
@@ -9,6 +11,15 @@ LOCATION_DOC_INFO = {
 }
 
 
+class ClaimStatus(Enum):
+    """
+    Enumeration of the states of a queued claim.
+    """
+    QUEUED = 'Q'
+    SUBMITTED = 'S'
+    FAILED = 'F'
+
+
 class Location(Schema):
     """
     Schema for simple location information.
@@ -73,6 +84,7 @@ class GetTokenInfoInternal(Schema):
     i_hash = fields.Str(dump_only=True)
     i_priv_key = fields.Str(dump_only=True)
     c_hash = fields.Str(dump_only=True)
+    sender = fields.Str(dump_only=True, allow_none=True)
 
 
 class GetAvailableTokenIDInternal(Schema):
@@ -85,15 +97,12 @@ class DoesCollectorOwnToken(DataQuery):
     Query to check if the issuer already owns a token apart of given con_id.
     """
 
-    def __init__(self):
-        self.sql_text = """
-        select * 
-        from tokens 
-        where owner_c_id = :c_id
-        and con_id = :con_id;
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    select * 
+    from tokens 
+    where owner_c_id = :c_id
+    and con_id = :con_id;
+    """
 
 
 class SetToken(DataQuery):
@@ -101,78 +110,145 @@ class SetToken(DataQuery):
     Sets up the token when an issuer has officially claimed it.
     """
 
-    def __init__(self):
-        self.sql_text = """
-        UPDATE tokens
-        SET owner_c_id = :c_id,
-          status = :new_status,
-          t_hash = :t_hash,
-          latitude = :latitude,
-          longitude = :longitude,
-          gas_price = :gas_price,
-          claim_ts = strftime('%Y-%m-%d %H:%M:%S')
-        WHERE con_id = :con_id
-          AND t_id = :t_id;
-        """
-
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    UPDATE tokens
+    SET owner_c_id = :c_id,
+      status = :new_status,
+      t_hash = :t_hash,
+      latitude = :latitude,
+      longitude = :longitude,
+      gas_price = :gas_price,
+      sender = :sender,
+      claim_ts = strftime('%Y-%m-%d %H:%M:%S')
+    WHERE con_id = :con_id
+      AND t_id = :t_id;
+    """
 
 
-class GetSingleAvailToken(DataQuery):
+class GetAvailableToken(DataQuery):
     """
     Gets an available token in the collection
     """
 
-    def __init__(self):
-        self.sql_text = """
-            SELECT t_id
-            FROM tokens
-            WHERE owner_c_id IS NULL 
-              AND con_id = :con_id
-              AND t_id = :t_id;
-        """
+    sql_text = """
+        SELECT t_id
+        FROM tokens
+        WHERE owner_c_id IS NULL 
+          AND con_id = :con_id
+        LIMIT 1;
+    """
 
-        self.schema_out = GetAvailableTokenIDInternal()
-        super().__init__()
+    schema_out = GetAvailableTokenIDInternal()
 
 
-class GetAvailableToken(DataQuery):
+class GetTokenInfo(DataQuery):
     """
-    Gets an available token in the collection
+    Gets a token's related contract and its issuer information for the ETH network
     """
 
-    def __init__(self):
-        self.sql_text = """
-            SELECT t_id
-            FROM tokens
-            WHERE owner_c_id IS NULL 
-              AND con_id = :con_id
-            LIMIT 1;
-        """
+    sql_text = """
+        SELECT t.t_id AS t_id, c.con_addr AS con_addr, c.con_abi AS con_abi, i.i_hash AS i_hash, 
+          i_priv_key AS i_priv_key, col.c_hash, c.sender AS sender
+        FROM tokens t, contracts c, issuers i, collectors col
+        WHERE  t.con_id = :con_id
+          AND t.con_id = c.con_id
+          AND c.i_id = i.i_id
+          AND c.con_addr IS NOT NULL
+          AND c.status == 'S'
+          AND t.owner_c_id IS NULL
+          AND col.c_id = :c_id;
+    """
 
-        self.schema_out = GetAvailableTokenIDInternal()
-        super().__init__()
+    schema_out = GetTokenInfoInternal()
 
 
-class GetTokenInfo(DataQuery):
+class ClaimQueuedResponse(Schema):
     """
-    Gets a token's related contract and its issuer information for the ETH network
+    Schema of the response to a claim that was queued.
+    """
+    cl_id = fields.Int()
+
+
+class ClaimStatusResponse(Schema):
+    """
+    Schema of the progress of a queued claim.
+    """
+    cl_id = fields.Int()
+    con_id = fields.Int()
+    t_id = fields.Int()
+    status = fields.Str()
+    token_status = fields.Str()
+    progress = fields.Str()
+    attempts = fields.Int()
+    last_error = fields.Str(allow_none=True)
+    tx_hash = fields.Str(allow_none=True)
+    queued_ts = fields.Str()
+    submitted_ts = fields.Str(allow_none=True)
+
+    doc_load_info = {'progress': "'queued', 'submitted', 'mined' or 'failed'"}
+
+
+class QueueAvailableToken(DataQuery):
+    """
+    Queues a claim of whichever token of the contract is still available, inserting nothing if none are left.
+
+    Being a write, the statement takes sqlite's write lock before it picks the token, so concurrent claimers on the
+    same contract always pick different tokens. Follow it with ReserveQueuedToken in the same transaction.
+    """
+
+    sql_text = """
+    INSERT INTO claim_outbox(con_id, t_id, c_id, code)
+    SELECT con_id, t_id, :c_id, :code
+    FROM tokens
+    WHERE con_id = :con_id
+      AND owner_c_id IS NULL
+    LIMIT 1;
+    """
+
+
+class QueueSingleToken(DataQuery):
+    """
+    Queues a claim of the given token if it is still available, inserting nothing otherwise. Follow it with
+    ReserveQueuedToken in the same transaction.
+    """
+
+    sql_text = """
+    INSERT INTO claim_outbox(con_id, t_id, c_id, code)
+    SELECT con_id, t_id, :c_id, :code
+    FROM tokens
+    WHERE con_id = :con_id
+      AND t_id = :t_id
+      AND owner_c_id IS NULL;
     """
 
-    def __init__(self):
-        self.sql_text = """
-            SELECT t.t_id AS t_id, c.con_addr AS con_addr, c.con_abi AS con_abi, i.i_hash AS i_hash, 
-              i_priv_key AS i_priv_key, col.c_hash
-            FROM tokens t, contracts c, issuers i, collectors col
-            WHERE  t.con_id = :con_id
-              AND t.con_id = c.con_id
-              AND c.i_id = i.i_id
-              AND c.con_addr IS NOT NULL
-              AND c.status == 'S'
-              AND t.owner_c_id IS NULL
-              AND col.c_id = :c_id;
-        """
-
-        self.schema_out = GetTokenInfoInternal()
-        super().__init__()
+
+class ReserveQueuedToken(DataQuery):
+    """
+    Reserves the token of a just queued claim for its collector while the claim waits in the outbox.
+    """
+
+    sql_text = """
+    UPDATE tokens
+    SET owner_c_id = :c_id,
+      status = :new_status,
+      latitude = :latitude,
+      longitude = :longitude,
+      claim_ts = strftime('%Y-%m-%d %H:%M:%S')
+    WHERE t_id = (SELECT t_id FROM claim_outbox WHERE cl_id = :cl_id)
+      AND owner_c_id IS NULL;
+    """
+
+
+class GetClaimStatus(DataQuery):
+    """
+    Gets a collector's queued claim along with the status of its token.
+    """
+
+    sql_text = """
+    SELECT co.cl_id, co.con_id, co.t_id, co.status, t.status AS token_status, co.attempts, co.last_error,
+      co.tx_hash, co.queued_ts, co.submitted_ts
+    FROM claim_outbox co
+    JOIN tokens t ON t.t_id = co.t_id
+    WHERE co.cl_id = :cl_id
+      AND co.c_id = :c_id;
+    """
@@ -70,70 +70,68 @@ def create_collector(user_deets):
 
 class GetCollectorByUsername(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        SELECT c_id, username
-        FROM collectors
-        WHERE username = :username
-        """
+    sql_text = """
+    SELECT c_id, username
+    FROM collectors
+    WHERE username = :username
+    """
 
-        self.schema_out = CreateCollectorRequest()
-
-        super().__init__()
+    schema_out = CreateCollectorRequest()
 
 
 class GetCollectorByCID(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        SELECT *
-        FROM collectors
-        WHERE c_id = :c_id
-        """
+    sql_text = """
+    SELECT *
+    FROM collectors
+    WHERE c_id = :c_id
+    """
+
+    schema_out = CollectorInfoRequest()
+
 
-        self.schema_out = CollectorInfoRequest()
+class GetCollectorsByCIDs(DataQuery):
 
-        super().__init__()
+    sql_text = """
+    SELECT *
+    FROM collectors
+    WHERE c_id in :c_ids
+    """
+
+    schema_out = CollectorInfoRequest()
+    expanding_binds = ('c_ids',)
 
 
 class GetCollection(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        SELECT  contracts.con_id, issuers.i_id, issuers.username as issuer_username, contracts.con_tx as con_hash,
-                contracts.name, contracts.description, contracts.num_created, contracts.pic_location, contracts.tradable,
-                contracts.status, contracts.metadata_location, tokens.t_id, tokens.t_hash, tokens.owner_c_id
-        FROM tokens, contracts, issuers
-        WHERE owner_c_id = :c_id
-        AND contracts.con_id = tokens.con_id
-        AND contracts.i_id = issuers.i_id
-        AND tokens.status != 'X';
-        """
+    sql_text = """
+    SELECT  contracts.con_id, issuers.i_id, issuers.username as issuer_username, contracts.con_tx as con_hash,
+            contracts.name, contracts.description, contracts.num_created, contracts.pic_location, contracts.tradable,
+            contracts.status, contracts.metadata_location, tokens.t_id, tokens.t_hash, tokens.owner_c_id
+    FROM tokens, contracts, issuers
+    WHERE owner_c_id = :c_id
+    AND contracts.con_id = tokens.con_id
+    AND contracts.i_id = issuers.i_id
+    AND tokens.status != 'X';
+    """
 
-        self.schema_out = TokenResponse()
-        super().__init__()
+    schema_out = TokenResponse()
 
 
 class InsertNewCollector(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        INSERT INTO collectors(username, password, c_hash, c_priv_key) 
-        values(:username, :password, :c_hash, :c_priv_key)
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    INSERT INTO collectors(username, password, c_hash, c_priv_key) 
+    values(:username, :password, :c_hash, :c_priv_key)
+    """
 
 
 class GetCollectorLoginDetails(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        SELECT username, password, c_id
-        FROM collectors
-        WHERE username = :username
-        """
-
-        self.schema_out = LoginCollectorRequest()
+    sql_text = """
+    SELECT username, password, c_id
+    FROM collectors
+    WHERE username = :username
+    """
 
-        super().__init__()
+    schema_out = LoginCollectorRequest()
@@ -1,14 +1,28 @@
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
 from datetime import datetime
 
-import mpu
 from marshmallow import Schema, fields, pre_dump
 from marshmallow.validate import ValidationError
 
 from utils.db_utils import DataQuery
+from utils.geo import FenceSet, haversine_m
 
 CONSTRAINT_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
 CODE_LENGTH = 6
 
+# Bounds of the per process cache of compiled claim constraints, in contracts and in codes, intervals and fences held.
+CONSTRAINT_CACHE_CONTRACTS = 4096
+CONSTRAINT_CACHE_ITEMS = 250000
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class ConstraintsUnavailable(Exception):
+    """ Raised when the constraints of a contract couldn't be read, so a claim is never checked against only some
+    of them """
+
 
 class ConstraintBase(Schema):
     con_id = fields.Int(required=True)
@@ -67,72 +81,264 @@ class Constraints(Schema):
 
 class GetUniqueCodeConstraints(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        select * 
-        from unique_code_claim
-        where con_id = :con_id
-        """
-        self.schema_out = UniqueCodeConstraint()
-        super().__init__()
+    sql_text = """
+    select * 
+    from unique_code_claim
+    where con_id = :con_id
+    """
+    schema_out = UniqueCodeConstraint()
 
 
 class GetTimeConstraints(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        select con_id, tc_id, start, end
-        from time_claim 
-        where con_id = :con_id
-        """
-        self.schema_out = TimeConstraint()
-        super().__init__()
+    sql_text = """
+    select con_id, tc_id, start, end
+    from time_claim 
+    where con_id = :con_id
+    """
+    schema_out = TimeConstraint()
 
 
 class GetLocationConstraints(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        select * 
-        from location_claim 
-        where con_id = :con_id
-        """
-        self.schema_out = LocationConstraint()
-        super().__init__()
+    sql_text = """
+    select * 
+    from location_claim 
+    where con_id = :con_id
+    """
+    schema_out = LocationConstraint()
 
 
-class InsertUniqueCodeConstraint(DataQuery):
+class GetUniqueCodeConstraintsMany(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        INSERT INTO unique_code_claim(con_id, code) values(:con_id, :code);
-        """
+    sql_text = """
+    select *
+    from unique_code_claim
+    where con_id in :con_ids
+    """
+    schema_out = UniqueCodeConstraint()
+    expanding_binds = ('con_ids',)
 
-        self.schema_out = None
-        super().__init__()
 
+class GetTimeConstraintsMany(DataQuery):
 
-class InsertLocationConstraint(DataQuery):
+    sql_text = """
+    select con_id, tc_id, start, end
+    from time_claim
+    where con_id in :con_ids
+    """
+    schema_out = TimeConstraint()
+    expanding_binds = ('con_ids',)
 
-    def __init__(self):
-        self.sql_text = """
-        INSERT INTO location_claim (con_id, latitude, longitude, radius) 
-        values(:con_id, :latitude, :longitude, :radius);
-        """
 
-        self.schema_out = None
-        super().__init__()
+class GetLocationConstraintsMany(DataQuery):
+
+    sql_text = """
+    select *
+    from location_claim
+    where con_id in :con_ids
+    """
+    schema_out = LocationConstraint()
+    expanding_binds = ('con_ids',)
+
+
+class GetContractExists(DataQuery):
+
+    sql_text = """
+    select con_id
+    from contracts
+    where con_id = :con_id
+    """
+
+
+class InsertUniqueCodeConstraint(DataQuery):
+
+    sql_text = """
+    INSERT INTO unique_code_claim(con_id, code) values(:con_id, :code);
+    """
+
+
+class InsertLocationConstraint(DataQuery):
+
+    sql_text = """
+    INSERT INTO location_claim (con_id, latitude, longitude, radius) 
+    values(:con_id, :latitude, :longitude, :radius);
+    """
 
 
 class InsertTimeConstraint(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        INSERT INTO time_claim(con_id, start, end) values(:con_id, :start, :end) 
+    sql_text = """
+    INSERT INTO time_claim(con_id, start, end) values(:con_id, :start, :end) 
+    """
+
+
+def to_epoch(time):
+    return (time - EPOCH).total_seconds()
+
+
+class CompiledConstraints(object):
+    """ The claim constraints of one contract, prepared so checking a claim needs no queries
+
+    **Attributes**:
+        * codes: frozenset of the codes that unlock the contract.
+        * starts, ends: the time constraints merged into disjoint intervals sorted by start, as epoch seconds.
+        * fences: FenceSet of the location constraints.
+        * size: number of codes, intervals and fences held, what the cache bounds memory by.
+    """
+
+    __slots__ = ('codes', 'starts', 'ends', 'fences', 'size')
+
+    def __init__(self, codes, intervals, locations):
+        """
+        :param codes: the codes of the unique_code_claim rows.
+        :param intervals: (start, end) epoch seconds of the time_claim rows.
+        :param locations: (latitude, longitude, radius) of the location_claim rows.
+        """
+        self.codes = frozenset(codes)
+
+        # A claim has to fall strictly inside an interval, so only intervals that overlap past a single instant merge.
+        merged = []
+        for start, end in sorted(intervals):
+            if merged and start < merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.starts = tuple(start for start, _ in merged)
+        self.ends = tuple(end for _, end in merged)
+
+        self.fences = FenceSet.from_rows(locations)
+        self.size = len(self.codes) + len(self.starts) + len(self.fences)
+
+    def check_code(self, code):
+        if not self.codes:
+            return True
+        return code is not None and code in self.codes
+
+    def check_time(self, time):
+        if not self.starts:
+            return True
+        if time is None:
+            return False
+        time = to_epoch(time)
+        # The last interval starting strictly before the claim is the only one that can hold it.
+        i = bisect_left(self.starts, time) - 1
+        return i >= 0 and time < self.ends[i]
+
+    def check_location(self, location):
+        if not len(self.fences):
+            return True
+        if not location:
+            return False
+        return self.fences.contains(location['latitude'], location['longitude'])
+
+
+def compile_constraints(con_id, sesh=None):
+    """
+    Loads and compiles the constraints of a contract.
+    :param con_id: con_id of the contract.
+    :param sesh: session to use.
+    :return: Tuple of (CompiledConstraints, True if the contract exists and the result can be cached)
+    :raises ConstraintsUnavailable: if any of the reads failed.
+    """
+    # Constraints commit with their contract, so once the contract is visible every constraint read after is too.
+    # Checked first, each read is its own snapshot and a contract issued between them could look unconstrained.
+    contract = GetContractExists().execute_n_fetchall({'con_id': con_id}, sesh=sesh, schema_out=False)
+    if contract is None:
+        raise ConstraintsUnavailable('could not check contract {} exists'.format(con_id))
+    if not contract:
+        return CompiledConstraints((), (), ()), False
+
+    binds = {'con_ids': [con_id]}
+    rows = {}
+    for key, query in (('codes', GetUniqueCodeConstraintsMany), ('times', GetTimeConstraintsMany),
+                       ('locations', GetLocationConstraintsMany)):
+        rows[key] = query().execute_n_fetchall(binds, sesh=sesh, schema_out=False)
+        if rows[key] is None:
+            raise ConstraintsUnavailable('could not read the {} constraints of contract {}'.format(key[:-1], con_id))
+
+    codes = [row['code'] for row in rows['codes']]
+    intervals = [(to_epoch(datetime.strptime(row['start'], CONSTRAINT_DATETIME_FORMAT)),
+                  to_epoch(datetime.strptime(row['end'], CONSTRAINT_DATETIME_FORMAT)))
+                 for row in rows['times']]
+    locations = [(row['latitude'], row['longitude'], row['radius']) for row in rows['locations']]
+    return CompiledConstraints(codes, intervals, locations), True
+
+
+class ConstraintCache(object):
+    """ Per process LRU cache of compiled claim constraints, keyed by con_id
+
+    Constraints are written in the same transaction as their contract and never change after, so an entry stays valid
+    for the life of the contract. Contracts that can't be seen yet are never cached, otherwise a claim racing the issue
+    of a contract could pin it to no constraints. Call invalidate if constraints are ever changed.
+    """
+
+    def __init__(self, max_contracts=CONSTRAINT_CACHE_CONTRACTS, max_items=CONSTRAINT_CACHE_ITEMS):
+        """
+        :param max_contracts: most contracts held.
+        :param max_items: most codes, intervals and fences held over every contract.
+        """
+        self._max_contracts = max_contracts
+        self._max_items = max_items
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._items = 0
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, con_id, sesh=None):
+        """
+        Returns the compiled constraints of a contract, compiling them on a miss.
+        :param con_id: con_id of the contract.
+        :param sesh: session to compile with.
+        :return: CompiledConstraints
+        :raises ConstraintsUnavailable: if they weren't cached and couldn't be read.
+        """
+        with self._lock:
+            compiled = self._entries.get(con_id)
+            if compiled is not None:
+                self._entries.move_to_end(con_id)
+                self._stats['hits'] += 1
+                return compiled
+            self._stats['misses'] += 1
+
+        compiled, cacheable = compile_constraints(con_id, sesh)
+        if cacheable and compiled.size <= self._max_items:
+            with self._lock:
+                if con_id not in self._entries:
+                    self._entries[con_id] = compiled
+                    self._items += compiled.size
+                    while len(self._entries) > self._max_contracts or self._items > self._max_items:
+                        _, evicted = self._entries.popitem(last=False)
+                        self._items -= evicted.size
+                        self._stats['evictions'] += 1
+        return compiled
+
+    def invalidate(self, con_id):
+        """
+        Drops a contract's entry so its constraints are loaded again on next use.
+        :param con_id: con_id of the contract.
+        :return: None
         """
+        with self._lock:
+            compiled = self._entries.pop(con_id, None)
+            if compiled is not None:
+                self._items -= compiled.size
 
-        self.schema_out = None
-        super().__init__()
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._items = 0
+
+    def stats(self):
+        """
+        Returns the cache counters and how much it holds.
+        :return: Dictionary of hits, misses, evictions, contracts and items
+        """
+        with self._lock:
+            return {**self._stats, 'contracts': len(self._entries), 'items': self._items}
+
+
+constraint_cache = ConstraintCache()
 
 
 def validate_uni_code_constraints(con_id, code):
@@ -142,23 +348,7 @@ def validate_uni_code_constraints(con_id, code):
     :param code: code given by collector.
     :return: Boolean if validation is successful
     """
-    # Get all possible unique code constraints
-    ucs = GetUniqueCodeConstraints().execute_n_fetchall({'con_id': con_id})
-
-    # If there are not codes associated with this contract then we are good.
-    if len(ucs) == 0:
-        return True
-
-    # If we found codes and their is no codes given then we automatically fail validation.
-    if code is None:
-        return False
-
-    # Go through and see if our code matches any.
-    valid_codes = next((t for t in ucs if code == t['code']), None)
-    if valid_codes:
-        return True
-    else:
-        return False
+    return constraint_cache.get(con_id).check_code(code)
 
 
 def validate_time_constraints(con_id, time):
@@ -168,21 +358,7 @@ def validate_time_constraints(con_id, time):
     :param time: time of attempted claim.
     :return: Boolean if validation is successful
     """
-    # Get all possible time constraints.
-    time_constraints = GetTimeConstraints().execute_n_fetchall({'con_id': con_id}, load_out=True)
-
-    if len(time_constraints) == 0:
-        return True
-
-    if time is None:
-        return False
-
-    # Go through and see if we find one. # BEAUTIFUL FIRST MATCH EXPRESSION.
-    valid_times = next((t for t in time_constraints if t['start'] < time < t['end']), None)
-    if valid_times:
-        return True
-    else:
-        return False
+    return constraint_cache.get(con_id).check_time(time)
 
 
 def validate_location_constraints(con_id, loc_constraint):
@@ -192,25 +368,7 @@ def validate_location_constraints(con_id, loc_constraint):
     :param loc_constraint: location of collector
     :return: Boolean if validation is successful
     """
-    # Get all possible location constraints.
-    location_constraints = GetLocationConstraints().execute_n_fetchall({'con_id': con_id})
-
-    if len(location_constraints) == 0:
-        return True
-
-    if not loc_constraint:
-        return False
-
-    # See if find a match.
-    valid_locations = next((l for l in location_constraints if near_enough(l['latitude'], l['longitude'],
-                                                                           loc_constraint['latitude'],
-                                                                           loc_constraint['longitude'],
-                                                                           l['radius'])),
-                           None)
-    if valid_locations:
-        return True
-    else:
-        return False
+    return constraint_cache.get(con_id).check_location(loc_constraint)
 
 
 def near_enough(dest_lat, dest_long, g_lat, g_long, radius):
@@ -223,22 +381,39 @@ def near_enough(dest_lat, dest_long, g_lat, g_long, radius):
     :param radius: maximum distance between the two points for them to be considered near.
     :return: Boolean
     """
-    if (mpu.haversine_distance((dest_lat, dest_long), (g_lat, g_long))*1000) <= radius:
-        return True
-    else:
-        return False
+    return bool(haversine_m(dest_lat, dest_long, g_lat, g_long) <= radius)
 
 
 def get_all_constraints(con_id):
     """
     This method gets all the constraints associated with a given contract.
     :param con_id: con_id to identify the contract.
-    :return: a python dictionary of the constraints.
+    :return: a python dictionary of the constraints, None if they couldn't be read.
     """
-    ucs = GetUniqueCodeConstraints().execute_n_fetchall({'con_id': con_id})
-    time_constraints = GetTimeConstraints().execute_n_fetchall({'con_id': con_id})
-    location_constraints = GetLocationConstraints().execute_n_fetchall({'con_id': con_id})
+    constraints = get_all_constraints_many([con_id])
+    return constraints[con_id] if constraints is not None else None
+
 
-    return Constraints().dump({'location_constraints': location_constraints,
-                               'time_constraints': time_constraints,
-                               'code_constraints': ucs})
\ No newline at end of file
+def get_all_constraints_many(con_ids):
+    """
+    This method gets all the constraints associated with each of the given contracts in three queries.
+    :param con_ids: con_ids to identify the contracts.
+    :return: a python dictionary of con_id to a dictionary of its constraints, None if any of the queries failed.
+    """
+    con_ids = list(set(con_ids))
+    if not con_ids:
+        return {}
+
+    grouped = {con_id: {'location_constraints': [], 'time_constraints': [], 'code_constraints': []}
+               for con_id in con_ids}
+    for key, query in (('code_constraints', GetUniqueCodeConstraintsMany),
+                       ('time_constraints', GetTimeConstraintsMany),
+                       ('location_constraints', GetLocationConstraintsMany)):
+        rows = query().execute_n_fetchall({'con_ids': con_ids})
+        if rows is None:
+            return None
+        for constraint in rows:
+            grouped[constraint['con_id']][key].append(constraint)
+
+    constraints_schema = Constraints()
+    return {con_id: constraints_schema.dump(constraints) for con_id, constraints in grouped.items()}
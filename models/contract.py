@@ -1,12 +1,16 @@
-from flask import request
-from marshmallow import Schema, fields, post_dump, post_load
+from collections import defaultdict
+
+import numpy as np
+from flask import request, g
+from marshmallow import Schema, fields, post_dump, post_load, validate
 from sqlalchemy.exc import SQLAlchemyError
 from enum import Enum
 
 from utils.db_utils import DataQuery
+from utils.geo import FenceSet, bounding_boxes, nearest_per_key
 from utils.utils import log_kv, LOG_ERROR
 from models.constraints import Constraints, InsertLocationConstraint, \
-    InsertTimeConstraint, InsertUniqueCodeConstraint, CONSTRAINT_DATETIME_FORMAT
+    InsertTimeConstraint, InsertUniqueCodeConstraint, CONSTRAINT_DATETIME_FORMAT, constraint_cache
 from models.claim import LOCATION_DOC_INFO
 
 
@@ -15,6 +19,7 @@ class TokenStatus(Enum):
     Enumeration of all the states a token can be in.
     """
     NEW = 'N'
+    QUEUED = 'Q'
     CLAIMED = 'P'
     CLAIM_MINED = 'S'
     FAILED = 'F'
@@ -114,69 +119,64 @@ class QRCode(Schema):
 
 class InsertNewContract(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        INSERT INTO contracts(i_id, con_tx, con_abi, name, description, tradable, num_created, 
-          pic_location, qr_code_claimable, gas_price, metadata_location)
-        VALUES(:i_id, :con_tx, :con_abi,  :name, :description, :tradable, :num_created, 
-          :pic_location, :qr_code_claimable, :gas_price, :metadata_location);
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    INSERT INTO contracts(i_id, con_tx, con_abi, name, description, tradable, num_created, 
+      pic_location, qr_code_claimable, gas_price, metadata_location, sender)
+    VALUES(:i_id, :con_tx, :con_abi,  :name, :description, :tradable, :num_created, 
+      :pic_location, :qr_code_claimable, :gas_price, :metadata_location, :sender);
+    """
 
 
-class InsertToken(DataQuery):
+class InsertTokens(DataQuery):
+    """ Inserts num_to_create new tokens for a contract in a single statement.
 
-    def __init__(self):
-        self.sql_text = """
-        INSERT INTO tokens(con_id, t_hash, status) values(:con_id, :tok_hash, '{}');
-        """.format(TokenStatus.NEW.value)
+    **binds**:
+        * con_id: The contract the tokens belong to.
+        * tok_hash: Placeholder hash given to every token.
+        * num_to_create: Number of tokens to insert.
+    """
 
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    WITH RECURSIVE token_num(n) AS (
+      SELECT 1
+      UNION ALL
+      SELECT n + 1 FROM token_num WHERE n < :num_to_create
+    )
+    INSERT INTO tokens(con_id, t_hash, status)
+    SELECT :con_id, :tok_hash, '{}' FROM token_num;
+    """.format(TokenStatus.NEW.value)
 
 
 class GetMetaDataByConID(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        SELECT metadata_location from contracts where con_id=:con_id;
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    SELECT metadata_location from contracts where con_id=:con_id;
+    """
 
 
 class GetAllQRCodes(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        SELECT qr_code_location from tokens where con_id=:con_id;
-        """
-        self.schema_out = QRCode()
-        super().__init__()
+    sql_text = """
+    SELECT qr_code_location from tokens where con_id=:con_id;
+    """
+    schema_out = QRCode()
 
 
 class DoesContractHaveQRCode(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        SELECT qr_code_claimable from contracts where con_id=:con_id;
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    SELECT qr_code_claimable from contracts where con_id=:con_id;
+    """
 
 class GetContractByConID(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        SELECT *
-        FROM contracts
-        WHERE con_id = :con_id
-        """
-
-        self.schema_out = GetContractResponse()
+    sql_text = """
+    SELECT *
+    FROM contracts
+    WHERE con_id = :con_id
+    """
 
-        super().__init__()
+    schema_out = GetContractResponse()
 
 
 class UpdateTokenStatus(DataQuery):
@@ -187,72 +187,72 @@ class UpdateTokenStatus(DataQuery):
         * this_id: The ID of the token
     """
 
-    def __init__(self):
-        self.sql_text = """
-        UPDATE tokens 
-        SET status = :new_status 
-        WHERE t_id = :this_id
-        """
-        super().__init__()
+    sql_text = """
+    UPDATE tokens 
+    SET status = :new_status 
+    WHERE t_id = :this_id
+    """
 
 
 class GetContractsByIssuerID(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        SELECT *
-        FROM contracts
-        WHERE i_id = :i_id
-        """
-
-        self.schema_out = GetContractResponse()
+    sql_text = """
+    SELECT *
+    FROM contracts
+    WHERE i_id = :i_id
+    """
 
-        super().__init__()
+    schema_out = GetContractResponse()
 
 
 class GetContractByName(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        SELECT *
-        FROM contracts
-        WHERE name like :name
-        """
-
-        self.schema_out = GetContractResponse()
+    sql_text = """
+    SELECT *
+    FROM contracts
+    WHERE name like :name
+    """
 
-        super().__init__()
+    schema_out = GetContractResponse()
 
 
 class GetAllContracts(DataQuery):
+    """
+    Gets all contracts for the explore page. Construct with with_keyword=True to also filter on the :keyword bind.
+
+    **binds**:
+        * include_nearby: 1 to include contracts with location constraints, 0 otherwise.
+        * keyword: Only when with_keyword. Text to look for in the name or description.
+    """
+
+    schema_out = GetContractResponse()
+
+    def __init__(self, with_keyword=False):
+        super().__init__(bool(with_keyword))
 
-    def __init__(self, keyword=None, include_nearby=0):
-        if keyword is not None:
-            self.sql_text = """
+    @classmethod
+    def build_sql(cls, with_keyword):
+        if with_keyword:
+            return """
             SELECT contracts.con_id, issuers.i_id, issuers.username as issuer_username, contracts.con_tx as con_hash,
             contracts.name, contracts.description, contracts.num_created, contracts.pic_location, contracts.tradable,
             contracts.status, contracts.qr_code_claimable, contracts.metadata_location
             FROM contracts, issuers
             WHERE contracts.i_id = issuers.i_id
-            AND (contracts.name like '%{keyword}%'
-            AND ((contracts.con_id NOT IN (SELECT con_id FROM location_claim) AND {nearby} = 0)
-              OR {nearby} = 1)
-            OR contracts.description like '%{keyword}%');
-            """.format(keyword=keyword, nearby=include_nearby)
-        else:
-            self.sql_text = """
+            AND (contracts.name like '%' || :keyword || '%'
+            AND ((contracts.con_id NOT IN (SELECT con_id FROM location_claim) AND :include_nearby = 0)
+              OR :include_nearby = 1)
+            OR contracts.description like '%' || :keyword || '%');
+            """
+        return """
             SELECT contracts.con_id, issuers.i_id, issuers.username as issuer_username, contracts.con_tx as con_hash,
             contracts.name, contracts.description, contracts.num_created, contracts.pic_location, contracts.tradable,
             contracts.status, contracts.qr_code_claimable, contracts.metadata_location
             FROM contracts, issuers
             WHERE contracts.i_id = issuers.i_id
-            AND ((contracts.con_id NOT IN (SELECT con_id FROM location_claim) AND {nearby} = 0)
-              OR {nearby} = 1);
-            """.format(nearby=include_nearby)
-
-        self.schema_out = GetContractResponse()
-
-        super().__init__()
+            AND ((contracts.con_id NOT IN (SELECT con_id FROM location_claim) AND :include_nearby = 0)
+              OR :include_nearby = 1);
+            """
 
 
 PROXIMITY_DOC_INFO = {**GET_CONTRACT_DOC,
@@ -291,42 +291,128 @@ class GetProximityContracts(Schema):
     doc_dump_info = PROXIMITY_DOC_INFO
 
 
-class GetAllContractsByProximity(DataQuery):
-    def __init__(self, keyword=None):
-        if keyword:
-            self.sql_text = """
-            SELECT min((((latitude-:latitude)*(latitude-:latitude)) 
-            + ((longitude - :longitude)*(longitude - :longitude))) * 1000)
-            as distance, radius, latitude, longitude,
-            contracts.con_id, contracts.name, contracts.description, contracts.num_created, contracts.pic_location, 
-            contracts.tradable, contracts.status, contracts.con_tx as con_hash, contracts.metadata_location,
-            issuers.username as issuer_username, issuers.i_id
-            FROM location_claim, contracts, issuers
-            WHERE location_claim.con_id = contracts.con_id
-            AND issuers.i_id = contracts.i_id
-            AND (contracts.name like '%{keyword}%'
-            OR contracts.description like '%{keyword}%')
-            GROUP BY location_claim.con_id
-            ORDER BY distance ASC;
-            """.format(keyword=keyword)
-        else:
-            self.sql_text = """
-            SELECT min((((latitude-:latitude)*(latitude-:latitude)) 
-            + ((longitude - :longitude)*(longitude - :longitude))) * 1000)
-            as distance, radius, latitude, longitude,
+# Most contracts /explore/proximity returns in one response when a limit is given.
+PROXIMITY_MAX_LIMIT = 500
+
+PROXIMITY_SEARCH_DOC_INFO = {**LOCATION_DOC_INFO,
+                             **{'radius': '(optional) only contracts with a location constraint centered within this '
+                                          'many meters.',
+                                'limit': '(optional) most contracts to return, at most {}.'.format(
+                                    PROXIMITY_MAX_LIMIT)}}
+
+
+class ProximitySearch(Schema):
+    latitude = fields.Number(required=True)
+    longitude = fields.Number(required=True)
+    radius = fields.Number(required=False, validate=validate.Range(min=0))
+    limit = fields.Int(required=False, validate=validate.Range(min=1, max=PROXIMITY_MAX_LIMIT))
+
+    doc_load_info = PROXIMITY_SEARCH_DOC_INFO
+
+
+PROXIMITY_COLUMNS = """
+            location_claim.radius, location_claim.latitude, location_claim.longitude,
             contracts.con_id, contracts.name, contracts.description, contracts.num_created, contracts.pic_location, 
             contracts.tradable, contracts.status, contracts.con_tx as con_hash, contracts.metadata_location,
-            issuers.username as issuer_username, issuers.i_id
+            issuers.username as issuer_username, issuers.i_id"""
+
+PROXIMITY_KEYWORD_CLAUSE = """
+            AND (contracts.name like '%' || :keyword || '%'
+            OR contracts.description like '%' || :keyword || '%')"""
+
+
+class GetAllContractsByProximity(DataQuery):
+    """
+    Gets every location constraint along with its contract. Distances are worked out with utils.geo by
+    contracts_by_proximity, which keeps each contract's nearest constraint.
+
+    **binds**:
+        * keyword: Only when with_keyword. Text to look for in the name or description.
+    """
+
+    schema_out = GetProximityContracts()
+
+    def __init__(self, with_keyword=False):
+        super().__init__(bool(with_keyword))
+
+    @classmethod
+    def build_sql(cls, with_keyword):
+        return """
+            SELECT {columns}
             FROM location_claim, contracts, issuers
             WHERE location_claim.con_id = contracts.con_id
-            AND issuers.i_id = contracts.i_id
-            GROUP BY location_claim.con_id
-            ORDER BY distance ASC;
-            """
+            AND issuers.i_id = contracts.i_id{keyword_clause};
+            """.format(columns=PROXIMITY_COLUMNS, keyword_clause=PROXIMITY_KEYWORD_CLAUSE if with_keyword else "")
 
-        self.schema_out = GetProximityContracts()
 
-        super().__init__()
+class GetNearbyContractsByProximity(DataQuery):
+    """
+    Gets the location constraints centered inside a box, along with their contracts. The box is looked up in
+    location_claim_rtree so only the constraints near the collector are read.
+
+    **binds**:
+        * min_lat, max_lat, min_long, max_long: The box, from utils.geo.bounding_boxes.
+        * keyword: Only when with_keyword. Text to look for in the name or description.
+    """
+
+    schema_out = GetProximityContracts()
+
+    def __init__(self, with_keyword=False):
+        super().__init__(bool(with_keyword))
+
+    @classmethod
+    def build_sql(cls, with_keyword):
+        # CROSS JOIN keeps the r-tree as the outer loop, otherwise a keyword can talk sqlite into scanning contracts.
+        return """
+            SELECT {columns}
+            FROM location_claim_rtree
+            CROSS JOIN location_claim ON location_claim.lc_id = location_claim_rtree.lc_id
+            CROSS JOIN contracts ON contracts.con_id = location_claim.con_id
+            CROSS JOIN issuers ON issuers.i_id = contracts.i_id
+            WHERE location_claim_rtree.min_lat <= :max_lat
+            AND location_claim_rtree.max_lat >= :min_lat
+            AND location_claim_rtree.min_long <= :max_long
+            AND location_claim_rtree.max_long >= :min_long{keyword_clause};
+            """.format(columns=PROXIMITY_COLUMNS, keyword_clause=PROXIMITY_KEYWORD_CLAUSE if with_keyword else "")
+
+
+def contracts_by_proximity(latitude, longitude, keyword=None, radius=None, limit=None, sesh=None):
+    """
+    Gets the contracts with a location constraint ordered by how far the given point is from their nearest one.
+    :param latitude: latitude of the collector.
+    :param longitude: longitude of the collector.
+    :param keyword: Text to look for in the name or description, None for every contract.
+    :param radius: Only contracts with a constraint centered within this many meters, None for every distance.
+    :param limit: Most contracts to return, None for all of them.
+    :param sesh: session to use.
+    :return: list of GetProximityContracts dicts, distance in meters. None if the query failed.
+    """
+    if radius is None:
+        rows = GetAllContractsByProximity(keyword).execute_n_fetchall({'keyword': keyword}, sesh=sesh,
+                                                                       schema_out=False)
+    else:
+        rows = []
+        for min_lat, max_lat, min_long, max_long in bounding_boxes(latitude, longitude, radius):
+            box_rows = GetNearbyContractsByProximity(keyword).execute_n_fetchall(
+                {'min_lat': min_lat, 'max_lat': max_lat, 'min_long': min_long, 'max_long': max_long,
+                 'keyword': keyword}, sesh=sesh, schema_out=False)
+            if box_rows is None:
+                return None
+            rows.extend(box_rows)
+    if rows is None:
+        return None
+
+    fences = FenceSet.from_rows(rows)
+    distances = fences.distances(latitude, longitude)
+    keys = np.array([row['con_id'] for row in rows], dtype=np.int64)
+    # The box holds a little more than the circle, its corners are dropped here.
+    candidates = np.flatnonzero(distances <= radius) if radius is not None else np.arange(len(rows))
+    nearest = candidates[nearest_per_key(keys[candidates], distances[candidates])][:limit]
+    contracts = []
+    for i in nearest:
+        rows[i]['distance'] = float(distances[i])
+        contracts.append(rows[i])
+    return GetAllContractsByProximity.schema_out.load(contracts, many=True)
 
 
 TRADABLE_DOC_INFO = {**GET_CONTRACT_DOC,
@@ -369,10 +455,19 @@ class TradableTokenResponse(Schema):
 
 
 class GetAllTradableContracts(DataQuery):
+    """
+    Gets all claimed tokens of tradable contracts. Construct with with_keyword=True to also filter on the :keyword bind.
+    """
+
+    schema_out = TradableTokenResponse()
+
+    def __init__(self, with_keyword=False):
+        super().__init__(bool(with_keyword))
 
-    def __init__(self, keyword=None):
-        if keyword is not None:
-            self.sql_text = """
+    @classmethod
+    def build_sql(cls, with_keyword):
+        if with_keyword:
+            return """
             SELECT issuers.i_id, issuers.username as issuer_username,
             contracts.con_tx as con_hash, contracts.name, contracts.description, contracts.num_created,
             contracts.pic_location, contracts.tradable, contracts.status, issuers.username, contracts.con_id,
@@ -386,11 +481,10 @@ class GetAllTradableContracts(DataQuery):
             AND tokens.status = 'S'
             AND tokens.owner_c_id notnull
             and tokens.owner_c_id = collectors.c_id
-            AND (contracts.name like '%{keyword}%'
-            OR contracts.description like '%{keyword}%');
-            """.format(keyword=keyword)
-        else:
-            self.sql_text = """
+            AND (contracts.name like '%' || :keyword || '%'
+            OR contracts.description like '%' || :keyword || '%');
+            """
+        return """
             SELECT issuers.i_id, issuers.username as issuer_username,
             contracts.con_tx as con_hash, contracts.name, contracts.description, contracts.num_created,
             contracts.pic_location, contracts.tradable, contracts.status, issuers.username, contracts.con_id,
@@ -405,33 +499,31 @@ class GetAllTradableContracts(DataQuery):
             AND tokens.owner_c_id notnull
             and tokens.owner_c_id = collectors.c_id;
             """
-        self.schema_out = TradableTokenResponse()
-        super().__init__()
 
 
 class GetAllContractsForEth(DataQuery):
-    def __init__(self):
-        self.sql_text = """
-            SELECT c.con_id, c.i_id, c.con_tx, c.con_addr, c.con_abi, i.username
-            FROM contracts c, issuers i 
-            WHERE c.i_id = i.i_id;
-        """
-
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+        SELECT c.con_id, c.i_id, c.con_tx, c.con_addr, c.con_abi, i.username
+        FROM contracts c, issuers i 
+        WHERE c.i_id = i.i_id;
+    """
 
 
 class UpdateQRCODE(DataQuery):
+    """ Sets the qr code location of a token. Execute with a list of binds to update many tokens at once.
+
+    **binds**:
+        * qr_code_location: filename of the saved qr code.
+        * con_id: The contract the token belongs to.
+        * t_id: The ID of the token
+    """
 
-    def __init__(self):
-        self.sql_text = """
-        UPDATE tokens
-        SET qr_code_location = :qr_code_location
-        WHERE con_id = :con_id
-        AND t_id = :t_id;
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    UPDATE tokens
+    SET qr_code_location = :qr_code_location
+    WHERE con_id = :con_id
+    AND t_id = :t_id;
+    """
 
 
 def insert_bulk_tokens(num_to_create, contract_deets, sesh):
@@ -440,20 +532,19 @@ def insert_bulk_tokens(num_to_create, contract_deets, sesh):
     :param num_to_create: Number of tokens to create off this contract.
     :param contract_deets: Details for contract creation.
     :param sesh: The database session
-    :return:
+    :return: Tuple of (con_id, range of the new t_ids)
     """
     # Insert the contract.
     InsertNewContract().execute(contract_deets, sesh=sesh)
     con_id = sesh.execute("select last_insert_rowid() as 'con_id'").fetchone()['con_id']
 
-    # Insert all token records associated with it.
-    t_ids = []
-    token_binds = {'con_id': con_id, 'tok_hash': 'temp_hash'}
-    for tok_num in range(1, num_to_create+1):
-        InsertToken().execute(token_binds, sesh=sesh)
-        t_id = sesh.execute("select last_insert_rowid() as 't_id'").fetchone()['t_id']
-        t_ids.append(t_id)
-    return con_id, t_ids
+    # Insert all token records associated with it. They come from one statement inside the transaction that holds the
+    # write lock, so the t_ids are consecutive and end at the last inserted row.
+    if num_to_create < 1:
+        return con_id, range(0)
+    InsertTokens().execute({'con_id': con_id, 'tok_hash': 'temp_hash', 'num_to_create': num_to_create}, sesh=sesh)
+    last_t_id = sesh.execute("select last_insert_rowid() as 't_id'").fetchone()['t_id']
+    return con_id, range(last_t_id - num_to_create + 1, last_t_id + 1)
 
 
 def process_constraints(constraints, con_id):
@@ -469,6 +560,37 @@ def process_constraints(constraints, con_id):
         process_time_constraints(constraints['time_constraints'], con_id)
     if 'location_constraints' in constraints:
         process_location_constraints(constraints['location_constraints'], con_id)
+    # Drop anything this worker compiled for the con_id before the constraints were written.
+    constraint_cache.invalidate(con_id)
+
+
+def insert_constraints(query, binds, con_id, kind):
+    """
+    Inserts the constraints of one kind in a single batch. If the batch fails every row is inserted again in its own
+    savepoint, so a bad row is logged and skipped without losing the rest or leaving part of the batch behind.
+    :param query: DataQuery class that inserts one constraint.
+    :param binds: binds of each constraint.
+    :param con_id: con_id of contract the constraints belong to.
+    :param kind: name of the constraint kind for the logs.
+    :return: None
+    """
+    if not binds:
+        return
+    try:
+        with g.sesh.begin_nested():
+            query().execute(binds)
+        return
+    except SQLAlchemyError as e:
+        log_kv(LOG_ERROR, {'message': 'Exception trying to add {} constraints, adding them one by one.'.format(kind),
+                           'contract_con_id': con_id, 'exception': str(e)})
+
+    for bind in binds:
+        try:
+            with g.sesh.begin_nested():
+                query().execute(bind)
+        except SQLAlchemyError as e:
+            log_kv(LOG_ERROR, {'message': 'Exception trying to add {} constraint.'.format(kind),
+                               'contract_con_id': con_id, 'exception': str(e), 'constraint': bind})
 
 
 def process_unique_code_constraints(uc_constraints, con_id):
@@ -478,13 +600,8 @@ def process_unique_code_constraints(uc_constraints, con_id):
     :param con_id: con_id of contract to associate constraints to.
     :return: None
     """
-    for uc in uc_constraints:
-        try:
-            InsertUniqueCodeConstraint().execute({'con_id': con_id, 'code': uc['code']})
-        except SQLAlchemyError as e:
-            log_kv(LOG_ERROR, {'message': 'Exception trying to add code constraint.',
-                               'contract_con_id': con_id, 'exception': str(e), 'constraints': uc_constraints})
-            continue
+    insert_constraints(InsertUniqueCodeConstraint, [{'con_id': con_id, 'code': uc['code']}
+                                                    for uc in uc_constraints or []], con_id, 'code')
 
 
 def process_time_constraints(time_constraints, con_id):
@@ -494,14 +611,10 @@ def process_time_constraints(time_constraints, con_id):
     :param con_id: con_id of contract to associate constraints to.
     :return:
     """
-    for tc in time_constraints:
-        try:
-            InsertTimeConstraint().execute({'con_id': con_id, 'start': tc['start'].strftime(CONSTRAINT_DATETIME_FORMAT),
-                                            'end': tc['end'].strftime(CONSTRAINT_DATETIME_FORMAT)})
-        except SQLAlchemyError as e:
-            log_kv(LOG_ERROR, {'message': 'Exception trying to add time constraint.', 'contract_con_id': con_id,
-                               'exception': str(e), 'constraints': time_constraints})
-            continue
+    insert_constraints(InsertTimeConstraint, [{'con_id': con_id,
+                                               'start': tc['start'].strftime(CONSTRAINT_DATETIME_FORMAT),
+                                               'end': tc['end'].strftime(CONSTRAINT_DATETIME_FORMAT)}
+                                              for tc in time_constraints or []], con_id, 'time')
 
 
 def process_location_constraints(location_constraints, con_id):
@@ -511,11 +624,70 @@ def process_location_constraints(location_constraints, con_id):
     :param con_id: con_id of contract to associate constraints to.
     :return:
     """
-    for lc in location_constraints:
-        try:
-            InsertLocationConstraint().execute({'con_id': con_id, 'latitude': lc['latitude'],
-                                                'longitude': lc['longitude'], 'radius': lc['radius']})
-        except SQLAlchemyError as e:
-            log_kv(LOG_ERROR, {'message': 'Exception trying to add location constraint.', 'contract_con_id': con_id,
-                               'exception': str(e), 'constraints': location_constraints})
-            continue
+    insert_constraints(InsertLocationConstraint, [{'con_id': con_id, 'latitude': lc['latitude'],
+                                                   'longitude': lc['longitude'], 'radius': lc['radius']}
+                                                  for lc in location_constraints or []], con_id, 'location')
+
+
+class GetIndexedOwners(DataQuery):
+    """ Gets owners from the transfer index kept by processes/indexer.py, for the tokens it is up to date on
+
+    A token is only returned when its claim is mined and the last transfer indexed for it is the last transaction the
+    backend sent for it: the latest one in its history, or its claim if it has none, with no trade transfer sent since
+    that the index hasn't seen.
+
+    **binds**:
+        * t_ids: The tokens
+        * mined: TokenStatus.CLAIM_MINED value
+    """
+
+    sql_text = """
+    SELECT o.con_id, o.t_id, o.owner
+    FROM token_owners o
+    JOIN indexer_checkpoints ic ON ic.con_id = o.con_id
+    JOIN tokens t ON t.t_id = o.t_id AND t.con_id = o.con_id
+    WHERE o.t_id in :t_ids
+      AND ic.block_number >= o.block_number
+      AND t.status = :mined
+      AND o.tx_hash = COALESCE((SELECT tt.tx_hash FROM token_transfers tt
+                                WHERE tt.con_id = o.con_id AND tt.t_id = o.t_id
+                                ORDER BY tt.tt_id DESC LIMIT 1), t.t_hash)
+      AND NOT EXISTS (SELECT 1 FROM trade_item ti
+                      WHERE ti.con_id = o.con_id AND ti.t_id = o.t_id
+                        AND ti.trade_hash IS NOT NULL
+                        AND ti.trade_hash != o.tx_hash
+                        AND ti.trade_hash NOT IN (SELECT tt.tx_hash FROM token_transfers tt
+                                                  WHERE tt.con_id = o.con_id AND tt.t_id = o.t_id
+                                                    AND tt.tx_hash IS NOT NULL))
+    """
+
+    expanding_binds = ('t_ids',)
+
+
+def get_chain_owners(tokens):
+    """
+    Gets the on-chain owner of each token. A token the transfer index in token_owners is up to date on, and that it
+    shows with the expected owner, is taken from the index. The rest are asked of the node in one batch per contract,
+    so a token that moved since the indexer's checkpoint, or that the index shows with someone else, is always checked
+    on chain.
+    :param tokens: list of dicts with con_id, t_id, con_addr, con_abi and owner, the address expected to own it.
+    :return: dict of (con_id, t_id) to owner address.
+    """
+    if not tokens:
+        return {}
+
+    rows = GetIndexedOwners().execute_n_fetchall({'t_ids': [token['t_id'] for token in tokens],
+                                                  'mined': TokenStatus.CLAIM_MINED.value}, schema_out=False)
+    indexed = {(row['con_id'], row['t_id']): row['owner'] for row in rows or []}
+
+    owners, unindexed = {}, defaultdict(list)
+    for token in tokens:
+        key = (token['con_id'], token['t_id'])
+        if key in indexed and indexed[key].upper() == token['owner'].upper():
+            owners[key] = indexed[key]
+        else:
+            unindexed[(token['con_addr'], token['con_abi'])].append(key)
+
+    for (con_addr, con_abi), keys in unindexed.items():
+        owners.update(zip(keys, g.geth.owners_of(con_addr, con_abi, [t_id for _, t_id in keys])))
+    return owners
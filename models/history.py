@@ -0,0 +1,146 @@
+from enum import Enum
+
+from marshmallow import Schema, fields
+
+from utils.db_utils import DataQuery
+
+
+class TransferKind(Enum):
+    """
+    Enumeration of the ways a token can change hands.
+    """
+    CLAIM = 'C'
+    TRADE = 'T'
+    EXTERNAL = 'E'
+
+
+class TokenTransferResponse(Schema):
+    """
+    Schema for one entry of a token's provenance.
+    """
+    tt_id = fields.Int()
+    con_id = fields.Int()
+    t_id = fields.Int()
+    from_c_id = fields.Int(allow_none=True)
+    from_username = fields.Str(allow_none=True)
+    to_c_id = fields.Int(allow_none=True)
+    to_username = fields.Str(allow_none=True)
+    to_address = fields.Str(allow_none=True)
+    kind = fields.Str()
+    tx_hash = fields.Str(allow_none=True)
+    tr_id = fields.Int(allow_none=True)
+    ts = fields.Str()
+
+
+class HistoryResponse(Schema):
+    """
+    Schema of a page of history.
+    """
+    history = fields.Nested(TokenTransferResponse, many=True)
+    next_cursor = fields.Int(allow_none=True)
+
+
+def token_transfer_binds(con_id, t_id, kind, from_c_id=None, to_c_id=None, to_address=None, tx_hash=None,
+                         tr_id=None):
+    """
+    Builds the binds of one InsertTokenTransfer.
+    :param con_id: con_id of the token.
+    :param t_id: t_id of the token.
+    :param kind: TransferKind value.
+    :param from_c_id: collector the token left, None for claims.
+    :param to_c_id: collector the token went to, None for external transfers.
+    :param to_address: wallet an external transfer went to.
+    :param tx_hash: hash of the transaction that moved the token.
+    :param tr_id: trade the transfer was part of.
+    :return: dict of binds.
+    """
+    return {'con_id': con_id, 't_id': t_id, 'kind': kind, 'from_c_id': from_c_id, 'to_c_id': to_c_id,
+            'to_address': to_address, 'tx_hash': tx_hash, 'tr_id': tr_id}
+
+
+class InsertTokenTransfer(DataQuery):
+    """
+    Appends to the provenance of a token. Build the binds with token_transfer_binds.
+    """
+
+    sql_text = """
+    INSERT INTO token_transfers(con_id, t_id, from_c_id, to_c_id, to_address, kind, tx_hash, tr_id)
+    VALUES (:con_id, :t_id, :from_c_id, :to_c_id, :to_address, :kind, :tx_hash, :tr_id);
+    """
+
+
+HISTORY_SELECT = """
+    SELECT tt.tt_id, tt.con_id, tt.t_id, tt.from_c_id, f.username AS from_username, tt.to_c_id,
+      t.username AS to_username, tt.to_address, tt.kind, tt.tx_hash, tt.tr_id, tt.ts
+    FROM token_transfers tt
+    LEFT JOIN collectors f ON f.c_id = tt.from_c_id
+    LEFT JOIN collectors t ON t.c_id = tt.to_c_id
+"""
+
+
+class GetTokenHistory(DataQuery):
+    """
+    Gets a page of a token's provenance, oldest first.
+
+    **binds**:
+        * con_id, t_id: The token
+        * cursor: tt_id the previous page ended on, 0 for the first page
+        * limit: Maximum number of entries
+    """
+
+    sql_text = HISTORY_SELECT + """
+    WHERE tt.con_id = :con_id
+      AND tt.t_id = :t_id
+      AND tt.tt_id > :cursor
+    ORDER BY tt.tt_id
+    LIMIT :limit;
+    """
+
+    schema_out = TokenTransferResponse()
+
+
+class GetCollectorHistory(DataQuery):
+    """
+    Gets a page of every transfer into or out of a collector's collection, oldest first.
+
+    **binds**:
+        * c_id: The collector
+        * cursor: tt_id the previous page ended on, 0 for the first page
+        * limit: Maximum number of entries
+    """
+
+    # Each side reads at most one page in tt_id order off its own index, so only two pages are ever sorted rather than
+    # the collector's whole history.
+    sql_text = HISTORY_SELECT + """
+    WHERE tt.tt_id IN (
+      SELECT tt_id FROM (
+        SELECT tt_id FROM token_transfers WHERE from_c_id = :c_id AND tt_id > :cursor ORDER BY tt_id LIMIT :limit)
+      UNION ALL
+      SELECT tt_id FROM (
+        SELECT tt_id FROM token_transfers WHERE to_c_id = :c_id AND tt_id > :cursor ORDER BY tt_id LIMIT :limit))
+    ORDER BY tt.tt_id
+    LIMIT :limit;
+    """
+
+    schema_out = TokenTransferResponse()
+
+
+def get_history_page(query, binds, cursor, limit):
+    """
+    Gets one page of history.
+    :param query: GetTokenHistory or GetCollectorHistory instance.
+    :param binds: binds identifying the token or collector.
+    :param cursor: tt_id the previous page ended on, 0 for the first page.
+    :param limit: Maximum number of entries to return.
+    :return: Tuple of (list of entries, cursor for the next page or None if this is the last page), None if the query
+    failed.
+    """
+    # Ask for one extra entry to know if there is another page.
+    history = query.execute_n_fetchall({**binds, 'cursor': cursor, 'limit': limit + 1})
+    if history is None:
+        return None
+    next_cursor = None
+    if len(history) > limit:
+        history = history[:limit]
+        next_cursor = history[-1]['tt_id']
+    return history, next_cursor
@@ -48,55 +48,32 @@ class LoginIssuerRequest(Schema):
 
 class GetIssuerInfo(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        SELECT *
-        FROM issuers
-        WHERE i_id = :i_id
-        """
-
-        self.schema_out = IssuerInternalInfo()
+    sql_text = """
+    SELECT *
+    FROM issuers
+    WHERE i_id = :i_id
+    """
 
-        super().__init__()
+    schema_out = IssuerInternalInfo()
 
 
 class InsertNewIssuer(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        INSERT INTO issuers(username, password, i_hash, i_priv_key) 
-        values(:username, :password, :i_hash, :i_priv_key)
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    INSERT INTO issuers(username, password, i_hash, i_priv_key) 
+    values(:username, :password, :i_hash, :i_priv_key)
+    """
 
 
 class GetIssuerByUsername(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        SELECT i_id, username
-        FROM issuers
-        WHERE username = :username
-        """
-
-        self.schema_out = CreateIssuerRequest()
-
-        super().__init__()
-
-
-class GetIssuerByIID(DataQuery):
-
-    def __init__(self):
-        self.sql_text = """
-        SELECT *
-        FROM issuers
-        WHERE i_id = :i_id
-        """
-
-        self.schema_out = IssuerInfoRequest()
+    sql_text = """
+    SELECT i_id, username
+    FROM issuers
+    WHERE username = :username
+    """
 
-        super().__init__()
+    schema_out = CreateIssuerRequest()
 
 
 class IssuerInfoRequest(Schema):
@@ -106,15 +83,23 @@ class IssuerInfoRequest(Schema):
     i_priv_key = fields.Str(required=True)
 
 
-class GetIssuerLoginDetails(DataQuery):
+class GetIssuerByIID(DataQuery):
+
+    sql_text = """
+    SELECT *
+    FROM issuers
+    WHERE i_id = :i_id
+    """
 
-    def __init__(self):
-        self.sql_text = """
-        SELECT *
-        FROM issuers
-        WHERE username = :username
-        """
+    schema_out = IssuerInfoRequest()
 
-        self.schema_out = LoginIssuerRequest()
 
-        super().__init__()
+class GetIssuerLoginDetails(DataQuery):
+
+    sql_text = """
+    SELECT *
+    FROM issuers
+    WHERE username = :username
+    """
+
+    schema_out = LoginIssuerRequest()
@@ -6,7 +6,8 @@ from ether.geth_keeper import GethException
 from utils.db_utils import DataQuery
 from utils.utils import log_kv, LOG_INFO
 
-from models.collector import TokenResponse, CollectorInfoRequest
+from models.collector import TokenResponse, CollectorInfoRequest, GetCollectorsByCIDs
+from models.contract import get_chain_owners
 
 
 class TradeStatus(Enum):
@@ -106,33 +107,36 @@ class TradeRequest(Schema):
     doc_load_info = TRADE_REQUEST_DOC
 
 
-def check_active_trade_item(c_id, con_id, t_id):
+def get_active_trade_items(c_id, trade_items):
     """
-    Checks to see user already has an active trade containing token.
+    Finds the tokens the collector already has up in another active trade request, in one query.
     :param c_id: c_id of collector who's trades to look at.
-    :param con_id: contract token should be under.
-    :param t_id: token to see if active.
-    :return: Boolean representing tokens active status in another trade.
+    :param trade_items: list of dicts with the con_id and t_id of each token to check.
+    :return: list of (con_id, t_id) of every token already in an active trade.
     """
-    if CheckActiveTradeItem().execute_n_fetchone({'c_id': c_id, 'con_id': con_id, 't_id': t_id}, schema_out=False):
-        return True
-    else:
-        return False
+    if not trade_items:
+        return []
 
+    active = GetActiveTradeItems().execute_n_fetchall({'c_id': c_id,
+                                                       't_ids': list({t_i['t_id'] for t_i in trade_items})},
+                                                      schema_out=False)
+    active = {(a['con_id'], a['t_id']) for a in active}
+    return [(t_i['con_id'], t_i['t_id']) for t_i in trade_items if (t_i['con_id'], t_i['t_id']) in active]
 
-def check_trade_item_ownership(c_id, con_id, t_id):
+
+def get_unowned_trade_items(trade_items):
     """
-    This method checks to ensure given c_id own s a token with a given con_id,
-    and t_id.
-    :param c_id: c_id of collector to ensure has ownership.
-    :param con_id: con_id that token should be under.
-    :param t_id: t_id that the collector should have ownership over.
-    :return: Boolean that represents ownership status.
+    Finds the trade items whose token is not currently owned by the items owner, in one query.
+    :param trade_items: list of dicts with the con_id, t_id and owner (c_id that should own the token) of each item.
+    :return: list of the trade items that failed the ownership check.
     """
-    if CheckOwnership().execute_n_fetchone({'c_id': c_id, 'con_id': con_id, 't_id': t_id}, schema_out=False):
-        return True
-    else:
-        return False
+    if not trade_items:
+        return []
+
+    owners = GetTokenOwners().execute_n_fetchall({'t_ids': list({t_i['t_id'] for t_i in trade_items})},
+                                                 schema_out=False)
+    owners = {(o['con_id'], o['t_id']): o['owner_c_id'] for o in owners}
+    return [t_i for t_i in trade_items if owners.get((t_i['con_id'], t_i['t_id'])) != t_i['owner']]
 
 
 def create_trade_request(tr):
@@ -160,6 +164,61 @@ def create_trade_request(tr):
     return tr_id
 
 
+def get_trade_listing(c_id, version, cursor, limit):
+    """
+    Builds a page of the collectors active trades in the TradeResponse shape. Always runs three queries: the trades,
+    the tokens of all their trade items and the collectors on either side.
+    :param c_id: c_id of collector who's trades to get.
+    :param version: 'tradee', 'trader' or None for both sides.
+    :param cursor: tr_id the previous page ended on, 0 for the first page.
+    :param limit: Maximum number of trades to return.
+    :return: Tuple of (list of trades, cursor for the next page or None if this is the last page), None if any of the
+    queries failed.
+    """
+    # Ask for one extra trade to know if there is another page.
+    trades = GetActiveTradeRequests(version).execute_n_fetchall({'c_id': c_id, 'cursor': cursor, 'limit': limit + 1},
+                                                                schema_out=False)
+    if trades is None:
+        return None
+    next_cursor = None
+    if len(trades) > limit:
+        trades = trades[:limit]
+        next_cursor = trades[-1]['tr_id']
+    if not trades:
+        return [], next_cursor
+
+    # Get the token info of every trade item grouped by trade.
+    items_by_trade = {trade['tr_id']: [] for trade in trades}
+    items = GetTradeItemTokens().execute_n_fetchall({'tr_ids': list(items_by_trade)}, schema_out=False)
+    if items is None:
+        return None
+    for item in items:
+        items_by_trade[item['tr_id']].append(item)
+
+    # Get every collector on either side of the trades.
+    c_ids = {trade['trader_c_id'] for trade in trades} | {trade['tradee_c_id'] for trade in trades}
+    collectors = GetCollectorsByCIDs().execute_n_fetchall({'c_ids': list(c_ids)})
+    if collectors is None:
+        return None
+    collectors = {c['c_id']: c for c in collectors}
+
+    token_schema = GetTradeItemTokens.token_schema
+    listing = []
+    for trade in trades:
+        trade_items = items_by_trade[trade['tr_id']]
+        trader_offers = [t_i for t_i in trade_items if t_i['owner'] == trade['trader_c_id']]
+        tradee_offers = [t_i for t_i in trade_items if t_i['owner'] == trade['tradee_c_id']]
+        listing.append({
+            'trader': {'collector': collectors.get(trade['trader_c_id']), 'eth_offer': trade['trader_eth_offer'],
+                       'offers': token_schema.dump(trader_offers, many=True)},
+            'tradee': {'collector': collectors.get(trade['tradee_c_id']), 'eth_offer': trade['tradee_eth_offer'],
+                       'offers': token_schema.dump(tradee_offers, many=True)},
+            'status': trade['status'], 'tr_id': trade['tr_id']
+        })
+
+    return TradeResponse().load(listing, many=True), next_cursor
+
+
 def is_valid_trade_items(trade_items):
     """
     Go through each trade item and ensure that the owners of the tokens are the same when the initial trade was
@@ -167,18 +226,14 @@ def is_valid_trade_items(trade_items):
     :param trade_items: list of trade_item db records.
     :return: Boolean representing validity of trade.
     """
-    # Go through each token and ensure it is owned by the correct collector.
-    for trade_item in trade_items:
-
-        # If we find a token in which the owner has changed then we have found an invalid trade request.
-        if not check_trade_item_ownership(trade_item['owner'], trade_item['con_id'], trade_item['t_id']):
-                log_kv(LOG_INFO, {'info': 'Owner of token has changed',
-                                  'previous_owner_c_id': trade_item['owner'], 'con_id': trade_item['con_id'],
-                                  't_id': trade_item['t_id']})
+    # If we find a token in which the owner has changed then we have found an invalid trade request.
+    unowned = get_unowned_trade_items(trade_items)
+    for trade_item in unowned:
+        log_kv(LOG_INFO, {'info': 'Owner of token has changed',
+                          'previous_owner_c_id': trade_item['owner'], 'con_id': trade_item['con_id'],
+                          't_id': trade_item['t_id']})
 
-                return False
-
-    return True
+    return len(unowned) == 0
 
 
 def validate_offer_and_trade(trade_items, tradee_id, trader_id, trader_eth_offer):
@@ -205,18 +260,30 @@ def validate_offer_and_trade(trade_items, tradee_id, trader_id, trader_eth_offer
         if balance <= trader_eth_offer:
             raise GethException('', message='Trader does not have enough eth to cover the trade')
 
+    # Get the contract of every token at once.
+    contracts = {row['t_id']: row for row in GetContractInfo().execute_n_fetchall(
+        {'t_ids': [item['t_id'] for item in trade_items]}, schema_out=False) or []}
+    for item in trade_items:
+        if item['t_id'] not in contracts:
+            raise GethException('', message='Could not get contract info for token_id {t_id}'.format(t_id=item['t_id']))
+
+    # Get the on-chain owners of every token, from the transfer index where it is up to date and otherwise one batched
+    # call per contract.
+    owners = get_chain_owners([{'con_id': item['con_id'], 't_id': item['t_id'],
+                                'con_addr': contracts[item['t_id']]['addr'], 'con_abi': contracts[item['t_id']]['abi'],
+                                'owner': tradee_acct if item['owner'] == tradee_id else trader_acct}
+                               for item in trade_items])
+
     # Validate the token offers and store them for the final transferring
     transfers = []
     for item in trade_items:
         acct, key = (tradee_acct, tradee_key) if item['owner'] == tradee_id else (trader_acct, trader_key)
         to_acct = tradee_acct if acct != tradee_acct else trader_acct
-        contract_info = GetContractInfo().execute_n_fetchone({'t_id': item['t_id']}, schema_out=False)
-        if not contract_info:
-            raise GethException('', message='Could not get contract info for token_id {t_id}'.format(t_id=item['t_id']))
+        contract_info = contracts[item['t_id']]
 
-        # Get the contract addr and abi and make sure the account owns the token
+        # Make sure the account owns the token
         con_addr, con_abi = contract_info['addr'], contract_info['abi']
-        owner = g.geth.get_user_from_token_id(con_addr, con_abi, item['t_id'])
+        owner = owners[(item['con_id'], item['t_id'])]
         if acct.upper() != owner.upper():
             raise GethException('', message='Account {acct} does not own token {t_id}'
                                 .format(acct=acct, t_id=item['t_id']))
@@ -230,7 +297,8 @@ def validate_offer_and_trade(trade_items, tradee_id, trader_id, trader_eth_offer
             'con_abi': con_abi,
             'token_id': item['t_id'],
             'con_id': item['con_id'],
-            'tr_id': item['tr_id']
+            'tr_id': item['tr_id'],
+            'sender': contract_info['sender']
         })
 
     # Perform the eth transfer
@@ -246,10 +314,10 @@ def validate_offer_and_trade(trade_items, tradee_id, trader_id, trader_eth_offer
             trade_hash, gas_price = g.geth.perform_transfer(transfer['con_addr'], transfer['con_abi'],
                                                             transfer['token_id'],
                                                             src_acct=transfer['from'], dest_acct=transfer['to'],
-                                                            src_priv_key=transfer['key'])
+                                                            src_priv_key=transfer['key'], sender=transfer['sender'])
             UpdateTradeItem().execute({'tr_id': transfer['tr_id'], 'con_id': transfer['con_id'],
                                        't_id': transfer['token_id'], 'trade_hash': trade_hash ,
-                                       'gas_price': gas_price})
+                                       'gas_price': gas_price, 'sender': transfer['sender']})
         except Exception as e:
             raise GethException(str(e), message='Could not perform token transfer for token_id {t_id}'
                                 .format(t_id=transfer['token_id']))
@@ -257,232 +325,241 @@ def validate_offer_and_trade(trade_items, tradee_id, trader_id, trader_eth_offer
 
 class UpdateTradeItem(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        UPDATE trade_item
-        SET trade_hash = :trade_hash,
-        gas_price = :gas_price
-        WHERE tr_id = :tr_id
-        AND con_id = :con_id
-        AND t_id = :t_id
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    UPDATE trade_item
+    SET trade_hash = :trade_hash,
+    gas_price = :gas_price,
+    sender = :sender
+    WHERE tr_id = :tr_id
+    AND con_id = :con_id
+    AND t_id = :t_id
+    """
 
 
 class GetContractInfo(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-            SELECT c.con_abi AS abi, c.con_addr AS addr
-            FROM contracts c, tokens t
-            WHERE c.con_id = t.con_id
-              AND t.t_id = :t_id;
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+        SELECT t.t_id, c.con_abi AS abi, c.con_addr AS addr, c.sender AS sender
+        FROM contracts c, tokens t
+        WHERE c.con_id = t.con_id
+          AND t.t_id in :t_ids;
+    """
+
+    expanding_binds = ('t_ids',)
 
 
 class GetTraderInfo(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-            SELECT c_hash AS address, c_priv_key AS priv_key
-            FROM collectors 
-            WHERE c_id = :c_id;
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+        SELECT c_hash AS address, c_priv_key AS priv_key
+        FROM collectors 
+        WHERE c_id = :c_id;
+    """
 
 
 class GetTradeItems(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        select * from trade_item where tr_id = :tr_id;
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    select * from trade_item where tr_id = :tr_id;
+    """
 
 
-class CheckActiveTradeItem(DataQuery):
+class GetActiveTradeItems(DataQuery):
+    """
+    Gets the tokens out of the :t_ids list the collector has put up in a requested trade.
+    """
 
-    def __init__(self):
-        self.sql_text = """
-        select * from trade_item, trade
-        where trade_item.tr_id = trade.tr_id
-        and status = '{}'
-        and trader_c_id = :c_id
-        and con_id = :con_id
-        and t_id = :t_id
-        and owner = :c_id;
-        """.format(TradeStatus.REQUESTED.value)
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    select trade_item.con_id, trade_item.t_id from trade_item, trade
+    where trade_item.tr_id = trade.tr_id
+    and status = '{}'
+    and trader_c_id = :c_id
+    and t_id in :t_ids
+    and owner = :c_id;
+    """.format(TradeStatus.REQUESTED.value)
+    expanding_binds = ('t_ids',)
 
 
-class CheckOwnership(DataQuery):
+class GetTokenOwners(DataQuery):
+    """
+    Gets the current owner of each claimed token out of the :t_ids list.
+    """
 
-    def __init__(self):
-        self.sql_text = """
-        select * from tokens 
-        where t_id = :t_id
-        and owner_c_id = :c_id
-        and con_id = :con_id
-        and status = 'S'
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    select con_id, t_id, owner_c_id from tokens 
+    where t_id in :t_ids
+    and status = 'S'
+    """
+    expanding_binds = ('t_ids',)
 
 
 class InsertTrade(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        INSERT INTO trade(trader_c_id, tradee_c_id, trader_eth_offer, tradee_eth_offer)
-        values (:trader_c_id, :tradee_c_id, :trader_eth_offer, :tradee_eth_offer);
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    INSERT INTO trade(trader_c_id, tradee_c_id, trader_eth_offer, tradee_eth_offer)
+    values (:trader_c_id, :tradee_c_id, :trader_eth_offer, :tradee_eth_offer);
+    """
 
 
 class InsertTradeItem(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        INSERT INTO trade_item(tr_id, con_id, t_id, owner)
-        values (:tr_id, :con_id, :t_id, :owner);
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    INSERT INTO trade_item(tr_id, con_id, t_id, owner)
+    values (:tr_id, :con_id, :t_id, :owner);
+    """
 
 
 class GetTrades(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        select trade_item.tr_id, trade_item.owner,
-        contracts.con_id, contracts.name,
-        tokens.t_id, tokens.owner_c_id
-        from trade, trade_item, contracts, tokens
-        where trade_item.tr_id in (select trade.tr_id from trade where trader_c_id = :c_id)
-        and contracts.con_id = trade_item.con_id
-        and tokens.t_id = trade_item.t_id
-        and trade.tr_id = trade_item.tr_id
-        and trade.status != 'I';
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    select trade_item.tr_id, trade_item.owner,
+    contracts.con_id, contracts.name,
+    tokens.t_id, tokens.owner_c_id
+    from trade, trade_item, contracts, tokens
+    where trade_item.tr_id in (select trade.tr_id from trade where trader_c_id = :c_id)
+    and contracts.con_id = trade_item.con_id
+    and tokens.t_id = trade_item.t_id
+    and trade.tr_id = trade_item.tr_id
+    and trade.status != 'I';
+    """
 
 
 class GetTradeByTRID(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        select * from trade
-        where trade.tr_id = :tr_id
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    select * from trade
+    where trade.tr_id = :tr_id
+    """
 
 
 class UpdateTradeStatus(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        update trade
-        set status = :new_status
-        where trade.tr_id = :tr_id;
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    update trade
+    set status = :new_status
+    where trade.tr_id = :tr_id;
+    """
 
 
 class InvalidateTradeRequests(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        update trade
-        set status = 'I'
-        where trade.tr_id  in (select trd.tr_id from trade trd, trade_item
-                                                where trd.tr_id = trade_item.tr_id
-                                                and trade_item.t_id = :t_id
-                                                and trade_item.con_id = :con_id
-                                                and trd.status = 'R');
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    update trade
+    set status = 'I'
+    where trade.tr_id  in (select trd.tr_id from trade trd, trade_item
+                                            where trd.tr_id = trade_item.tr_id
+                                            and trade_item.t_id = :t_id
+                                            and trade_item.con_id = :con_id
+                                            and trd.status = 'R');
+    """
 
 
 class GetActiveTradeRequests(DataQuery):
+    """
+    Gets a page of the collectors active trades ordered by tr_id. version is 'tradee', 'trader' or None for both sides.
+
+    **binds**:
+        * c_id: The collector whose trades to get.
+        * cursor: Only trades with a tr_id greater than this are returned. 0 for the first page.
+        * limit: Maximum number of trades to return.
+    """
 
     def __init__(self, version):
+        super().__init__(version)
+
+    @classmethod
+    def build_sql(cls, version):
         if version == 'tradee':
-            self.sql_text = """
-            select tr_id from trade 
+            return """
+            select * from trade 
             where tradee_c_id = :c_id
-            and status in ('R', 'A', 'W');
+            and status in ('R', 'A', 'W')
+            and tr_id > :cursor
+            order by tr_id
+            limit :limit;
             """
         elif version == 'trader':
-            self.sql_text = """
-            select tr_id from trade 
+            return """
+            select * from trade 
             where trader_c_id = :c_id
-            and status in ('R', 'A', 'W');
+            and status in ('R', 'A', 'W')
+            and tr_id > :cursor
+            order by tr_id
+            limit :limit;
             """
         else:
-            self.sql_text = """
-            select tr_id from trade 
+            return """
+            select * from trade 
             where (trader_c_id = :c_id
             or tradee_c_id = :c_id)
-            and status in ('R', 'A', 'W');
+            and status in ('R', 'A', 'W')
+            and tr_id > :cursor
+            order by tr_id
+            limit :limit;
             """
-        self.schema_out = None
-        super().__init__()
+
+
+class GetTradeItemTokens(DataQuery):
+    """
+    Gets the token info of every trade item in the :tr_ids list along with the tr_id and owner of the item.
+    """
+
+    sql_text = """
+    SELECT  trade_item.tr_id, trade_item.owner,
+            contracts.con_id, issuers.i_id, issuers.username as issuer_username, contracts.con_tx as con_hash,
+            contracts.name, contracts.description, contracts.num_created, contracts.pic_location, contracts.tradable,
+            contracts.status, contracts.metadata_location, contracts.qr_code_claimable,
+            tokens.t_id, tokens.t_hash, tokens.owner_c_id
+    FROM trade_item, tokens, contracts, issuers
+    WHERE trade_item.tr_id in :tr_ids
+    AND tokens.t_id = trade_item.t_id
+    AND contracts.con_id = trade_item.con_id
+    AND contracts.con_id = tokens.con_id
+    AND contracts.i_id = issuers.i_id
+    ORDER BY trade_item.tr_id, trade_item.rowid;
+    """
+    expanding_binds = ('tr_ids',)
+
+    # Rows carry tr_id and owner for grouping, so they are dumped per side of the trade with this instead of schema_out.
+    token_schema = TokenResponse()
 
 
 class UpdateOwnership(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        update tokens
-        set owner_c_id = :new_owner
-        where con_id = :con_id
-        and t_id = :t_id
-        and owner_c_id = :prev_owner;
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    update tokens
+    set owner_c_id = :new_owner
+    where con_id = :con_id
+    and t_id = :t_id
+    and owner_c_id = :prev_owner;
+    """
 
 
 class GetUntradables(DataQuery):
     """
-    This Data Query has a weird format as I needed to bind a list of integers.
+    Gets the con_ids out of the :con_ids list that are not tradable.
     """
 
-    def __init__(self, con_ids):
-        self.sql_text = """
-        select con_id from contracts 
-        where con_id in (%s)
-        and tradable = 0;
-        """ % ",".join(str(x) for x in con_ids)
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    select con_id from contracts 
+    where con_id in :con_ids
+    and tradable = 0;
+    """
+    expanding_binds = ('con_ids',)
 
 
 class GetTokenInfo(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        SELECT  contracts.con_id, issuers.i_id, issuers.username as issuer_username, contracts.con_tx as con_hash,
-                contracts.name, contracts.description, contracts.num_created, contracts.pic_location, contracts.tradable,
-                contracts.status, contracts.metadata_location, contracts.qr_code_claimable,
-                tokens.t_id, tokens.t_hash, tokens.owner_c_id
-        FROM tokens, contracts, issuers
-        WHERE tokens.t_id = :t_id
-        AND contracts.con_id = :con_id
-        AND contracts.con_id = tokens.con_id
-        AND contracts.i_id = issuers.i_id;
-        """
-
-        self.schema_out = TokenResponse()
-        super().__init__()
\ No newline at end of file
+    sql_text = """
+    SELECT  contracts.con_id, issuers.i_id, issuers.username as issuer_username, contracts.con_tx as con_hash,
+            contracts.name, contracts.description, contracts.num_created, contracts.pic_location, contracts.tradable,
+            contracts.status, contracts.metadata_location, contracts.qr_code_claimable,
+            tokens.t_id, tokens.t_hash, tokens.owner_c_id
+    FROM tokens, contracts, issuers
+    WHERE tokens.t_id = :t_id
+    AND contracts.con_id = :con_id
+    AND contracts.con_id = tokens.con_id
+    AND contracts.i_id = issuers.i_id;
+    """
+
+    schema_out = TokenResponse()
\ No newline at end of file
@@ -1,7 +1,37 @@
+from enum import Enum
+
 from marshmallow import Schema, fields
 
+from utils.db_utils import DataQuery
+
+
+class ExternalTransferStatus(Enum):
+    """
+    Enumeration of all the states a transfer to an external wallet can be in.
+    """
+    PENDING = 'P'
+    MINED = 'S'
+    FAILED = 'F'
+
 
 class ExternalTransfer(Schema):
     con_id = fields.Int(required=True)
     t_id = fields.Int(required=True)
-    destination_wallet_hash = fields.Str(required=True)
\ No newline at end of file
+    destination_wallet_hash = fields.Str(required=True)
+
+
+class InsertExternalTransfer(DataQuery):
+    """
+    Records a transfer to an external wallet that has been sent, upact adds it to the token's history once mined.
+
+    **binds**:
+        * con_id, t_id: The token
+        * from_c_id: Collector the token is leaving
+        * to_address: Wallet the token is sent to
+        * tx_hash: Hash of the transfer transaction
+    """
+
+    sql_text = """
+    INSERT INTO external_transfers(con_id, t_id, from_c_id, to_address, tx_hash)
+    VALUES (:con_id, :t_id, :from_c_id, :to_address, :tx_hash);
+    """
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+"""
+Runs EXPLAIN QUERY PLAN over every DataQuery in models/*.py, processes/upact.py and processes/indexer.py against a
+freshly migrated database and fails if any of them scans a whole table that it is not expected to.
+
+usage: python check_query_plans.py
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, '/usr/apps/token/backend/backend/')
+
+from sqlalchemy.engine import create_engine
+
+from processes.migrate import migrate
+from utils.db_utils import DataQuery
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUERY_MODULES = ['models.claim', 'models.collector', 'models.constraints', 'models.contract', 'models.history',
+                 'models.issuer', 'models.trade', 'models.transfer', 'processes.upact', 'processes.indexer',
+                 'processes.submitter']
+
+# Queries that return (or filter with a leading wildcard like over) every row of a table by design.
+ALLOWED_SCANS = {
+    'GetAllContracts': {'contracts'},
+    'GetAllContractsByProximity': {'location_claim'},
+    'GetAllContractsForEth': {'c'},
+    'GetContractByName': {'contracts'},
+    'GetIndexedContracts': {'c'},
+    # token_num is the generated series of new tokens. The trade_item, token_transfers, claim_outbox and
+    # external_transfers scans are sqlite's foreign key bookkeeping for inserts into a parent table, they only run while
+    # there are outstanding deferred violations.
+    'InsertTokens': {'token_num', 'trade_item', 'token_transfers', 'claim_outbox', 'external_transfers'},
+}
+
+# Constructor arguments of every variant of queries that override build_sql.
+QUERY_VARIANTS = {
+    'GetActiveTradeRequests': [('tradee',), ('trader',), (None,)],
+    'GetAllContracts': [(False,), (True,)],
+    'GetAllContractsByProximity': [(False,), (True,)],
+    'GetAllTradableContracts': [(False,), (True,)],
+    'GetNearbyContractsByProximity': [(False,), (True,)],
+}
+
+
+def get_queries():
+    """
+    Imports the query modules and gathers every DataQuery subclass defined in them.
+    :return: list of DataQuery classes.
+    """
+    for module in QUERY_MODULES:
+        __import__(module)
+
+    queries, to_visit = [], list(DataQuery.__subclasses__())
+    while to_visit:
+        query = to_visit.pop()
+        to_visit.extend(query.__subclasses__())
+        if query.__module__ in QUERY_MODULES:
+            queries.append(query)
+    return sorted(queries, key=lambda q: (q.__module__, q.__name__))
+
+
+def get_statements(query):
+    """
+    Gets the sql of every variant of the query.
+    :param query: DataQuery class.
+    :return: list of (label, sql_text)
+    """
+    if query.__name__ in QUERY_VARIANTS:
+        return [('{}{}'.format(query.__name__, variant), query.get_variant(*variant)[1])
+                for variant in QUERY_VARIANTS[query.__name__]]
+    if query.sql_text is None:
+        raise ValueError('{} builds its sql but has no entry in QUERY_VARIANTS'.format(query.__name__))
+    return [(query.__name__, query.sql_text)]
+
+
+def get_table_scans(con, query, sql_text):
+    """
+    Explains the sql and finds any full table scans.
+    :param con: sqlalchemy connection.
+    :param query: DataQuery class the sql belongs to.
+    :param sql_text: sql to explain.
+    :return: Tuple of (list of plan details, list of scanned tables)
+    """
+    statement = query.compile('EXPLAIN QUERY PLAN ' + sql_text.strip())
+    binds = {name: [1] if name in query.expanding_binds else 1 for name in statement._bindparams}
+    details = [row['detail'] for row in con.execute(statement, binds).fetchall()]
+
+    scans = []
+    for detail in details:
+        words = detail.split()
+        # Subqueries are reported as SUBQUERY n by older sqlite and (subquery-n) by newer ones.
+        # Virtual tables report SCAN even when their own index does the lookup, e.g. an r-tree searched by its
+        # coordinates is VIRTUAL TABLE INDEX 2:B0D1B2D3. Only an index with no constraints after the colon is a scan.
+        if 'VIRTUAL TABLE INDEX' in detail and not detail.rstrip().endswith(':'):
+            continue
+        if (len(words) >= 2 and words[0] == 'SCAN' and words[1] not in ('CONSTANT', 'SUBQUERY')
+                and not words[1].startswith('(subquery-')):
+            scans.append(words[1])
+    return details, scans
+
+
+def check_query_plans():
+    """
+    Checks the plan of every query.
+    :return: list of (label, unexpected scans, plan details) for the failing queries.
+    """
+    fd, path = tempfile.mkstemp(prefix='toker_plans_', suffix='.db')
+    os.close(fd)
+    try:
+        with open(os.path.join(ROOT_PATH, 'create_statements.sql')) as fp:
+            raw = sqlite3.connect(path)
+            raw.executescript(fp.read())
+            raw.close()
+
+        engine = create_engine('sqlite:///' + path)
+        migrate(engine)
+
+        failures = []
+        with engine.connect() as con:
+            for query in get_queries():
+                for label, sql_text in get_statements(query):
+                    details, scans = get_table_scans(con, query, sql_text)
+                    unexpected = [s for s in scans if s not in ALLOWED_SCANS.get(query.__name__, set())]
+                    print('{} {}'.format('FULL SCAN' if unexpected else 'ok'.ljust(9), label))
+                    if unexpected:
+                        failures.append((label, unexpected, details))
+        return failures
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    failed = check_query_plans()
+    for failed_label, failed_scans, plan in failed:
+        print('\n{} scans {}:\n  {}'.format(failed_label, ', '.join(failed_scans), '\n  '.join(plan)))
+    sys.exit(1 if failed else 0)
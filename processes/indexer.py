@@ -0,0 +1,184 @@
+#!/usr/bin/python
+"""
+Indexes the Transfer events of every deployed contract into the token_owners table.
+
+usage: python indexer.py [--daemon]
+
+Logs are pulled with eth_getLogs in ranges of INDEXER_BLOCK_RANGE blocks, for up to ADDRESSES_PER_FILTER contracts per
+request, and only up to INDEXER_CONFIRMATIONS blocks behind the head so a short reorg never reaches the table. The last
+block processed for each contract is checkpointed in indexer_checkpoints, a new contract starts at the block it was
+deployed in. Without arguments the indexer catches up to the head once and exits, with --daemon it keeps following the
+chain until it gets SIGTERM or SIGINT.
+"""
+import signal
+import sys
+import threading
+
+ROOT_PATH = '/usr/apps/token/backend/backend/'
+sys.path.insert(0, ROOT_PATH)
+from utils.db_utils import DataQuery, configure_sqlite_pragmas
+from ether.geth_keeper import get_geth_keeper
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine import create_engine
+from utils.setup_utils import load_config
+from utils.utils import log_kv, LOG_ERROR, LOG_INFO
+
+# Created in main so the queries below can be imported without a node.
+geth = None
+
+INDEXER_BLOCK_RANGE = 5000
+INDEXER_CONFIRMATIONS = 6
+ADDRESSES_PER_FILTER = 100
+
+# Seconds the daemon waits before looking for new blocks again once caught up.
+POLL_INTERVAL = 15
+
+# Creating session for querying. The pragma profile is configured in main before the first connection.
+Session = sessionmaker()
+engine = create_engine('sqlite:////usr/apps/token/backend/backend/temp.db')
+Session.configure(bind=engine)
+
+
+class GetIndexedContracts(DataQuery):
+    """ Gets every deployed contract along with the last block indexed for it, NULL if it was never indexed """
+
+    sql_text = """
+    SELECT c.con_id, c.con_addr, c.con_tx, ic.block_number AS checkpoint
+    FROM contracts c
+    LEFT JOIN indexer_checkpoints ic ON ic.con_id = c.con_id
+    WHERE c.con_addr IS NOT NULL
+    """
+
+
+class SetTokenOwner(DataQuery):
+    """ Records the owner a token was transferred to
+
+    **binds**:
+        * con_id: The contract of the token
+        * t_id: The token id
+        * owner: Address the token was sent to
+        * tx_hash: Transaction of the transfer
+        * block_number: Block the transfer was mined in
+        * log_index: Position of the event in the block
+    """
+
+    sql_text = """
+    INSERT OR REPLACE INTO token_owners(con_id, t_id, owner, tx_hash, block_number, log_index)
+    VALUES (:con_id, :t_id, :owner, :tx_hash, :block_number, :log_index)
+    """
+
+
+class SetCheckpoint(DataQuery):
+    """ Records the last block indexed for a contract """
+
+    sql_text = """
+    INSERT OR REPLACE INTO indexer_checkpoints(con_id, block_number)
+    VALUES (:con_id, :block_number)
+    """
+
+
+def start_new_contracts(rows):
+    """ Gives contracts that were never indexed a checkpoint just before the block they were deployed in
+    :param rows: rows from GetIndexedContracts, updated in place.
+    :return: None
+    """
+    new = [row for row in rows if row['checkpoint'] is None]
+    if new:
+        for row, receipt in zip(new, geth.get_receipts([row['con_tx'] for row in new])):
+            if receipt is not None:
+                row['checkpoint'] = receipt['blockNumber'] - 1
+
+
+def index_range(rows, from_block, to_block, sess):
+    """ Indexes the transfers of the given contracts in a range of blocks and moves their checkpoints to to_block
+    :param rows: contracts to index.
+    :param from_block: first block of the range.
+    :param to_block: last block of the range.
+    :param sess: session to use.
+    :return: number of transfers indexed.
+    """
+    con_ids = {row['con_addr'].lower(): row['con_id'] for row in rows}
+    owner_binds = []
+    for start in range(0, len(rows), ADDRESSES_PER_FILTER):
+        addresses = [row['con_addr'] for row in rows[start:start + ADDRESSES_PER_FILTER]]
+        for transfer in geth.get_transfer_logs(addresses, from_block, to_block):
+            owner_binds.append({'con_id': con_ids[transfer['con_addr'].lower()], 't_id': transfer['t_id'],
+                                'owner': transfer['to'], 'tx_hash': transfer['tx_hash'],
+                                'block_number': transfer['block_number'],
+                                'log_index': transfer['log_index']})
+
+    # Transfers are in chain order so the last one written for a token is its current owner.
+    if owner_binds:
+        SetTokenOwner().execute(owner_binds, sesh=sess)
+    SetCheckpoint().execute([{'con_id': row['con_id'], 'block_number': to_block} for row in rows], sesh=sess)
+    sess.commit()
+    return len(owner_binds)
+
+
+def index_once():
+    """ Indexes one range of blocks for every contract that is behind the head
+    :return: True once every contract is caught up.
+    """
+    head = geth.block_number() - INDEXER_CONFIRMATIONS
+    sess = Session()
+    try:
+        rows = GetIndexedContracts().execute_n_fetchall({}, sess, schema_out=False) or []
+        start_new_contracts(rows)
+
+        # Contracts sitting at the same checkpoint are indexed together, new ones catch up on their own.
+        groups = {}
+        for row in rows:
+            if row['checkpoint'] is not None and row['checkpoint'] < head:
+                groups.setdefault(row['checkpoint'], []).append(row)
+
+        caught_up = True
+        for checkpoint, group in sorted(groups.items()):
+            to_block = min(checkpoint + INDEXER_BLOCK_RANGE, head)
+            indexed = index_range(group, checkpoint + 1, to_block, sess)
+            print('Indexed {n} transfers of {c} contracts - blocks {f} to {t}'.format(n=indexed, c=len(group),
+                                                                                      f=checkpoint + 1, t=to_block))
+            caught_up = caught_up and to_block == head
+        return caught_up
+    except Exception:
+        sess.rollback()
+        raise
+    finally:
+        sess.close()
+
+
+def run_daemon(stop, poll_interval=POLL_INTERVAL):
+    """ Keeps the index caught up with the chain until stop is set
+    :param stop: threading.Event that ends the loop, set by the SIGTERM handler.
+    :param poll_interval: seconds to wait once caught up, or after an error.
+    :return: None
+    """
+    while not stop.is_set():
+        try:
+            if not index_once():
+                continue
+        except Exception as e:
+            log_kv(LOG_ERROR, {'error': 'indexing failed', 'exception': str(e)}, exception=True)
+        stop.wait(poll_interval)
+
+
+def main(daemon=False):
+    global geth
+    configure_sqlite_pragmas(load_config(ROOT_PATH).get('SQLITE_PRAGMAS'))
+    geth = get_geth_keeper()
+
+    if not daemon:
+        print('running indexer')
+        while not index_once():
+            pass
+    else:
+        log_kv(LOG_INFO, {'message': 'indexer daemon starting'})
+        stop = threading.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda signum, frame: stop.set())
+        run_daemon(stop)
+
+    log_kv(LOG_INFO, {'message': 'indexer finished', 'node_connections': geth.connection_stats()})
+
+
+if __name__ == '__main__':
+    main(daemon='--daemon' in sys.argv[1:])
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+"""
+Applies the versioned migrations in /migrations to a sqlite database in place.
+
+The schema version is kept in sqlite's user_version pragma. A database built from create_statements.sql starts at
+version 0 and every migration file named <version>_<name>.sql with a higher version is applied in order, each in its
+own transaction along with the version bump.
+
+usage: python migrate.py [database_uri]
+"""
+import os
+import re
+import sys
+
+sys.path.insert(0, '/usr/apps/token/backend/backend/')
+
+from sqlalchemy.engine import create_engine
+
+DEFAULT_DATABASE_URI = 'sqlite:////usr/apps/token/backend/backend/temp.db'
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+MIGRATION_FILE = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+
+def get_migrations(migrations_dir=MIGRATIONS_DIR):
+    """
+    Lists all migrations in the migrations directory.
+    :param migrations_dir: directory to look in.
+    :return: list of (version, name, path) ordered by version.
+    """
+    migrations = []
+    for file_name in os.listdir(migrations_dir):
+        match = MIGRATION_FILE.match(file_name)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(migrations_dir, file_name)))
+    return sorted(migrations)
+
+
+def get_version(con):
+    """
+    Gets the schema version of the database.
+    :param con: dbapi connection.
+    :return: integer version.
+    """
+    return con.execute('PRAGMA user_version;').fetchone()[0]
+
+
+def migrate(engine, target=None):
+    """
+    Brings the database up to the target version.
+    :param engine: engine of the database to migrate.
+    :param target: version to stop at, latest if not given.
+    :return: list of versions applied.
+    """
+    applied = []
+    con = engine.raw_connection()
+    try:
+        version = get_version(con)
+        for m_version, name, path in get_migrations():
+            if m_version <= version or (target is not None and m_version > target):
+                continue
+
+            print('Applying migration {:04d}_{}'.format(m_version, name))
+            with open(path) as fp:
+                script = fp.read()
+
+            try:
+                con.executescript('BEGIN;\n{}\nPRAGMA user_version = {};\nCOMMIT;'.format(script, m_version))
+            except Exception:
+                con.rollback()
+                raise
+            applied.append(m_version)
+    finally:
+        con.close()
+    return applied
+
+
+if __name__ == '__main__':
+    db_engine = create_engine(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DATABASE_URI)
+    versions = migrate(db_engine)
+    print('MIGRATED TO VERSION {}'.format(versions[-1]) if versions else 'ALREADY UP TO DATE')
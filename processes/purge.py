@@ -1,13 +1,18 @@
 #!/usr/bin/python
 import sys
 
-sys.path.insert(0, '/usr/apps/token/backend/backend/')
+ROOT_PATH = '/usr/apps/token/backend/backend/'
+sys.path.insert(0, ROOT_PATH)
 
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.engine import create_engine
 from sqlalchemy.sql import text
 
+from utils.db_utils import configure_sqlite_pragmas
+from utils.setup_utils import load_config
+
 # Creating session for querying.
+configure_sqlite_pragmas(load_config(ROOT_PATH).get('SQLITE_PRAGMAS'))
 Session = sessionmaker()
 engine = create_engine('sqlite:////usr/apps/token/backend/backend/temp.db')
 Session.configure(bind=engine)
@@ -16,6 +21,11 @@ Session.configure(bind=engine)
 def purge():
     sess = Session()
     commands = [
+        'delete from token_owners;',
+        'delete from indexer_checkpoints;',
+        'delete from token_transfers;',
+        'delete from external_transfers;',
+        'delete from claim_outbox;',
         'delete from issuers;',
         'delete from collectors;',
         'delete from contracts;',
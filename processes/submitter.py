@@ -0,0 +1,424 @@
+#!/usr/bin/python
+"""
+Sends the claims queued in claim_outbox to the chain.
+
+usage: python submitter.py [--daemon]
+
+Up to SUBMIT_BATCH_SIZE claims are taken from the queue at a time in the order they were queued. Claims on contracts
+deployed by the same hot wallet are sent one after another, so each wallet's nonces follow the queue, while the
+wallets themselves send in parallel.
+
+Every claim is signed and its transaction recorded in claim_outbox before it is sent. A claim that comes back round
+with a recorded transaction, because its send or the write back failed part way, is never signed again: if the node
+has the transaction mined or pending it counts as sent, otherwise the same bytes are sent again. Only a claim the node
+rejected outright is signed afresh, after RETRY_BASE_DELAY seconds doubling every attempt, and after
+MAX_CLAIM_ATTEMPTS rejections it fails and its token is released. Claims whose send is in doubt are checked again on
+the same back off but never given up on, the transaction may still be mined.
+
+Each batch is written back in one transaction, sent claims move their token on to CLAIMED for upact to confirm.
+Without arguments the queue is drained once, with --daemon the submitter keeps draining it until it gets SIGTERM or
+SIGINT.
+"""
+import os
+import signal
+import sys
+import threading
+from binascii import hexlify, unhexlify
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT_PATH = '/usr/apps/token/backend/backend/'
+sys.path.insert(0, ROOT_PATH)
+from utils.db_utils import DataQuery, configure_sqlite_pragmas
+from ether.geth_keeper import get_geth_keeper, TransactionRejected
+from ether.signing import SignedSend
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine import create_engine
+from utils.setup_utils import load_config
+from utils.utils import log_kv, LOG_ERROR, LOG_INFO, LOG_WARNING
+from models.claim import ClaimStatus
+from models.contract import TokenStatus
+
+# Created in main so the queries below can be imported without a node.
+geth = None
+
+SUBMIT_BATCH_SIZE = 100
+MAX_CLAIM_ATTEMPTS = 5
+RETRY_BASE_DELAY = 2
+
+# Wallets sending at once. Keep it at or below GETH_POOL_SIZE, extra threads just wait on a socket.
+SUBMITTER_WORKERS = int(os.getenv('SUBMITTER_WORKERS', 4))
+
+# Seconds the daemon waits before looking at the queue again once it is empty.
+POLL_INTERVAL = 1
+
+# What became of a claim this round. SENT: the node has its transaction. REJECTED: the node refused it or it was never
+# sent, signing again is safe. IN_DOUBT: the send failed in a way that may have reached the node.
+SENT, REJECTED, IN_DOUBT = 'sent', 'rejected', 'in doubt'
+
+# Creating session for querying. The pragma profile is configured in main before the first connection.
+Session = sessionmaker()
+engine = create_engine('sqlite:////usr/apps/token/backend/backend/temp.db')
+Session.configure(bind=engine)
+
+
+class GetQueuedClaims(DataQuery):
+    """ Gets the oldest queued claims that are due to be sent, along with what is needed to send them
+
+    **binds**:
+        * queued: ClaimStatus.QUEUED value
+        * limit: Most claims to return
+    """
+
+    sql_text = """
+    SELECT co.cl_id, co.con_id, co.t_id, co.c_id, co.code, co.attempts, co.tx_hash, co.raw_tx, co.gas_price,
+      c.con_addr, c.con_abi, c.sender, col.c_hash
+    FROM claim_outbox co
+    JOIN contracts c ON c.con_id = co.con_id
+    JOIN collectors col ON col.c_id = co.c_id
+    WHERE co.status = :queued
+      AND co.next_attempt_ts <= strftime('%Y-%m-%d %H:%M:%S')
+    ORDER BY co.cl_id
+    LIMIT :limit
+    """
+
+
+class SetClaimSigned(DataQuery):
+    """ Records the transaction of a claim before it is sent
+
+    **binds**:
+        * cl_id: The claim
+        * tx_hash: Hash of the signed transaction
+        * raw_tx: The signed transaction, hexlified
+        * gas_price: Gas price it was signed with
+    """
+
+    sql_text = """
+    UPDATE claim_outbox
+    SET tx_hash = :tx_hash,
+      raw_tx = :raw_tx,
+      gas_price = :gas_price
+    WHERE cl_id = :cl_id
+    """
+
+
+class SetClaimSubmitted(DataQuery):
+    """ Records the transaction a claim was sent in
+
+    **binds**:
+        * cl_id: The claim
+        * tx_hash: Hash of the claim transaction
+        * submitted: ClaimStatus.SUBMITTED value
+    """
+
+    sql_text = """
+    UPDATE claim_outbox
+    SET status = :submitted,
+      tx_hash = :tx_hash,
+      attempts = attempts + 1,
+      last_error = NULL,
+      submitted_ts = strftime('%Y-%m-%d %H:%M:%S')
+    WHERE cl_id = :cl_id
+    """
+
+
+class SetTokenSubmitted(DataQuery):
+    """ Moves a reserved token on to claimed once its claim is sent
+
+    **binds**:
+        * con_id, t_id: The token
+        * t_hash: Hash of the claim transaction
+        * gas_price: Gas price the claim was sent with
+        * sender: Hot wallet the claim was sent from
+        * claimed: TokenStatus.CLAIMED value
+        * queued: TokenStatus.QUEUED value
+    """
+
+    sql_text = """
+    UPDATE tokens
+    SET status = :claimed,
+      t_hash = :t_hash,
+      gas_price = :gas_price,
+      sender = :sender
+    WHERE con_id = :con_id
+      AND t_id = :t_id
+      AND status = :queued
+    """
+
+
+class SetClaimRetry(DataQuery):
+    """ Puts a claim whose send is in doubt back in the queue, keeping its transaction to check on next attempt
+
+    **binds**:
+        * cl_id: The claim
+        * error: Why the send failed
+        * delay: Seconds until the next attempt
+    """
+
+    sql_text = """
+    UPDATE claim_outbox
+    SET attempts = attempts + 1,
+      last_error = :error,
+      next_attempt_ts = strftime('%Y-%m-%d %H:%M:%S', 'now', printf('+%d seconds', :delay))
+    WHERE cl_id = :cl_id
+    """
+
+
+class SetClaimRejected(DataQuery):
+    """ Puts a claim the node rejected back in the queue, dropping its transaction so the next attempt signs a new one
+
+    **binds**:
+        * cl_id: The claim
+        * error: Why the send failed
+        * delay: Seconds until the next attempt
+    """
+
+    sql_text = """
+    UPDATE claim_outbox
+    SET attempts = attempts + 1,
+      last_error = :error,
+      tx_hash = NULL,
+      raw_tx = NULL,
+      gas_price = NULL,
+      next_attempt_ts = strftime('%Y-%m-%d %H:%M:%S', 'now', printf('+%d seconds', :delay))
+    WHERE cl_id = :cl_id
+    """
+
+
+class SetClaimFailed(DataQuery):
+    """ Gives up on a claim that ran out of attempts
+
+    **binds**:
+        * cl_id: The claim
+        * error: Why the last send failed
+        * failed: ClaimStatus.FAILED value
+    """
+
+    sql_text = """
+    UPDATE claim_outbox
+    SET status = :failed,
+      attempts = attempts + 1,
+      last_error = :error,
+      tx_hash = NULL,
+      raw_tx = NULL
+    WHERE cl_id = :cl_id
+    """
+
+
+class ReleaseToken(DataQuery):
+    """ Makes the reserved token of a failed claim available again
+
+    **binds**:
+        * con_id, t_id: The token
+        * new: TokenStatus.NEW value
+        * queued: TokenStatus.QUEUED value
+    """
+
+    sql_text = """
+    UPDATE tokens
+    SET owner_c_id = NULL,
+      status = :new,
+      latitude = NULL,
+      longitude = NULL,
+      claim_ts = NULL
+    WHERE con_id = :con_id
+      AND t_id = :t_id
+      AND status = :queued
+    """
+
+
+def group_by_sender(claims):
+    """ Splits claims by the hot wallet they are sent from, keeping the queue order within each wallet
+
+    :param claims: rows from GetQueuedClaims.
+    :return: list of lists of claims.
+    """
+    groups = {}
+    for claim in claims:
+        groups.setdefault(claim['sender'], []).append(claim)
+    return list(groups.values())
+
+
+def error_text(e):
+    return getattr(e, 'exception', None) or str(e)
+
+
+def send_claims(claims):
+    """ Sends claims from one wallet one after another
+
+    :param claims: claims sharing a sender, in queue order.
+    :return: list of (claim, outcome, tx_hash, gas_price, error) tuples, outcome is SENT, REJECTED or IN_DOUBT.
+    """
+    sess = Session()
+    try:
+        return [send_claim(claim, sess) if claim['tx_hash'] is None else resend_claim(claim) for claim in claims]
+    finally:
+        sess.close()
+
+
+def send_claim(claim, sess):
+    """ Signs a claim, records its transaction and sends it
+
+    :param claim: row from GetQueuedClaims without a recorded transaction.
+    :param sess: session to record the transaction with, committed before the send.
+    :return: (claim, outcome, tx_hash, gas_price, error)
+    """
+    try:
+        signed, gas_price = geth.prepare_claim(claim['con_addr'], claim['con_abi'], claim['c_hash'], claim['t_id'],
+                                               code=claim['code'], sender=claim['sender'])
+    except Exception as e:
+        return claim, REJECTED, None, None, error_text(e)
+
+    tx_hash = hexlify(signed.hash).decode()
+    try:
+        SetClaimSigned().execute({'cl_id': claim['cl_id'], 'tx_hash': tx_hash, 'gas_price': gas_price,
+                                  'raw_tx': hexlify(signed.raw_transaction).decode()}, sesh=sess)
+        sess.commit()
+    except Exception as e:
+        sess.rollback()
+        geth.discard_signed(signed)
+        return claim, REJECTED, None, None, 'could not record the signed claim: {}'.format(e)
+
+    try:
+        geth.send_signed(signed)
+        return claim, SENT, tx_hash, gas_price, None
+    except TransactionRejected as e:
+        return claim, REJECTED, None, None, error_text(e)
+    except Exception as e:
+        return claim, IN_DOUBT, tx_hash, gas_price, error_text(e)
+
+
+def resend_claim(claim):
+    """ Follows up a claim whose transaction was recorded on an earlier attempt, sending the same bytes only if the
+    node has never seen them
+
+    :param claim: row from GetQueuedClaims with a recorded transaction.
+    :return: (claim, outcome, tx_hash, gas_price, error)
+    """
+    tx_hash, gas_price = claim['tx_hash'], claim['gas_price']
+    try:
+        if geth.transaction_state(tx_hash) != 'unknown':
+            return claim, SENT, tx_hash, gas_price, None
+        geth.send_signed(SignedSend(claim['sender'], None, unhexlify(claim['raw_tx']), unhexlify(tx_hash)),
+                         rebroadcast=True)
+        return claim, SENT, tx_hash, gas_price, None
+    except TransactionRejected as e:
+        # It may have been mined between the check and the send, taking its own nonce, so look once more.
+        try:
+            if geth.transaction_state(tx_hash) != 'unknown':
+                return claim, SENT, tx_hash, gas_price, None
+        except Exception as state_error:
+            return claim, IN_DOUBT, tx_hash, gas_price, error_text(state_error)
+        return claim, REJECTED, None, None, error_text(e)
+    except Exception as e:
+        return claim, IN_DOUBT, tx_hash, gas_price, error_text(e)
+
+
+def retry_delay(attempts):
+    return RETRY_BASE_DELAY * 2 ** min(attempts, MAX_CLAIM_ATTEMPTS)
+
+
+def write_back(results, sess):
+    """ Records the outcome of a batch of sends in one transaction
+
+    If this fails the claims stay queued with their transactions recorded, so the next drain finds them on the node
+    instead of sending them again.
+
+    :param results: tuples from send_claims.
+    :param sess: session to use.
+    :return: Tuple of (number sent, number retried, number failed)
+    """
+    submitted, tokens, retries, rejected, failed, released = [], [], [], [], [], []
+    for claim, outcome, tx_hash, gas_price, error in results:
+        if outcome == SENT:
+            submitted.append({'cl_id': claim['cl_id'], 'tx_hash': tx_hash, 'submitted': ClaimStatus.SUBMITTED.value})
+            tokens.append({'con_id': claim['con_id'], 't_id': claim['t_id'], 't_hash': tx_hash,
+                           'gas_price': gas_price, 'sender': claim['sender'], 'claimed': TokenStatus.CLAIMED.value,
+                           'queued': TokenStatus.QUEUED.value})
+        elif outcome == IN_DOUBT:
+            if claim['attempts'] + 1 >= MAX_CLAIM_ATTEMPTS:
+                log_kv(LOG_WARNING, {'warning': 'claim still in doubt', 'claim_id': claim['cl_id'],
+                                     'tx_hash': tx_hash, 'error': error})
+            retries.append({'cl_id': claim['cl_id'], 'error': error, 'delay': retry_delay(claim['attempts'])})
+        elif claim['attempts'] + 1 < MAX_CLAIM_ATTEMPTS:
+            rejected.append({'cl_id': claim['cl_id'], 'error': error, 'delay': retry_delay(claim['attempts'])})
+        else:
+            log_kv(LOG_WARNING, {'warning': 'giving up on claim', 'claim_id': claim['cl_id'], 'error': error})
+            failed.append({'cl_id': claim['cl_id'], 'error': error, 'failed': ClaimStatus.FAILED.value})
+            released.append({'con_id': claim['con_id'], 't_id': claim['t_id'], 'new': TokenStatus.NEW.value,
+                             'queued': TokenStatus.QUEUED.value})
+
+    try:
+        for query, binds in ((SetClaimSubmitted, submitted), (SetTokenSubmitted, tokens), (SetClaimRetry, retries),
+                             (SetClaimRejected, rejected), (SetClaimFailed, failed), (ReleaseToken, released)):
+            if binds:
+                query().execute(binds, sesh=sess)
+        sess.commit()
+    except Exception:
+        sess.rollback()
+        raise
+    return len(submitted), len(retries) + len(rejected), len(failed)
+
+
+def drain_once(executor=None):
+    """ Sends one batch of queued claims
+
+    :param executor: ThreadPoolExecutor the wallets send on, None sends them one after another.
+    :return: number of claims taken from the queue.
+    """
+    sess = Session()
+    try:
+        claims = GetQueuedClaims().execute_n_fetchall({'queued': ClaimStatus.QUEUED.value,
+                                                       'limit': SUBMIT_BATCH_SIZE}, sess, schema_out=False) or []
+        if not claims:
+            return 0
+
+        groups = group_by_sender(claims)
+        sends = executor.map(send_claims, groups) if executor is not None else map(send_claims, groups)
+        results = [result for group in sends for result in group]
+
+        sent, retried, failed = write_back(results, sess)
+        print('Submitted {s} claims, {r} to retry, {f} failed'.format(s=sent, r=retried, f=failed))
+        return len(claims)
+    finally:
+        sess.close()
+
+
+def run_daemon(stop, executor=None, poll_interval=POLL_INTERVAL):
+    """ Keeps draining the queue until stop is set
+
+    :param stop: threading.Event that ends the loop, set by the SIGTERM handler.
+    :param executor: ThreadPoolExecutor the wallets send on.
+    :param poll_interval: seconds to wait once the queue is empty, or after an error.
+    :return: None
+    """
+    while not stop.is_set():
+        try:
+            if drain_once(executor) == SUBMIT_BATCH_SIZE:
+                continue
+        except Exception as e:
+            log_kv(LOG_ERROR, {'error': 'submitting claims failed', 'exception': str(e)}, exception=True)
+        stop.wait(poll_interval)
+
+
+def main(daemon=False):
+    global geth
+    configure_sqlite_pragmas(load_config(ROOT_PATH).get('SQLITE_PRAGMAS'))
+    geth = get_geth_keeper()
+
+    with ThreadPoolExecutor(max_workers=SUBMITTER_WORKERS) as executor:
+        if not daemon:
+            print('running submitter')
+            while drain_once(executor) == SUBMIT_BATCH_SIZE:
+                pass
+        else:
+            log_kv(LOG_INFO, {'message': 'submitter daemon starting'})
+            stop = threading.Event()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(sig, lambda signum, frame: stop.set())
+            run_daemon(stop, executor)
+
+    log_kv(LOG_INFO, {'message': 'submitter finished', 'node_connections': geth.connection_stats()})
+
+
+if __name__ == '__main__':
+    main(daemon='--daemon' in sys.argv[1:])
@@ -1,20 +1,46 @@
 #!/usr/bin/python
+"""
+Moves pending contracts, token claims, trades and external transfers along once their transactions are mined.
+
+usage: python upact.py [--daemon]
+
+Without arguments every pending row is checked once, for running from cron. With --daemon it keeps running and
+checks again each time a new block is mined, until it gets SIGTERM or SIGINT. Pending rows are worked through in
+chunks on UPACT_WORKERS threads, each with a session of its own.
+"""
+import os
+import signal
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 
-sys.path.insert(0, '/usr/apps/token/backend/backend/')
-from utils.db_utils import DataQuery
-from ether.geth_keeper import GethKeeper
+ROOT_PATH = '/usr/apps/token/backend/backend/'
+sys.path.insert(0, ROOT_PATH)
+from utils.db_utils import DataQuery, configure_sqlite_pragmas
+from ether.geth_keeper import get_geth_keeper
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.engine import create_engine
-from utils.utils import log_kv, LOG_ERROR
+from utils.setup_utils import load_config
+from utils.utils import log_kv, LOG_ERROR, LOG_INFO
 from models.contract import TokenStatus, ContractStatus
 from models.trade import TradeStatus
+from models.history import InsertTokenTransfer, TransferKind, token_transfer_binds
+from models.transfer import ExternalTransferStatus
+
+# Created in main so the queries below can be imported without a node.
+geth = None
+
+# Number of receipts fetched from the node per batch, each chunk's updates are committed together.
+RECEIPT_CHUNK_SIZE = 500
 
-# Create geth.
-geth = GethKeeper()
-print('running upact')
+# Threads working through chunks at once. Keep it at or below GETH_POOL_SIZE, extra threads just wait on a socket.
+UPACT_WORKERS = int(os.getenv('UPACT_WORKERS', 4))
 
-# Creating session for querying.
+# Seconds the daemon waits between polls of the node's block number. Rinkeby mines a block about every 15 seconds.
+MIN_POLL_INTERVAL = 1
+MAX_POLL_INTERVAL = 15
+
+# Creating session for querying. The pragma profile is configured in main before the first connection.
 Session = sessionmaker()
 engine = create_engine('sqlite:////usr/apps/token/backend/backend/temp.db')
 Session.configure(bind=engine)
@@ -30,29 +56,24 @@ class UpdateContractStatus(DataQuery):
         * this_id: The database's contract_id for this contract
     """
 
-    def __init__(self):
-        self.sql_text = """
-            UPDATE contracts 
-            SET status = :new_status, 
-              con_addr = :con_addr,
-              gas_cost = :gas_cost 
-            WHERE con_id = :this_id;
-        """
-        super().__init__()
+    sql_text = """
+        UPDATE contracts 
+        SET status = :new_status, 
+          con_addr = :con_addr,
+          gas_cost = :gas_cost 
+        WHERE con_id = :this_id;
+    """
 
 
 class UpdateOwnership(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        update tokens
-        set owner_c_id = :new_owner
-        where con_id = :con_id
-        and t_id = :t_id
-        and owner_c_id = :prev_owner;
-        """
-        self.schema_out = None
-        super().__init__()
+    sql_text = """
+    update tokens
+    set owner_c_id = :new_owner
+    where con_id = :con_id
+    and t_id = :t_id
+    and owner_c_id = :prev_owner;
+    """
 
 
 class UpdateTokenStatus(DataQuery):
@@ -64,26 +85,22 @@ class UpdateTokenStatus(DataQuery):
         * this_id: The ID of the token
     """
 
-    def __init__(self):
-        self.sql_text = """
-            UPDATE tokens 
-            SET status = :new_status, 
-              gas_cost = :gas_cost 
-            WHERE t_id = :this_id
-        """
-        super().__init__()
+    sql_text = """
+        UPDATE tokens 
+        SET status = :new_status, 
+          gas_cost = :gas_cost 
+        WHERE t_id = :this_id
+    """
 
 
 class GetPendingContracts(DataQuery):
     """ Gets all pending contracts """
 
-    def __init__(self):
-        self.sql_text = """
-            SELECT con_id, con_tx 
-            FROM contracts 
-            WHERE status = :pending_issue_status
-        """
-        super().__init__()
+    sql_text = """
+        SELECT con_id, con_tx 
+        FROM contracts 
+        WHERE status = :pending_issue_status
+    """
 
 
 class GetPendingTradeTRIDs(DataQuery):
@@ -91,212 +108,453 @@ class GetPendingTradeTRIDs(DataQuery):
     Get all tr_ids of trade items in pending state.
     """
 
-    def __init__(self):
-        self.sql_text = """
-        select * from trade
-        where status = :pending_trade_status
-        """
-        super().__init__()
+    sql_text = """
+    select * from trade
+    where status = :pending_trade_status
+    """
 
 
-class GetTradeItemsByTRID(DataQuery):
-    def __init__(self):
-        self.sql_text = """
-        select * from trade_item
-        where tr_id = :tr_id
-        """
-        super().__init__()
+class GetTradeItemsByTRIDs(DataQuery):
+    sql_text = """
+    select * from trade_item
+    where tr_id in :tr_ids
+    """
+
+    expanding_binds = ('tr_ids',)
 
 
 class UpdateTradeItemGasCost(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        UPDATE trade_item
-        SET gas_cost = :gas_cost
-        WHERE tr_id = :tr_id
-        and con_id = :con_id
-        and t_id = :t_id
-        """
-        super().__init__()
+    sql_text = """
+    UPDATE trade_item
+    SET gas_cost = :gas_cost
+    WHERE tr_id = :tr_id
+    and con_id = :con_id
+    and t_id = :t_id
+    """
 
 
 class UpdateTradeStatus(DataQuery):
 
-    def __init__(self):
-        self.sql_text = """
-        UPDATE trade
-        SET status = :new_status
-        WHERE tr_id = :tr_id
-        """
-        super().__init__()
+    sql_text = """
+    UPDATE trade
+    SET status = :new_status
+    WHERE tr_id = :tr_id
+    """
 
 
 class GetPendingTokens(DataQuery):
     """ Gets all pending tokens """
 
-    def __init__(self):
-        self.sql_text = """
-            SELECT t_id, t_hash 
-            FROM tokens 
-            WHERE status = :pending_claim_status
-              AND t_hash IS NOT NULL
-        """
-        super().__init__()
+    sql_text = """
+        SELECT t_id, con_id, owner_c_id, t_hash 
+        FROM tokens 
+        WHERE status = :pending_claim_status
+          AND t_hash IS NOT NULL
+    """
+
+
+class GetPendingExternalTransfers(DataQuery):
+    """ Gets all transfers to external wallets that haven't been mined yet """
+
+    sql_text = """
+        SELECT et_id, con_id, t_id, from_c_id, to_address, tx_hash
+        FROM external_transfers
+        WHERE status = :pending
+    """
+
+
+class UpdateExternalTransferStatus(DataQuery):
+    """ Updates the status of a transfer to an external wallet
+
+    **binds**:
+        * new_status: ExternalTransferStatus value
+        * et_id: The transfer
+    """
+
+    sql_text = """
+        UPDATE external_transfers
+        SET status = :new_status
+        WHERE et_id = :et_id
+    """
+
+
+class ReturnExternalToken(DataQuery):
+    """ Puts a token whose transfer to an external wallet failed back in its collector's collection
+
+    **binds**:
+        * con_id, t_id: The token
+        * external: TokenStatus.EXTERNAL value
+        * mined: TokenStatus.CLAIM_MINED value
+    """
+
+    sql_text = """
+        UPDATE tokens
+        SET status = :mined
+        WHERE con_id = :con_id
+          AND t_id = :t_id
+          AND status = :external
+    """
+
+
+def chunks(rows, size=RECEIPT_CHUNK_SIZE):
+    """ Splits rows into lists of at most size rows
+    :param rows: list to split.
+    :param size: length of each chunk.
+    :return: generator of lists.
+    """
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def get_receipts(tx_hashes):
+    """ Fetches the receipts of the given transactions, skipping hashes that were never set
+    :param tx_hashes: transaction hashes as stored in the database.
+    :return: dict of tx_hash to receipt, None if it isn't mined yet.
+    """
+    tx_hashes = [tx_hash for tx_hash in tx_hashes if tx_hash]
+    receipts = {}
+    for chunk in chunks(tx_hashes):
+        receipts.update(zip(chunk, geth.get_receipts(chunk)))
+    return receipts
 
 
 def update_contracts(rows, sess):
     """ Updates contract status and address if an issue has been processed. 'S' = Success, 'F' = Failure
+
+    Receipts are fetched before anything is written and each chunk's updates go out as one executemany, so the write
+    lock is only held for the length of the update itself.
+
     :param rows: The rows to iterate over
     :param sess: session to use.
     """
-    for row in rows:
-        print('working on contract - contract_id: {c_id}'.format(c_id=row['con_id']))
-        # Try to get the transaction receipt
-        has_receipt, success, receipt = geth.check_contract_mine(row['con_tx'])
-        if has_receipt:
+    for chunk in chunks(rows):
+        print('working on {n} contracts'.format(n=len(chunk)))
+        receipts = geth.get_receipts([row['con_tx'] for row in chunk])
+        binds = []
+        for row, receipt in zip(chunk, receipts):
+            if receipt is None:
+                continue
             status, address, gas_cost = ContractStatus.FAILED.value, None, None
-            if success:
+            if receipt['status'] != 0:
                 status, address = ContractStatus.ISSUE_MINED.value, receipt['contractAddress']
                 gas_cost = receipt['gasUsed']
                 print('Contract mined - contract_id: {c_id}'.format(c_id=row['con_id']))
             else:
                 print('Contract failed!! - contract_id: {c_id}'.format(c_id=row['con_id']))
-            # Update the status and contract address
-            UpdateContractStatus().execute(
-                {'new_status': 'S', 'con_addr': address, 'this_id': row['con_id'], 'gas_cost': gas_cost},
-                sesh=sess)
-    sess.commit()
+            binds.append({'new_status': 'S', 'con_addr': address, 'this_id': row['con_id'], 'gas_cost': gas_cost})
+
+        # Update the status and contract address
+        if binds:
+            UpdateContractStatus().execute(binds, sesh=sess)
+            sess.commit()
 
 
 def update_tokens(rows, sess):
     """ Updates token status if a claim has been processed. Sets status to 'S' on success or 'F' on failure
 
+    Written back one executemany per chunk like update_contracts, along with the history of the claims that succeeded.
+
     :param rows: The rows to iterate over
     :param sess: session to use.
     """
-    for row in rows:
-        print('working on token - token_id: {t_id}'.format(t_id=row['t_id']))
-        # Try to get the transaction receipt
-        has_receipt, success, receipt = geth.check_claim_mine(row['t_hash'])
-        if has_receipt:
+    for chunk in chunks(rows):
+        print('working on {n} tokens'.format(n=len(chunk)))
+        receipts = geth.get_receipts([row['t_hash'] for row in chunk])
+        binds, history_binds = [], []
+        for row, receipt in zip(chunk, receipts):
+            if receipt is None:
+                continue
             status = TokenStatus.FAILED.value
-            if success:
+            if receipt['status'] == 1:
                 status = TokenStatus.CLAIM_MINED.value
                 gas_cost = receipt['gasUsed']
+                history_binds.append(token_transfer_binds(row['con_id'], row['t_id'], TransferKind.CLAIM.value,
+                                                          to_c_id=row['owner_c_id'], tx_hash=row['t_hash']))
                 print('Token claim mined - token_id: {t_id}, gas_used: {gas}'.format(t_id=row['t_id'], gas=gas_cost))
             else:
                 gas_cost = None
                 print('Token claim failed!! - token_id: {t_id}'.format(t_id=row['t_id']))
-            # Update the status
-            UpdateTokenStatus().execute({'new_status': status, 'gas_cost': gas_cost, 'this_id': row['t_id']}, sesh=sess)
-    sess.commit()
+            binds.append({'new_status': status, 'gas_cost': gas_cost, 'this_id': row['t_id']})
 
+        # Update the status
+        if binds:
+            UpdateTokenStatus().execute(binds, sesh=sess)
+            if history_binds:
+                InsertTokenTransfer().execute(history_binds, sesh=sess)
+            sess.commit()
 
-def update_trade_items(trade_items, trade, sess):
+
+def update_external_transfers(rows, sess):
+    """ Finishes transfers to external wallets once mined, adding them to the token's history
+
+    A transfer that failed on chain is marked failed and its token goes back to the collector, nothing is added to the
+    history since the token never left.
+
+    :param rows: The rows to iterate over
+    :param sess: session to use.
+    """
+    for chunk in chunks(rows):
+        print('working on {n} external transfers'.format(n=len(chunk)))
+        receipts = geth.get_receipts([row['tx_hash'] for row in chunk])
+        binds, history_binds, returned = [], [], []
+        for row, receipt in zip(chunk, receipts):
+            if receipt is None:
+                continue
+            if receipt['status'] == 1:
+                binds.append({'new_status': ExternalTransferStatus.MINED.value, 'et_id': row['et_id']})
+                history_binds.append(token_transfer_binds(row['con_id'], row['t_id'], TransferKind.EXTERNAL.value,
+                                                          from_c_id=row['from_c_id'], to_address=row['to_address'],
+                                                          tx_hash=row['tx_hash']))
+            else:
+                print('External transfer failed!! - token_id: {t_id}'.format(t_id=row['t_id']))
+                binds.append({'new_status': ExternalTransferStatus.FAILED.value, 'et_id': row['et_id']})
+                returned.append({'con_id': row['con_id'], 't_id': row['t_id'],
+                                 'external': TokenStatus.EXTERNAL.value, 'mined': TokenStatus.CLAIM_MINED.value})
+
+        if binds:
+            UpdateExternalTransferStatus().execute(binds, sesh=sess)
+            if history_binds:
+                InsertTokenTransfer().execute(history_binds, sesh=sess)
+            if returned:
+                ReturnExternalToken().execute(returned, sesh=sess)
+            sess.commit()
+
+
+def check_trade_items(trade_items, trade, receipts):
     """
     Goes through and makes sure all trade_items given have been mined fully.
     :param trade_items: List of trade_item dictionary objects.
-    :param trade: tr_id of trade.
-    :return: list of booleans.
+    :param trade: trade row the items belong to.
+    :param receipts: dict of trade_hash to receipt from get_receipts.
+    :return: Tuple of (new trade status or None if not all mined yet, list of gas used by each item)
     """
     print("Working on trade_items in trade with tr_id: {}".format(trade['tr_id']))
 
-    claimed = []
     gas_cost_list = []
 
     # Go through trade items and ensure they have been mined.
     for ti in trade_items:
-        has_receipt, success, receipt = geth.check_claim_mine(ti['trade_hash'])
-        if has_receipt:
-            if success:
-                # If they have been mined and success add to the list.
-                gas_cost_list.append(receipt['gasUsed'])
-                claimed.append(True)
-            else:
-                # If any of the tis fail. Then we need to fail the whole transfer and update the status.
-                print('Trade_item mine fail. Failing whole transfer.-tr_id:{}, t_id:{}, con_id:{}'.format(ti['tr_id'],
-                                                                                                          ti['t_id'],
-                                                                                                          ti['con_id']))
-                UpdateTradeStatus().execute({'tr_id': trade['tr_id'], 'new_status': TradeStatus.FAILED.value})
-        else:
-            # If any fail then its over.
-            claimed.append(False)
-            break
+        receipt = receipts.get(ti['trade_hash'])
+        if receipt is None:
+            # If any aren't mined yet then its over for now.
+            print('Not all trade_items mined will try again later. - tr_id: {}'.format(trade['tr_id']))
+            return None, []
 
-    # Check to make sure all tokens have been mined.
-    if all(claimed):
-        try:
-            perform_ownership_transfer(trade, trade_items, sess)
-            UpdateTradeStatus().execute({'tr_id': trade['tr_id'], 'new_status': TradeStatus.ACCEPTED.value}, sesh=sess)
-            for ti, gas_cost in zip(trade_items, gas_cost_list):
-                UpdateTradeItemGasCost().execute({'gas_cost': gas_cost, 'tr_id': ti['tr_id'], 'con_id': ti['con_id'],
-                                                  't_id': ti['t_id']}, sesh=sess)
-            print('Trade transfer mined - tr_id: {tr_id}, gas_cost: {gas_cost_list}'
-                  .format(tr_id=trade['tr_id'], gas_cost_list=gas_cost_list))
-            sess.commit()
-        except Exception as e:
-            print('Exception while checking transfer mine: ERROR: {err}'.format(err=str(e)))
-            log_kv(LOG_ERROR, {'error': 'exception while checking transfer mine', 'exception': str(e)},
-                   exception=True)
-            sess.rollback()
-    else:
-        print('Not all trade_items mined will try again later.'.format(t_id=trade['tr_id']))
+        if receipt['status'] != 1:
+            # If any of the tis fail. Then we need to fail the whole transfer.
+            print('Trade_item mine fail. Failing whole transfer.-tr_id:{}, t_id:{}, con_id:{}'.format(ti['tr_id'],
+                                                                                                      ti['t_id'],
+                                                                                                      ti['con_id']))
+            return TradeStatus.FAILED.value, []
+
+        # If they have been mined and success add to the list.
+        gas_cost_list.append(receipt['gasUsed'])
+
+    print('Trade transfer mined - tr_id: {tr_id}, gas_cost: {gas_cost_list}'
+          .format(tr_id=trade['tr_id'], gas_cost_list=gas_cost_list))
+    return TradeStatus.ACCEPTED.value, gas_cost_list
 
 
-def perform_ownership_transfer(trade, trade_items, sess):
-    # Go through and transfer ownership over
+def ownership_binds(trade, trade_items):
+    """
+    Builds the UpdateOwnership binds that hand each item over to the other side of the trade.
+    :param trade: trade row.
+    :param trade_items: the trade's items.
+    :return: list of binds.
+    """
     trader_c_id, tradee_c_id = trade['trader_c_id'], trade['tradee_c_id']
+    binds = []
     for trade_item in trade_items:
-        try:
-            # Figure out new ownership.
-            if trade_item['owner'] == trader_c_id:
-                prev_owner, new_owner = trader_c_id, tradee_c_id
-            else:
-                prev_owner, new_owner = tradee_c_id, trader_c_id
+        # Figure out new ownership.
+        if trade_item['owner'] == trader_c_id:
+            prev_owner, new_owner = trader_c_id, tradee_c_id
+        else:
+            prev_owner, new_owner = tradee_c_id, trader_c_id
+        binds.append({'con_id': trade_item['con_id'], 't_id': trade_item['t_id'],
+                      'new_owner': new_owner, 'prev_owner': prev_owner})
+    return binds
+
+
+def update_trades(trades, sess):
+    """ Checks the trade_items of each pending trade and finishes the trades that are fully mined
 
-            # Update the ownership.
-            upt_cnt = UpdateOwnership().execute({'con_id': trade_item['con_id'], 't_id': trade_item['t_id'],
-                                                 'new_owner': new_owner, 'prev_owner': prev_owner},
-                                                sesh=sess)
-            # Ensure that the ownership was actually updated.
-            if upt_cnt != 1:
-                log_kv(LOG_ERROR, {'error': 'error transferring token ownership',
-                                   'con_id': trade_item['con_id'], 't_id': trade_item['t_id']})
+    Every outcome is worked out first, then written back in a single transaction. If that fails each trade is written
+    again in its own savepoint, so one bad trade doesn't hold up the rest of the chunk.
+
+    :param trades: trade rows to check.
+    :param sess: session to use.
+    :return: None
+    """
+    trade_items = {trade['tr_id']: [] for trade in trades}
+    for ti in GetTradeItemsByTRIDs().execute_n_fetchall({'tr_ids': list(trade_items)}, sess, schema_out=False):
+        trade_items[ti['tr_id']].append(ti)
 
+    # Fetch the receipts of every trade at once before working through the trades.
+    receipts = get_receipts([ti['trade_hash'] for items in trade_items.values() for ti in items])
+
+    outcomes = []
+    for trade in trades:
+        items = trade_items[trade['tr_id']]
+        new_status, gas_cost_list = check_trade_items(items, trade, receipts)
+        if new_status is None:
+            continue
+
+        outcome = {'status': {'tr_id': trade['tr_id'], 'new_status': new_status}, 'transfers': [], 'gas': []}
+        if new_status == TradeStatus.ACCEPTED.value:
+            # Each ownership change is paired with the history row that records it.
+            outcome['transfers'] = [(b, token_transfer_binds(b['con_id'], b['t_id'], TransferKind.TRADE.value,
+                                                             from_c_id=b['prev_owner'], to_c_id=b['new_owner'],
+                                                             tx_hash=ti['trade_hash'], tr_id=trade['tr_id']))
+                                    for ti, b in zip(items, ownership_binds(trade, items))]
+            outcome['gas'] = [{'gas_cost': gas_cost, 'tr_id': ti['tr_id'], 'con_id': ti['con_id'], 't_id': ti['t_id']}
+                              for ti, gas_cost in zip(items, gas_cost_list)]
+        outcomes.append(outcome)
+
+    if not outcomes:
+        return
+
+    try:
+        write_trade_outcomes(outcomes, sess)
+        sess.commit()
+        return
+    except Exception as e:
+        print('Exception while checking transfer mine: ERROR: {err}'.format(err=str(e)))
+        log_kv(LOG_ERROR, {'error': 'exception while checking transfer mine, writing trades one by one',
+                           'exception': str(e)}, exception=True)
+        sess.rollback()
+
+    for outcome in outcomes:
+        try:
+            with sess.begin_nested():
+                write_trade_outcomes([outcome], sess)
         except Exception as e:
-            log_kv(LOG_ERROR, {'error': 'error transferring ownership of token.',
-                               'con_id': trade_item['con_id'], 't_id': trade_item['t_id'],
-                               'owner_c_id': trade_item['owner'], 'exception': str(e)}, exception=True)
-            sess.rollback()
+            log_kv(LOG_ERROR, {'error': 'could not finish trade', 'tr_id': outcome['status']['tr_id'],
+                               'exception': str(e)}, exception=True)
+    sess.commit()
 
 
-def main():
-    # Get contracts with pending status (for updating contracts)
-    sess = Session()
-    contract_rows = GetPendingContracts().execute_n_fetchall({'pending_issue_status': ContractStatus.ISSUED.value},
-                                                             sess, schema_out=False)
-    if contract_rows:
-        update_contracts(contract_rows, sess)
-    sess.close()
+def write_trade_outcomes(outcomes, sess):
+    """ Writes the outcomes of finished trades, one executemany per statement apart from the ownership updates
 
-    # Get tokens with pending status (for updating claimed tokens)
+    :param outcomes: outcomes built by update_trades.
+    :param sess: session to use, not committed.
+    :return: None
+    """
+    # Ownership is updated token by token so history is only written for the handovers that happened, a token whose
+    # owner is no longer the one the trade expects is logged and left out.
+    history_binds = []
+    for owner_bind, history_bind in (transfer for outcome in outcomes for transfer in outcome['transfers']):
+        if UpdateOwnership().execute(owner_bind, sesh=sess):
+            history_binds.append(history_bind)
+        else:
+            log_kv(LOG_ERROR, {'error': 'error transferring token ownership', 'con_id': owner_bind['con_id'],
+                               't_id': owner_bind['t_id'], 'expected_owner': owner_bind['prev_owner']})
+
+    gas_binds = [bind for outcome in outcomes for bind in outcome['gas']]
+    if gas_binds:
+        UpdateTradeItemGasCost().execute(gas_binds, sesh=sess)
+    if history_binds:
+        InsertTokenTransfer().execute(history_binds, sesh=sess)
+    UpdateTradeStatus().execute([outcome['status'] for outcome in outcomes], sesh=sess)
+
+
+def in_session(update, rows):
+    """ Runs update(rows, sess) on a new session, closing it once done so each worker thread owns its own.
+    :param update: one of the update_* functions.
+    :param rows: rows to pass along.
+    :return: None
+    """
     sess = Session()
-    token_rows = GetPendingTokens().execute_n_fetchall({'pending_claim_status': TokenStatus.CLAIMED.value},
-                                                       sess, schema_out=False)
-    if token_rows:
-        update_tokens(token_rows, sess)
-    sess.close()
-
-    # Get pending trades.
+    try:
+        update(rows, sess)
+    except Exception:
+        sess.rollback()
+        raise
+    finally:
+        sess.close()
+
+
+def sweep(executor=None):
+    """ Checks every pending contract, token, trade and external transfer once.
+    :param executor: ThreadPoolExecutor to work through the chunks on, they run one after another if not given.
+    :return: None
+    """
     sess = Session()
+    contract_rows = GetPendingContracts().execute_n_fetchall({'pending_issue_status': ContractStatus.ISSUED.value},
+                                                             sess, schema_out=False) or []
+    token_rows = GetPendingTokens().execute_n_fetchall({'pending_claim_status': TokenStatus.CLAIMED.value},
+                                                       sess, schema_out=False) or []
     trades = GetPendingTradeTRIDs().execute_n_fetchall({"pending_trade_status": TradeStatus.WAITING.value},
-                                                       sess, schema_out=False)
-    for trade in trades:
-        trade_items = GetTradeItemsByTRID().execute_n_fetchall({'tr_id': trade['tr_id']}, sess, schema_out=False)
-        update_trade_items(trade_items, trade, sess)
+                                                       sess, schema_out=False) or []
+    transfer_rows = GetPendingExternalTransfers().execute_n_fetchall(
+        {'pending': ExternalTransferStatus.PENDING.value}, sess, schema_out=False) or []
     sess.close()
 
+    # Each chunk is fetched, written and committed on its own so the phases interleave across the workers.
+    jobs = [(update_contracts, chunk) for chunk in chunks(contract_rows)] + \
+           [(update_tokens, chunk) for chunk in chunks(token_rows)] + \
+           [(update_trades, chunk) for chunk in chunks(trades)] + \
+           [(update_external_transfers, chunk) for chunk in chunks(transfer_rows)]
+
+    if executor is None:
+        for update, rows in jobs:
+            in_session(update, rows)
+        return
+
+    futures = [executor.submit(in_session, update, rows) for update, rows in jobs]
+    wait(futures)
+    for future in futures:
+        if future.exception() is not None:
+            log_kv(LOG_ERROR, {'error': 'upact chunk failed', 'exception': str(future.exception())})
+
+
+def run_daemon(stop, executor=None, min_interval=MIN_POLL_INTERVAL, max_interval=MAX_POLL_INTERVAL):
+    """ Sweeps every time the node's head advances until stop is set
+
+    The node is polled for its block number, starting at min_interval after each new block and doubling up to
+    max_interval while nothing happens, so an idle chain or a node that is down costs at most one request per
+    max_interval. A sweep in progress always finishes before the daemon exits.
+
+    :param stop: threading.Event that ends the loop, set by the SIGTERM handler.
+    :param executor: ThreadPoolExecutor given to sweep.
+    :param min_interval: seconds to wait after a new block.
+    :param max_interval: longest wait between polls.
+    :return: None
+    """
+    last_block, interval = None, min_interval
+    while not stop.is_set():
+        try:
+            block = geth.block_number()
+            if last_block is None or block > last_block:
+                sweep(executor)
+                last_block, interval = block, min_interval
+            else:
+                interval = min(interval * 2, max_interval)
+        except Exception as e:
+            log_kv(LOG_ERROR, {'error': 'upact sweep failed', 'exception': str(e)}, exception=True)
+            interval = max_interval
+        stop.wait(interval)
+
+
+def main(daemon=False):
+    global geth
+    configure_sqlite_pragmas(load_config(ROOT_PATH).get('SQLITE_PRAGMAS'))
+    geth = get_geth_keeper()
+
+    with ThreadPoolExecutor(max_workers=UPACT_WORKERS) as executor:
+        if not daemon:
+            print('running upact')
+            sweep(executor)
+        else:
+            log_kv(LOG_INFO, {'message': 'upact daemon starting', 'workers': UPACT_WORKERS})
+            stop = threading.Event()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(sig, lambda signum, frame: stop.set())
+            run_daemon(stop, executor)
+
+    log_kv(LOG_INFO, {'message': 'upact finished', 'node_connections': geth.connection_stats()})
+
 
 if __name__ == '__main__':
-    main()
+    main(daemon='--daemon' in sys.argv[1:])
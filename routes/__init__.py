@@ -3,12 +3,12 @@ from functools import wraps
 from flask import request, jsonify, g, current_app
 from marshmallow import ValidationError
 
-from ether.geth_keeper import GethKeeper, MockGethKeeper
+from ether.geth_keeper import MockGethKeeper, get_geth_keeper
 from utils.utils import error_response, log_kv, LOG_ERROR
 
 def requires_geth(f):
     """
-    Places geth on flask request.
+    Places geth on flask request. The real keeper is shared by the whole worker process.
     :return: GethKeeper object
     """
     @wraps(f)
@@ -16,7 +16,7 @@ def requires_geth(f):
         if current_app.config.get('USE_MOCK', False):
             g.geth = MockGethKeeper()
         else:
-            g.geth = GethKeeper()
+            g.geth = get_geth_keeper()
         return f(*args, **kwargs)
     return decorated_function
 
@@ -4,6 +4,7 @@ from utils.verify_utils import verify_issuer_jwt
 from utils.utils import error_response, success_response
 from utils.db_utils import requires_db
 from models.constraints import get_all_constraints
+from utils.geo import FenceSet
 
 analytics_bp = Blueprint('analytics', __name__)
 analytics_docs = BlueprintDocumentation(analytics_bp, 'Analytics')
@@ -56,13 +57,17 @@ def analytics(con_id):
         constraints = None
     else:
         constraints = get_all_constraints(con_id)
+        if constraints is None:
+            return error_response("Couldn't retrieve constraints")
 
+    coordinates = claimed_coordinates(con_id)
     return success_response({
         'num_claimed': num_claimed,
         'num_unclaimed': num_created-num_claimed,
         'num_created': num_created,
-        'coordinates': claimed_coordinates(con_id),
+        'coordinates': coordinates,
         'loc_constraints': loc_constraints(con_id),
+        'fence_claims': fence_claims(con_id, coordinates),
         'time_windows': token_time_windows(con_id),
         'qr_code_claimable': qr_code_claimable,
         'constraints': constraints,
@@ -93,6 +98,22 @@ def loc_constraints(con_id):
         return []
 
 
+def fence_claims(con_id, coordinates):
+    """
+    Counts how many of the claimed tokens were claimed inside each location constraint of a contract.
+    :param con_id: con_id of the contract.
+    :param coordinates: [latitude, longitude] of each claimed token.
+    :return: list of [latitude, longitude, radius, claims] for each location constraint.
+    """
+    d_fences = g.sesh.execute("""select latitude, longitude, radius from location_claim 
+    where location_claim.con_id=:contract_id;""", {'contract_id': con_id}).fetchall()
+
+    fences = FenceSet.from_rows([tuple(fence) for fence in d_fences])
+    located = [coordinate for coordinate in coordinates if None not in coordinate]
+    counts = fences.count_within([lat for lat, _ in located], [long for _, long in located])
+    return [[fence.latitude, fence.longitude, fence.radius, int(count)] for fence, count in zip(d_fences, counts)]
+
+
 def token_time_windows(con_id):
     d_times = g.sesh.execute("""select start, end from time_claim where time_claim.con_id=:contract_id;
        """, {'contract_id': con_id}).fetchall()
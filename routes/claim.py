@@ -2,12 +2,11 @@ import traceback
 
 from flask import Blueprint, g
 
-from ether.geth_keeper import GethException
-from models.claim import ClaimRequest, GetTokenInfo, GetAvailableToken, SetToken, ClaimQRCodeRequest,\
-    GetSingleAvailToken
+from models.claim import ClaimRequest, GetTokenInfo, ClaimQRCodeRequest, QueueAvailableToken, QueueSingleToken,\
+    ReserveQueuedToken, GetClaimStatus, ClaimStatus, ClaimQueuedResponse, ClaimStatusResponse
 from models.contract import TokenStatus
 from models.constraints import validate_uni_code_constraints, validate_time_constraints, validate_location_constraints
-from routes import load_with_schema, requires_geth
+from routes import load_with_schema
 from utils.db_utils import requires_db
 from utils.doc_utils import BlueprintDocumentation
 from utils.utils import success_response, error_response, log_kv, LOG_INFO, LOG_ERROR
@@ -17,23 +16,57 @@ claim_bp = Blueprint('claim', __name__)
 claim_docs = BlueprintDocumentation(claim_bp, 'Claim')
 url_prefix = '/claim'
 
+CLAIM_QUEUED_DOC = """
+                   The chain call is queued and sent by the submitter, the response is 202 with the cl_id to follow
+                   the claim with /claim/status/cl_id=<int:cl_id>.
+                   """
+
+
+def queue_claim(con_id, c_id, lat, long, code=None, t_id=None, sesh=None):
+    """ Queues a claim for the submitter and reserves its token for the collector
+
+    The token is picked by the insert into the outbox, which holds sqlite's write lock until the transaction ends, so
+    no other claim can pick it in between. Commit or roll back right after.
+
+    :param con_id: The contract_id of the token
+    :param c_id: The collector_id of the collecting user
+    :param lat: latitude of user during claim attempt.
+    :param long: longitude of user during claim attempt.
+    :param code: The code the collector gave, sent along with the claim.
+    :param t_id: the t_id of token to claim, None for any available token of the contract.
+    :param sesh: The database session to use
+    :return: Tuple of (cl_id, t_id) of the queued claim, None if no token was available
+    """
+    sesh = sesh if sesh is not None else g.sesh
+    binds = {'con_id': con_id, 't_id': t_id, 'c_id': c_id, 'code': code}
+    query = QueueAvailableToken() if t_id is None else QueueSingleToken()
+    if query.execute(binds, sesh=sesh) != 1:
+        return None
+
+    claim = sesh.execute("select cl_id, t_id from claim_outbox where cl_id = last_insert_rowid()").fetchone()
+    rows_updated = ReserveQueuedToken().execute({'cl_id': claim['cl_id'], 'c_id': c_id, 'latitude': lat,
+                                                 'longitude': long, 'new_status': TokenStatus.QUEUED.value},
+                                                sesh=sesh)
+    if rows_updated != 1:
+        return None
+    return claim['cl_id'], claim['t_id']
+
 
 @claim_bp.route(url_prefix + '/qr_code', methods=['POST'])
 @requires_db
-@requires_geth
 @load_with_schema(ClaimQRCodeRequest)
 @verify_collector_jwt
 @claim_docs.document(url_prefix + '/qr_code', 'POST',
                      """
                      Method to claim a token of of an issued contract from a qr_code.
-                     """, input_schema=ClaimQRCodeRequest,  req_c_jwt=True,
-                     error_codes={'78': 'Already been claimed.'})
+                     """ + CLAIM_QUEUED_DOC, input_schema=ClaimQRCodeRequest,  req_c_jwt=True,
+                     output_schema=ClaimQueuedResponse, error_codes={'78': 'Already been claimed.'})
 def claim_by_qr_code(data):
-    results, msg, err_code = claim_qr_code(data['con_id'], data['t_id'], g.collector_info['c_id'],
-                                           data['location']['latitude'], data['location']['longitude'])
-    if results:
+    cl_id, msg, err_code = claim_qr_code(data['con_id'], data['t_id'], g.collector_info['c_id'],
+                                         data['location']['latitude'], data['location']['longitude'])
+    if cl_id:
         g.sesh.commit()
-        return success_response(msg)
+        return success_response({'cl_id': cl_id}, status=msg, http_code=202)
     else:
         g.sesh.rollback()
         return error_response(msg, status_code=err_code)
@@ -47,39 +80,28 @@ def claim_qr_code(con_id, t_id, c_id, lat, long):
     :param c_id: The collector_id of the collecting user
     :param lat: latitude of user during claim attempt.
     :param long: longitude of user during claim attempt.
-    :return: True if the claim request was successful, False if otherwise
+    :return: cl_id of the queued claim if the claim request was successful, False if otherwise
     """
     try:
         # No constraint logic is done as its only a qr_code token.
 
-        # Make sure a token is available and that it has info
-        avail_token = GetSingleAvailToken().execute_n_fetchone({'con_id': con_id, 't_id': t_id})
+        # Make sure the contract is live and still has tokens
         token_info = GetTokenInfo().execute_n_fetchone({'con_id': con_id, 'c_id': c_id})
-        if not avail_token or not token_info:
+        if not token_info:
             log_kv(LOG_INFO, {'message': 'no tokens are available', 'contract_id': con_id, 'collector_id': c_id})
             return False, 'Token not available.', 78
 
-        # Claim the token and update the database
-        log_kv(LOG_INFO, {'message': 'claiming ethereum token', 'token_id': avail_token['t_id'], 'collector_id': c_id})
-
-        # Attempt to claim the token on the eth network.
-        tx_hash, gas_price = g.geth.claim_token(token_info['con_addr'], token_info['con_abi'],
-                                                token_info['c_hash'], avail_token['t_id'])
-
-        # Persist the changes in the database.
-        rows_updated = SetToken().execute(
-            {'con_id': con_id, 'latitude': lat, 'longitude': long, 'gas_price': gas_price,
-             't_hash': tx_hash, 't_id': avail_token['t_id'], 'c_id': c_id, 'new_status': TokenStatus.CLAIMED.value})
+        # Reserve the token and queue the claim, the submitter sends it to the eth network.
+        queued = queue_claim(con_id, c_id, lat, long, t_id=t_id)
+        if queued is None:
+            log_kv(LOG_INFO, {'message': 'token is not available', 'contract_id': con_id, 'token_id': t_id,
+                              'collector_id': c_id})
+            return False, 'Token not available.', 78
 
-        # Make sure a row was updated
-        if rows_updated == 1:
-            log_kv(LOG_INFO, {'message': 'successfully claimed token', 'contract_id': con_id, 'collector_id': c_id})
-            return True, 'Token has been claimed!', 0
+        cl_id, t_id = queued
+        log_kv(LOG_INFO, {'message': 'queued token claim', 'claim_id': cl_id, 'token_id': t_id, 'collector_id': c_id})
+        return cl_id, 'Token claim has been queued!', 0
 
-    except GethException as e:
-        log_kv(LOG_ERROR, {'error': 'a geth_exception occurred while claiming token', 'exception': e.exception,
-                           'exc_message': e.message, 'contract_id': con_id, 'collector_id': c_id}, exception=True)
-        return False, 'Geth Error:' + e.exception, -1
     except Exception as e:
         log_kv(LOG_ERROR, {'error': 'an exception occurred while claiming token', 'exception': str(e),
                            'contract_id': con_id, 'collector_id': c_id}, exception=True)
@@ -88,24 +110,24 @@ def claim_qr_code(con_id, t_id, c_id, lat, long):
 
 @claim_bp.route(url_prefix, methods=['POST'])
 @verify_collector_jwt
-@requires_geth
 @requires_db
 @load_with_schema(ClaimRequest)
 @claim_docs.document(url_prefix, 'POST',
                      """
                      Method to claim a token of of an issued contract.
-                     """, input_schema=ClaimRequest,  req_c_jwt=True,
+                     """ + CLAIM_QUEUED_DOC, input_schema=ClaimRequest,  req_c_jwt=True,
+                     output_schema=ClaimQueuedResponse,
                      error_codes={'3': 'Code Constraint Failed',
                                   '4': 'Time Constraint Failed',
                                   '5': 'Location Constraint Failed',
                                   '6': 'No available tokens left.'})
 def claims(data):
-    results, msg, err_code = claim_token_for_user(data['con_id'], g.collector_info['c_id'],
-                                                  data['location']['latitude'], data['location']['longitude'],
-                                                  data.get('constraints', {}), g.sesh)
-    if results:
+    cl_id, msg, err_code = claim_token_for_user(data['con_id'], g.collector_info['c_id'],
+                                                data['location']['latitude'], data['location']['longitude'],
+                                                data.get('constraints', {}), g.sesh)
+    if cl_id:
         g.sesh.commit()
-        return success_response(msg)
+        return success_response({'cl_id': cl_id}, status=msg, http_code=202)
     else:
         g.sesh.rollback()
         return error_response(msg, status_code=err_code)
@@ -120,7 +142,7 @@ def claim_token_for_user(con_id, c_id, lat, long, constraints, sesh):
     :param long: longitude of user during claim attempt.
     :param sesh: The database session to use
     :param constraints: Contraint information given by user.
-    :return: True if the claim request was successful, False if otherwise
+    :return: cl_id of the queued claim if the claim request was successful, False if otherwise
     """
     try:
         # Enforcing claim constraints.
@@ -131,38 +153,61 @@ def claim_token_for_user(con_id, c_id, lat, long, constraints, sesh):
         if not validate_location_constraints(con_id, constraints.get('location', None)):
             return False, 'Constraint Failed: Not within the appropriate location to obtain this token.', 5
 
-        # Make sure a token is available and that it has info
-        avail_token = GetAvailableToken().execute_n_fetchone({'con_id': con_id}, sesh=sesh)
+        # Make sure the contract is live and still has tokens
         token_info = GetTokenInfo().execute_n_fetchone({'con_id': con_id, 'c_id': c_id}, sesh=sesh)
-        if not avail_token or not token_info:
+        if not token_info:
             log_kv(LOG_INFO, {'message': 'no tokens are available', 'contract_id': con_id, 'collector_id': c_id})
             return False, 'No available tokens', 6
 
-        # Claim the token and update the database
-        log_kv(LOG_INFO, {'message': 'claiming ethereum token', 'token_id': avail_token['t_id'],
-                          'collector_id': c_id})
-
-        # Attempt to claim the token on the eth network.
-        tx_hash, gas_price = g.geth.claim_token(token_info['con_addr'], token_info['con_abi'],
-                                                token_info['c_hash'], avail_token['t_id'],
-                                                code=constraints.get('code', None))
-
-        # Persist the changes in the database.
-        rows_updated = SetToken().execute(
-            {'con_id': con_id, 'latitude': lat, 'longitude': long, 'gas_price': gas_price,
-             't_hash': tx_hash, 't_id': avail_token['t_id'], 'c_id': c_id,
-             'new_status': TokenStatus.CLAIMED.value}, sesh=sesh)
-
-        # Make sure a row was updated
-        if rows_updated == 1:
-            log_kv(LOG_INFO, {'message': 'successfully claimed token', 'contract_id': con_id, 'collector_id': c_id})
-            return True, 'Token has been claimed!', 0
-
-    except GethException as e:
-        log_kv(LOG_ERROR, {'error': 'a geth_exception occurred while claiming token', 'exception': e.exception,
-                           'exc_message': e.message, 'contract_id': con_id, 'collector_id': c_id}, exception=True)
-        return False, 'Geth Error:' + e.exception, -1
+        # Pick, reserve and queue a token in one go, the submitter sends the claim to the eth network.
+        queued = queue_claim(con_id, c_id, lat, long, code=constraints.get('code', None), sesh=sesh)
+        if queued is None:
+            log_kv(LOG_INFO, {'message': 'tokens ran out', 'contract_id': con_id, 'collector_id': c_id})
+            return False, 'No available tokens', 6
+
+        cl_id, t_id = queued
+        log_kv(LOG_INFO, {'message': 'queued token claim', 'claim_id': cl_id, 'token_id': t_id, 'collector_id': c_id})
+        return cl_id, 'Token claim has been queued!', 0
+
     except Exception as e:
         log_kv(LOG_ERROR, {'error': 'an exception occurred while claiming token', 'exception': str(e),
                            'contract_id': con_id, 'collector_id': c_id}, exception=True)
         return False, str(e) + traceback.format_exc(), -1
+
+
+def claim_progress(claim):
+    """ Sums up where a queued claim is at from its outbox and token statuses
+
+    :param claim: row of GetClaimStatus
+    :return: 'queued', 'submitted', 'mined' or 'failed'
+    """
+    if claim['status'] == ClaimStatus.QUEUED.value:
+        return 'queued'
+    if claim['status'] == ClaimStatus.FAILED.value or claim['token_status'] == TokenStatus.FAILED.value:
+        return 'failed'
+    if claim['token_status'] == TokenStatus.CLAIMED.value:
+        return 'submitted'
+    return 'mined'
+
+
+@claim_bp.route(url_prefix + '/status/cl_id=<int:cl_id>', methods=['GET'])
+@requires_db
+@verify_collector_jwt
+@claim_docs.document(url_prefix + '/status/cl_id=<int:cl_id>', 'GET',
+                     """
+                     Returns the progress of one of the authorized collector's claims. A claim is 'queued' until the
+                     submitter sends it, then 'submitted' until the transaction is mined and 'mined' after. It is
+                     'failed' if it could not be sent after every retry, last_error says why, or if the transaction
+                     failed.
+                     """, req_c_jwt=True, output_schema=ClaimStatusResponse,
+                     url_params={'cl_id': 'cl_id returned when the claim was queued.'},
+                     error_codes={'79': 'No such claim.'})
+def claim_status(cl_id):
+    claim = GetClaimStatus().execute_n_fetchone({'cl_id': cl_id, 'c_id': g.collector_info['c_id']},
+                                                schema_out=False)
+    if claim is None:
+        return error_response('No such claim.', status_code=79, http_code=404)
+
+    claim = dict(claim)
+    claim['progress'] = claim_progress(claim)
+    return success_response(ClaimStatusResponse().dump(claim))
@@ -11,7 +11,7 @@ from marshmallow import ValidationError
 
 from ether.contract_source import DEFAULT_JSON_METADATA
 from ether.geth_keeper import GethException
-from models.constraints import get_all_constraints
+from models.constraints import get_all_constraints, get_all_constraints_many
 from models.contract import ContractRequest, GetContractByConID, GetContractByName, \
     GetContractsByIssuerID, process_constraints, insert_bulk_tokens, GetContractResponse, UpdateQRCODE, GetAllQRCodes, \
     DoesContractHaveQRCode, GetMetaDataByConID
@@ -96,18 +96,18 @@ class Contract(Resource):
             if issuer is None:
                 return error_response('Failed to retrieve issuer specified.', status_code=45)
 
-            data['con_tx'], data['con_abi'], data['gas_price'] = g.geth.issue_contract(issuer['i_hash'],
-                                                                                       issuer_name=issuer['username'],
-                                                                                       name=data['name'],
-                                                                                       desc=data['description'],
-                                                                                       img_url=data['pic_location'],
-                                                                                       num_tokes=data['num_created'],
-                                                                                       code_reqs=code_constraints,
-                                                                                       date_reqs=date_constraints,
-                                                                                       loc_reqs=loc_constraints,
-                                                                                       tradable=data['tradable'],
-                                                                                       metadata_uri=data[
-                                                                                           'metadata_location'])
+            data['con_tx'], data['con_abi'], data['gas_price'], data['sender'] = \
+                g.geth.issue_contract(issuer['i_hash'],
+                                      issuer_name=issuer['username'],
+                                      name=data['name'],
+                                      desc=data['description'],
+                                      img_url=data['pic_location'],
+                                      num_tokes=data['num_created'],
+                                      code_reqs=code_constraints,
+                                      date_reqs=date_constraints,
+                                      loc_reqs=loc_constraints,
+                                      tradable=data['tradable'],
+                                      metadata_uri=data['metadata_location'])
 
             # Insert into the database
             con_id, t_ids = insert_bulk_tokens(data['num_created'], data, g.sesh)
@@ -115,6 +115,7 @@ class Contract(Resource):
             # It is either qr_codes or other contstraints it cannot be both.
             if data['qr_code_claimable']:
                 # Get all tokens to associate qr code with.
+                qr_binds = []
                 for t_id in t_ids:
                     # Generate the data to place in qr code.
                     json_data_dict = dumps({'con_id': con_id, 't_id': t_id,
@@ -128,7 +129,11 @@ class Contract(Resource):
                     if saved_location is None:
                         log_kv(LOG_ERROR, {'error': 'failed to make qrcode.'})
                     else:
-                        UpdateQRCODE().execute({'qr_code_location': saved_location, 'con_id': con_id, 't_id': t_id})
+                        qr_binds.append({'qr_code_location': saved_location, 'con_id': con_id, 't_id': t_id})
+
+                # Persist every saved qr code in one batch.
+                if qr_binds:
+                    UpdateQRCODE().execute(qr_binds)
             elif 'constraints' in data:
                 # If constraints were passed in we need to process them.
                 process_constraints(data['constraints'], con_id)
@@ -200,9 +205,14 @@ class Contract(Resource):
             log_kv(LOG_INFO, {'message': 'succesfully retrieved issuer\'s contracts',
                               'issuer_id': g.issuer_info['i_id']})
 
-            # Add the constraints to the contract object.
+            # Add the constraints to the contract object, loaded for every contract at once.
+            constraints = get_all_constraints_many([contract['con_id'] for contract in contracts])
+            if constraints is None:
+                log_kv(LOG_WARNING, {'warning': 'could not get constraints of issuer\'s contracts',
+                                     'issuer_id': g.issuer_info['i_id']})
+                return error_response(status="Couldn't retrieve contract constraints", status_code=-1, http_code=200)
             for contract in contracts:
-                contract.update({'constraints': get_all_constraints(contract['con_id'])})
+                contract.update({'constraints': constraints[contract['con_id']]})
 
             return success_response({'contracts': contracts})
         else:
@@ -282,6 +292,9 @@ def get_contract_by_con_id(con_id):
     contract = GetContractByConID().execute_n_fetchone({'con_id': con_id})
     constraints = get_all_constraints(con_id)
     g.sesh.close()
+    if contract and constraints is None:
+        log_kv(LOG_WARNING, {'warning': 'could not get contract constraints', 'contract_id': con_id})
+        return error_response(status="Couldn't retrieve contract constraints", status_code=-1, http_code=200)
     if contract:
         log_kv(LOG_DEBUG, {'debug': 'successfully retrieved contract', 'contract_id': con_id})
         contract.update({'constraints': constraints})
@@ -1,12 +1,11 @@
-from flask import Blueprint
+from flask import Blueprint, g
 
 from models.contract import GetAllContracts
 from utils.db_utils import requires_db
 from utils.doc_utils import BlueprintDocumentation
 from utils.utils import success_response, error_response, log_kv, LOG_DEBUG, LOG_ERROR
-from models.claim import Location
-from models.contract import GetAllContractsByProximity, GetAllTradableContracts, GetProximityContracts, \
-    TradableTokenResponse, GET_CONTRACT_DOC_EXPLORE
+from models.contract import contracts_by_proximity, GetAllTradableContracts, GetProximityContracts, \
+    ProximitySearch, TradableTokenResponse, GET_CONTRACT_DOC_EXPLORE
 from routes import load_with_schema
 
 
@@ -32,7 +31,9 @@ url_prefix = '/explore'
                        Get's all contracts for the explore page that have keyword in name or description.
                        """, output_schema=GET_CONTRACT_DOC_EXPLORE)
 def get_all_contracts(keyword, include_nearby):
-    contracts = GetAllContracts(keyword, include_nearby).execute_n_fetchall({}, close_connection=True)
+    contracts = GetAllContracts(keyword is not None).execute_n_fetchall({'keyword': keyword,
+                                                                         'include_nearby': include_nearby},
+                                                                        close_connection=True)
     if contracts is not None:
         log_kv(LOG_DEBUG, {'debug': 'succesfully got all contracts'})
         return success_response({'contracts': contracts})
@@ -43,20 +44,24 @@ def get_all_contracts(keyword, include_nearby):
 
 @explore_bp.route(url_prefix + '/proximity', methods=['POST'])
 @explore_bp.route(url_prefix + '/proximity/keyword=<string:keyword>', methods=['POST'])
-@load_with_schema(Location)
+@load_with_schema(ProximitySearch)
 @requires_db
 @explore_docs.document(url_prefix + '/proximity', 'POST',
                        """
-                       Returns all contracts that have some sort of location constraint on it. Also returns distance 
-                       given location is from the constraint. Distance in meters.
-                       """, input_schema=Location, output_schema=GetProximityContracts)
+                       Returns all contracts that have some sort of location constraint on it, nearest first. Also 
+                       returns distance given location is from the constraint. Distance in meters. Give radius to only
+                       get contracts with a constraint within that many meters, looked up in a spatial index so it 
+                       stays fast however many contracts there are, and limit to cap how many come back.
+                       """, input_schema=ProximitySearch, output_schema=GetProximityContracts)
 @explore_docs.document(url_prefix + '/proximity/keyword=<string:keyword>', 'POST',
                        """
                        Same as proximmity with keyword.
                        """,
-                       input_schema=Location, output_schema=GetProximityContracts)
+                       input_schema=ProximitySearch, output_schema=GetProximityContracts)
 def get_all_contracts_by_proximity(data, keyword=None):
-    contracts = GetAllContractsByProximity(keyword).execute_n_fetchall(data, close_connection=True, load_out=True)
+    contracts = contracts_by_proximity(data['latitude'], data['longitude'], keyword, radius=data.get('radius'),
+                                       limit=data.get('limit'))
+    g.sesh.close()
     if contracts is not None:
         log_kv(LOG_DEBUG, {'debug': 'succesfully got all contracts'})
         return success_response({'contracts': contracts})
@@ -77,7 +82,8 @@ def get_all_contracts_by_proximity(data, keyword=None):
                        Same as base tradable method but with keyword search.
                        """, output_schema=TradableTokenResponse)
 def get_all_tradable(keyword=None):
-    contracts = GetAllTradableContracts(keyword).execute_n_fetchall({}, close_connection=True, load_out=True)
+    contracts = GetAllTradableContracts(keyword is not None).execute_n_fetchall({'keyword': keyword},
+                                                                                close_connection=True, load_out=True)
     if contracts is not None:
         log_kv(LOG_DEBUG, {'debug': 'succesfully got all contracts'})
         return success_response({'contracts': contracts})
@@ -0,0 +1,23 @@
+from flask import Blueprint, g
+
+from routes import requires_geth
+from utils.doc_utils import BlueprintDocumentation
+from utils.utils import success_response
+
+gas_bp = Blueprint('gas', __name__)
+gas_docs = BlueprintDocumentation(gas_bp, 'Gas')
+url_prefix = '/gas_prices'
+
+
+@gas_bp.route(url_prefix, methods=['GET'])
+@requires_geth
+@gas_docs.document(url_prefix, 'GET',
+                   """
+                   Returns the gas price in wei this worker currently bids for each kind of transaction: deploy (deploying,
+                   minting and killing contracts), trade (trades and external transfers) and claim. source is 'blocks'
+                   when the prices are percentiles of the transactions in recent blocks, 'node' when those were too few
+                   and the node's eth_gasPrice is used, and 'fallback' when the node couldn't be reached. Estimates are
+                   cached, age is how many seconds ago they were sampled.
+                   """)
+def get_gas_prices():
+    return success_response(g.geth.gas_prices())
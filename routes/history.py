@@ -0,0 +1,69 @@
+from flask import Blueprint, g, request
+
+from models.history import GetTokenHistory, GetCollectorHistory, HistoryResponse, get_history_page
+from utils.db_utils import requires_db
+from utils.doc_utils import BlueprintDocumentation
+from utils.utils import success_response, error_response
+from utils.verify_utils import verify_collector_jwt
+
+history_bp = Blueprint('history', __name__)
+history_docs = BlueprintDocumentation(history_bp, 'History')
+url_prefix = '/history'
+
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 200
+
+PAGING_PARAMS = {'cursor': 'next_cursor of the previous page, leave out for the first page.',
+                 'limit': 'Page size, {} by default and at most {}.'.format(HISTORY_PAGE_SIZE, MAX_HISTORY_PAGE_SIZE)}
+
+
+def get_paging():
+    """
+    Reads the cursor and limit query parameters.
+    :return: Tuple of (cursor, limit), limit is None if it is out of range.
+    """
+    cursor = request.args.get('cursor', 0, type=int)
+    limit = request.args.get('limit', HISTORY_PAGE_SIZE, type=int)
+    if limit < 1 or limit > MAX_HISTORY_PAGE_SIZE:
+        return cursor, None
+    return cursor, limit
+
+
+@history_bp.route(url_prefix + '/con_id=<int:con_id>&t_id=<int:t_id>', methods=['GET'])
+@requires_db
+@history_docs.document(url_prefix + '/con_id=<int:con_id>&t_id=<int:t_id>', 'GET',
+                       """
+                       Returns every claim, trade and external transfer of a token, oldest first. Results are paged,
+                       pass the returned next_cursor as ?cursor= to get the next page (null on the last page).
+                       """, output_schema=HistoryResponse,
+                       url_params={'con_id': 'con_id of the token.', 't_id': 't_id of the token.', **PAGING_PARAMS})
+def get_token_history(con_id, t_id):
+    cursor, limit = get_paging()
+    if limit is None:
+        return error_response('limit must be between 1 and {}.'.format(MAX_HISTORY_PAGE_SIZE))
+
+    page = get_history_page(GetTokenHistory(), {'con_id': con_id, 't_id': t_id}, cursor, limit)
+    if page is None:
+        return error_response("Couldn't retrieve history.")
+    history, next_cursor = page
+    return success_response({'history': history, 'next_cursor': next_cursor})
+
+
+@history_bp.route(url_prefix + '/collector', methods=['GET'])
+@requires_db
+@verify_collector_jwt
+@history_docs.document(url_prefix + '/collector', 'GET',
+                       """
+                       Returns every token that came into or left the authorized collector's collection, oldest first.
+                       Paged like /history/con_id=<int:con_id>&t_id=<int:t_id>.
+                       """, req_c_jwt=True, output_schema=HistoryResponse, url_params=PAGING_PARAMS)
+def get_collector_history():
+    cursor, limit = get_paging()
+    if limit is None:
+        return error_response('limit must be between 1 and {}.'.format(MAX_HISTORY_PAGE_SIZE))
+
+    page = get_history_page(GetCollectorHistory(), {'c_id': g.collector_info['c_id']}, cursor, limit)
+    if page is None:
+        return error_response("Couldn't retrieve history.")
+    history, next_cursor = page
+    return success_response({'history': history, 'next_cursor': next_cursor})
@@ -1,5 +1,6 @@
-from flask import Blueprint, g
+from flask import Blueprint, g, current_app
 
+from ether.geth_keeper import get_geth_keeper
 from utils.doc_utils import BlueprintDocumentation
 from utils.utils import success_response, log_kv, LOG_INFO
 from utils.verify_utils import verify_issuer_jwt, verify_collector_jwt
@@ -39,3 +40,21 @@ def issuer_a_ping():
 def collector_a_ping():
     log_kv(LOG_INFO, {'message': 'authorized collector ping called', 'collector_id': g.collector_info['c_id']})
     return success_response("pong for c_id:{}".format(g.collector_info['c_id']))
+
+
+@ping.route(url_prefix+'_geth', methods=['GET'])
+@ping_docs.document(url_prefix+'_geth', 'GET',
+                    """
+                    Returns how many connections this worker has opened to the ethereum node, how its contract 
+                    cache is doing and how many sends it has in flight over its hot wallets, without touching the node.
+                    """)
+def geth_ping():
+    if current_app.config.get('USE_MOCK', False):
+        return success_response({'mock': True})
+    geth = get_geth_keeper()
+
+    # Only totals, this doesn't require a login so the hot wallet addresses stay out of it.
+    in_flight = list(geth.wallet_stats().values())
+    wallets = {'wallets': len(in_flight), 'in_flight': sum(in_flight), 'busiest': max(in_flight, default=0)}
+    return success_response({'connections': geth.connection_stats(), 'contract_cache': geth.contract_cache_stats(),
+                             'wallets': wallets})
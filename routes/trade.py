@@ -1,4 +1,4 @@
-from flask import Blueprint, g
+from flask import Blueprint, g, request
 from flask_restful import Resource, Api
 
 from utils.doc_utils import BlueprintDocumentation
@@ -8,15 +8,17 @@ from utils.verify_utils import verify_collector_jwt
 from ether.geth_keeper import GethException
 from routes import load_with_schema, requires_geth
 from models.trade import TradeRequest, DeleteTradeRequest, TradeResponseRequest, GetTradeByTRID, UpdateTradeStatus, \
-    TradeStatus, GetTradeItems, InvalidateTradeRequests, GetActiveTradeRequests, GetUntradables, \
-    create_trade_request, check_trade_item_ownership, check_active_trade_item, is_valid_trade_items, \
-    validate_offer_and_trade, GetTokenInfo, TradeResponse, GetTraderInfo
-from models.collector import GetCollectorByCID
+    TradeStatus, GetTradeItems, InvalidateTradeRequests, GetUntradables, \
+    create_trade_request, get_unowned_trade_items, get_active_trade_items, is_valid_trade_items, \
+    validate_offer_and_trade, TradeResponse, GetTraderInfo, get_trade_listing
 
 trade_bp = Blueprint('trade', __name__)
 trade_docs = BlueprintDocumentation(trade_bp, 'Trade')
 url_prefix = '/trade'
 
+TRADE_PAGE_SIZE = 50
+MAX_TRADE_PAGE_SIZE = 200
+
 
 class Trade(Resource):
 
@@ -42,37 +44,39 @@ class Trade(Resource):
             # Ensure all the items put up for trade are tradable tokens.
             con_ids = set([t_i['con_id'] for t_i in data['trader']['offers']] +
                           [t_i['con_id'] for t_i in data['tradee']['offers']])
-            untradable_con_ids = GetUntradables(con_ids).execute_n_fetchall({}, schema_out=False)
+            untradable_con_ids = GetUntradables().execute_n_fetchall({'con_ids': list(con_ids)}, schema_out=False)
             if len(untradable_con_ids) != 0:
                 return error_response('Attempting to issue trade request with untradable tokens.',
                                       untradable_cons=untradable_con_ids, status_code=42)
 
+            # Check ownership of every token on both sides at once.
+            trader_c_id, tradee_c_id = data['trader']['c_id'], data['tradee']['c_id']
+            unowned = get_unowned_trade_items([{**t_i, 'owner': trader_c_id} for t_i in data['trader']['offers']] +
+                                              [{**t_i, 'owner': tradee_c_id} for t_i in data['tradee']['offers']])
+            trader_unowned = [(t_i['con_id'], t_i['t_id']) for t_i in unowned if t_i['owner'] == trader_c_id]
+            tradee_unowned = [(t_i['con_id'], t_i['t_id']) for t_i in unowned if t_i['owner'] == tradee_c_id]
+
             # Ensure trader owns all tokens put up by trader.
-            for t_i in data['trader']['offers']:
-                if not check_trade_item_ownership(data['trader']['c_id'], t_i['con_id'], t_i['t_id']):
-                    log_kv(LOG_INFO, {'info': 'collector made trade request containing token they did not own.',
-                                      'trader_c_id': data['trader']['c_id'], 'con_id': t_i['con_id'],
-                                      't_id': t_i['t_id']})
-                    return error_response("Collector making request doesn't have ownership of tokens within trade",
-                                          status_code=67)
+            if trader_unowned:
+                log_kv(LOG_INFO, {'info': 'collector made trade request containing token they did not own.',
+                                  'trader_c_id': trader_c_id, 'tokens': trader_unowned})
+                return error_response("Collector making request doesn't have ownership of tokens within trade",
+                                      unowned_tokens=trader_unowned, status_code=67)
 
             # Ensure trader doesn't have any active trades containing put up tokens.
-            for t_i in data['trader']['offers']:
-                if check_active_trade_item(data['trader']['c_id'], t_i['con_id'], t_i['t_id']):
-                    log_kv(LOG_INFO, {'info': 'collector attempting to make trade on active token.',
-                                      'trader_c_id': data['trader']['c_id'], 'con_id': t_i['con_id'],
-                                      't_id': t_i['t_id']})
-                    return error_response("Collector making request already has token in an active trade.",
-                                          status_code=90)
+            active = get_active_trade_items(trader_c_id, data['trader']['offers'])
+            if active:
+                log_kv(LOG_INFO, {'info': 'collector attempting to make trade on active token.',
+                                  'trader_c_id': trader_c_id, 'tokens': active})
+                return error_response("Collector making request already has token in an active trade.",
+                                      active_tokens=active, status_code=90)
 
             # Ensure tradee owns all tokens request
-            for t_i in data['tradee']['offers']:
-                if not check_trade_item_ownership(data['tradee']['c_id'], t_i['con_id'], t_i['t_id']):
-                    log_kv(LOG_INFO, {'info': 'collector made trade request containing token tradee did not own.',
-                                      'tradee_c_id': data['tradee']['c_id'], 'con_id': t_i['con_id'],
-                                      't_id': t_i['t_id']})
-                    return error_response("Collector making request for token the tradee doesn't have ownership of.",
-                                          status_code=91)
+            if tradee_unowned:
+                log_kv(LOG_INFO, {'info': 'collector made trade request containing token tradee did not own.',
+                                  'tradee_c_id': tradee_c_id, 'tokens': tradee_unowned})
+                return error_response("Collector making request for token the tradee doesn't have ownership of.",
+                                      unowned_tokens=tradee_unowned, status_code=91)
 
             # Ensures the trader has the appropriate amount of eth.
             if data['trader']['eth_offer']:
@@ -236,49 +240,29 @@ class Trade(Resource):
 @verify_collector_jwt
 @trade_docs.document(url_prefix, 'GET',
                      """
-                     Method to get all active trade requests.
+                     Method to get all active trade requests. Results are paged, pass the returned next_cursor as 
+                     ?cursor= to get the next page (null on the last page) and ?limit= to change the page size.
                      """, req_c_jwt=True, output_schema=TradeResponse)
 @trade_docs.document('/tradee', 'GET',
                      """
-                     Method to get all active trade requests where authorized user is tradee.
+                     Method to get all active trade requests where authorized user is tradee. Paged like /trade.
                      """, req_c_jwt=True, output_schema=TradeResponse)
 @trade_docs.document('/trader', 'GET',
                      """
-                     Method to get all active trade requests where authorized user is trader.
+                     Method to get all active trade requests where authorized user is trader. Paged like /trade.
                      """,req_c_jwt=True, output_schema=TradeResponse)
 def get(version=None):
-    # Get all tr_ids of active trade_requests containing the authorized collector..
-    tr_ids = GetActiveTradeRequests(version).execute_n_fetchall({'c_id': g.collector_info['c_id']}, schema_out=False)
-
-    trades = []
-    for tr_id in map(lambda x: x['tr_id'], tr_ids):
-        # Get base trade info and all trade items associated.
-        trade = GetTradeByTRID().execute_n_fetchone({'tr_id': tr_id}, schema_out=False)
-        trade_items = GetTradeItems().execute_n_fetchall({'tr_id': tr_id}, schema_out=False)
-
-        # Getting collector info..
-        trader_collector = GetCollectorByCID().execute_n_fetchone({'c_id': trade['trader_c_id']})
-        tradee_collector = GetCollectorByCID().execute_n_fetchone({'c_id': trade['tradee_c_id']})
-
-        # Getting trade offer, tradee offer info.
-        trader_offers = [
-            GetTokenInfo().execute_n_fetchone({'con_id': t_i['con_id'], 't_id': t_i['t_id']}) for t_i in trade_items
-            if t_i['owner'] == trade['trader_c_id']
-        ]
-        tradee_offers = [
-            GetTokenInfo().execute_n_fetchone({'con_id': t_i['con_id'], 't_id': t_i['t_id']}) for t_i in trade_items
-            if t_i['owner'] == trade['tradee_c_id']
-        ]
-
-        # Setting them up in an object.
-        cur_trade = TradeResponse().load({
-            'trader': {'collector': trader_collector, 'eth_offer': trade['trader_eth_offer'], 'offers': trader_offers},
-            'tradee': {'collector': tradee_collector, 'eth_offer': trade['tradee_eth_offer'], 'offers': tradee_offers},
-            'status': trade['status'], 'tr_id': tr_id
-        })
-        trades.append(cur_trade)
-
-    return success_response({'trades': trades})
+    cursor = request.args.get('cursor', 0, type=int)
+    limit = request.args.get('limit', TRADE_PAGE_SIZE, type=int)
+    if limit < 1 or limit > MAX_TRADE_PAGE_SIZE:
+        return error_response('limit must be between 1 and {}.'.format(MAX_TRADE_PAGE_SIZE))
+
+    # Get the page of active trade_requests containing the authorized collector.
+    page = get_trade_listing(g.collector_info['c_id'], version, cursor, limit)
+    if page is None:
+        return error_response("Couldn't retrieve trade requests.")
+    trades, next_cursor = page
+    return success_response({'trades': trades, 'next_cursor': next_cursor})
 
 
 trade_api = Api(trade_bp)
@@ -5,13 +5,12 @@ from models.collector import GetCollectorByCID
 from utils.doc_utils import BlueprintDocumentation
 from utils.verify_utils import verify_collector_jwt
 from utils.db_utils import requires_db
-from utils.utils import success_response, error_response, log_kv, LOG_ERROR
+from utils.utils import success_response, error_response, log_kv, LOG_ERROR, LOG_INFO
 from routes import load_with_schema, requires_geth
 
-from models.contract import GetContractByConID, UpdateTokenStatus, TokenStatus
+from models.contract import GetContractByConID, UpdateTokenStatus, TokenStatus, get_chain_owners
 from models.issuer import GetIssuerByIID
-
-from models.transfer import ExternalTransfer
+from models.transfer import ExternalTransfer, InsertExternalTransfer
 
 transfer_bp = Blueprint('transfer', __name__)
 transfer_docs = BlueprintDocumentation(transfer_bp, 'Transfer')
@@ -26,7 +25,8 @@ class Transfer(Resource):
                             """
                             This method performs a transfer to an external account outside of the token environment.
                             """, req_c_jwt=True,
-                            error_codes={423: "Couldn't perform external token transfer."})
+                            error_codes={423: "Couldn't perform external token transfer.",
+                                         424: "Collector doesn't own the token on chain."})
     @verify_collector_jwt
     @load_with_schema(ExternalTransfer)
     def post(self, data):
@@ -35,10 +35,23 @@ class Transfer(Resource):
         contract = GetContractByConID().execute_n_fetchone({'con_id': data['con_id']}, schema_out=False)
 
         try:
-            g.geth.perform_transfer(contract['con_addr'], contract['con_abi'], data['t_id'],
-                                    src_acct=collector['c_hash'],
-                                    dest_acct=data['destination_wallet_hash'])
+            # Check ownership on chain before paying for a transfer the contract would reject.
+            owners = get_chain_owners([{'con_id': data['con_id'], 't_id': data['t_id'],
+                                        'con_addr': contract['con_addr'], 'con_abi': contract['con_abi'],
+                                        'owner': collector['c_hash']}])
+            if owners[(data['con_id'], data['t_id'])].upper() != collector['c_hash'].upper():
+                log_kv(LOG_INFO, {'info': 'external transfer of token not owned on chain',
+                                  'c_id': g.collector_info['c_id'], 'con_id': data['con_id'], 't_id': data['t_id']})
+                return error_response("Collector doesn't own that token.", status_code=424)
+
+            tx_hash, _ = g.geth.perform_transfer(contract['con_addr'], contract['con_abi'], data['t_id'],
+                                                 src_acct=collector['c_hash'],
+                                                 dest_acct=data['destination_wallet_hash'], sender=contract['sender'])
             UpdateTokenStatus().execute({'new_status': TokenStatus.EXTERNAL.value, 'this_id': data['t_id']})
+            # Only added to the token's history by upact once the transfer is mined.
+            InsertExternalTransfer().execute({'con_id': data['con_id'], 't_id': data['t_id'],
+                                              'from_c_id': g.collector_info['c_id'],
+                                              'to_address': data['destination_wallet_hash'], 'tx_hash': tx_hash})
             g.sesh.commit()
         except Exception as e:
             g.sesh.rollback()
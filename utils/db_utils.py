@@ -2,7 +2,7 @@ from functools import wraps
 from sqlite3 import Connection as SQLite3Connection
 
 from flask import g
-from sqlalchemy import event
+from sqlalchemy import bindparam, event
 from sqlalchemy.engine import Engine
 from sqlalchemy.sql import text
 
@@ -12,12 +12,37 @@ from models import Sesh
 # Need this here as sqlite is a little lame and wont keep this across connections.
 from utils.utils import log_kv, LOG_ERROR, LOG_DEBUG
 
+# Pragmas that may be set from the SQLITE_PRAGMAS config, in the order they get applied. busy_timeout goes first so
+# switching the journal mode waits on other connections instead of failing.
+SQLITE_PRAGMA_ORDER = ('busy_timeout', 'journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store')
+
+# Profile applied to every new sqlite connection. Set with configure_sqlite_pragmas.
+_sqlite_pragmas = {}
+
+
+def configure_sqlite_pragmas(pragmas):
+    """
+    Sets the pragma profile applied to every sqlite connection opened after this call.
+    :param pragmas: dict of pragma name to value, usually the SQLITE_PRAGMAS config. None to reset.
+    :return: None
+    """
+    pragmas = pragmas or {}
+    unknown = set(pragmas) - set(SQLITE_PRAGMA_ORDER)
+    if unknown:
+        raise ValueError('Unsupported sqlite pragmas: {}'.format(', '.join(sorted(unknown))))
+
+    _sqlite_pragmas.clear()
+    _sqlite_pragmas.update(pragmas)
+
 
 @event.listens_for(Engine, "connect")
 def _set_sqlite_pragma(dbapi_connection, _):
     if isinstance(dbapi_connection, SQLite3Connection):
         cursor = dbapi_connection.cursor()
         cursor.execute("PRAGMA foreign_keys=ON;")
+        for name in SQLITE_PRAGMA_ORDER:
+            if name in _sqlite_pragmas:
+                cursor.execute("PRAGMA {}={};".format(name, _sqlite_pragmas[name]))
         cursor.close()
 
 
@@ -34,27 +59,80 @@ def requires_db(f):
 
 
 class DataQuery:
+    """
+    Base class for every query in the app. Subclasses declare sql_text (and optionally schema_out) at the class level,
+    the statement is compiled once when the subclass is defined and the schema instance is shared by every call.
+
+    Queries whose sql changes with constructor arguments (ex: keyword searches) override build_sql. Each distinct set
+    of arguments is compiled once and cached on the class, so the arguments should describe the *shape* of the query
+    and never contain user supplied values. Those belong in the binds.
+    """
 
     sql_text = None
     schema_out = None
 
-    def __init__(self):
-        if self.sql_text is None:
+    # Names of binds that take a list of values. ex: "where con_id in :con_ids"
+    expanding_binds = ()
+
+    _statement = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._variants = {}
+        cls._statement = cls.compile(cls.sql_text) if cls.sql_text is not None else None
+
+    def __init__(self, *variant):
+        if variant:
+            self._statement, self.sql_text = self.get_variant(*variant)
+        if self._statement is None:
             raise NotImplementedError("Must provide sql_text")
-        self.sql_txt = text(self.sql_text)
+
+    @classmethod
+    def compile(cls, sql_text):
+        """
+        Wraps the sql_text into a statement, marking any expanding binds.
+        :param sql_text: Raw sql to compile.
+        :return: Compiled text clause.
+        """
+        statement = text(sql_text)
+        if cls.expanding_binds:
+            statement = statement.bindparams(*[bindparam(name, expanding=True) for name in cls.expanding_binds])
+        return statement
+
+    @classmethod
+    def build_sql(cls, *variant):
+        """
+        Builds the sql_text for the given variant. Override for queries whose sql depends on constructor arguments.
+        :param variant: Arguments given to the constructor.
+        :return: sql_text string.
+        """
+        raise NotImplementedError("{} does not take variant arguments".format(cls.__name__))
+
+    @classmethod
+    def get_variant(cls, *variant):
+        """
+        Gets the compiled statement for the given variant, building and caching it the first time it is seen.
+        :param variant: Arguments given to the constructor.
+        :return: Tuple of (compiled statement, sql_text)
+        """
+        compiled = cls._variants.get(variant)
+        if compiled is None:
+            sql_text = cls.build_sql(*variant)
+            compiled = cls._variants.setdefault(variant, (cls.compile(sql_text), sql_text))
+        return compiled
 
     def execute(self, binds, sesh=None, close_connection=False):
         """
-        Calls query and fetch's the first row will return None if no values are present.
-        :param binds: Binds to add to the query.
+        Executes the query and returns the number of rows it affected.
+        :param binds: Binds to add to the query. A list of binds runs the statement once per entry (executemany).
         :param sesh: If we are being provided a connection use it.
         :param close_connection: If true close connection before returning
-        :return: First value of None.
+        :return: Number of rows affected.
         """
         log_kv(LOG_DEBUG, {'message': 'executing query', 'sql_text': self.sql_text, 'binds': binds})
         try:
             sesh = sesh if sesh is not None else g.sesh
-            res = sesh.execute(self.sql_text, binds)
+            res = sesh.execute(self._statement, binds)
 
             # close connection if needed.
             if close_connection:
@@ -79,7 +157,7 @@ class DataQuery:
         try:
             # Perform the selected query and try and get object off of it.
             sesh = sesh if sesh is not None else g.sesh
-            rv = sesh.execute(self.sql_text, binds).fetchone()
+            rv = sesh.execute(self._statement, binds).fetchone()
             if rv is None:
                 # Nothing from the query.
                 return None
@@ -115,7 +193,7 @@ class DataQuery:
         try:
             # Perform the selected query and try and get object off of it.
             sesh = sesh if sesh is not None else g.sesh
-            rv = sesh.execute(self.sql_text, binds).fetchall()
+            rv = sesh.execute(self._statement, binds).fetchall()
             if rv is None:
                 # Nothing from the query.
                 return None
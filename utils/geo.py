@@ -0,0 +1,172 @@
+"""
+Great circle distances between collectors and location constraints, computed with numpy for many points and fences at
+once. Distances are in meters over a sphere of the earth's mean radius, the same one mpu.haversine_distance uses.
+"""
+import math
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+
+# Most point to fence distances worked out in one go, larger batches of points are split to bound memory.
+GEO_CHUNK_CELLS = 1 << 20
+
+
+def haversine_m(lats1, longs1, lats2, longs2):
+    """
+    Haversine distance between two sets of points, broadcast against each other like any numpy operation.
+    :param lats1: latitudes in degrees of the first points.
+    :param longs1: longitudes in degrees of the first points.
+    :param lats2: latitudes in degrees of the second points.
+    :param longs2: longitudes in degrees of the second points.
+    :return: numpy array of distances in meters.
+    """
+    lats1, longs1, lats2, longs2 = (np.radians(np.asarray(v, dtype=np.float64))
+                                    for v in (lats1, longs1, lats2, longs2))
+    return _haversine(lats1, longs1, np.cos(lats1), lats2, longs2, np.cos(lats2))
+
+
+def _haversine(lats1, longs1, cos_lats1, lats2, longs2, cos_lats2):
+    # Every argument is in radians, the cosines are passed in so fences can work theirs out once.
+    a = np.sin((lats2 - lats1) / 2) ** 2 + cos_lats1 * cos_lats2 * np.sin((longs2 - longs1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def bounding_boxes(latitude, longitude, radius):
+    """
+    Boxes in degrees that hold every point within radius meters of the given one, for searching a spatial index.
+    :param latitude: latitude of the center.
+    :param longitude: longitude of the center.
+    :param radius: distance from the center in meters.
+    :return: list of (min_lat, max_lat, min_long, max_long), two boxes when the circle crosses the antimeridian.
+    """
+    angle = radius / EARTH_RADIUS_M
+    min_lat, max_lat = latitude - math.degrees(angle), latitude + math.degrees(angle)
+    # Circles over a pole, or too wide for the longitude offset to exist, span every longitude.
+    if min_lat <= -90 or max_lat >= 90 or angle >= math.pi / 2:
+        return [(max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0)]
+    ratio = math.sin(angle) / math.cos(math.radians(latitude))
+    if ratio >= 1:
+        return [(min_lat, max_lat, -180.0, 180.0)]
+
+    delta_long = math.degrees(math.asin(ratio))
+    min_long, max_long = longitude - delta_long, longitude + delta_long
+    if min_long < -180:
+        return [(min_lat, max_lat, min_long + 360, 180.0), (min_lat, max_lat, -180.0, max_long)]
+    if max_long > 180:
+        return [(min_lat, max_lat, min_long, 180.0), (min_lat, max_lat, -180.0, max_long - 360)]
+    return [(min_lat, max_lat, min_long, max_long)]
+
+
+def nearest_per_key(keys, distances):
+    """
+    Picks the closest row of every key, e.g. the nearest fence of every contract.
+    :param keys: numpy array of the key of each row.
+    :param distances: numpy array of the distance of each row.
+    :return: numpy array of row indices, one per key, ordered by distance.
+    """
+    if not len(keys):
+        return np.empty(0, dtype=np.intp)
+    order = np.lexsort((distances, keys))
+    sorted_keys = keys[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    nearest = order[first]
+    return nearest[np.argsort(distances[nearest], kind='mergesort')]
+
+
+class FenceSet(object):
+    """ Circular location fences held as numpy arrays so a point is checked against all of them in one call
+
+    **Attributes**:
+        * lats, longs: centers of the fences in degrees.
+        * radii: radius of each fence in meters.
+    """
+
+    __slots__ = ('lats', 'longs', 'radii', '_lats_rad', '_longs_rad', '_cos_lats')
+
+    def __init__(self, lats, longs, radii):
+        """
+        :param lats: latitude of each fence.
+        :param longs: longitude of each fence.
+        :param radii: radius of each fence in meters.
+        """
+        self.lats = np.asarray(lats, dtype=np.float64).reshape(-1)
+        self.longs = np.asarray(longs, dtype=np.float64).reshape(-1)
+        self.radii = np.asarray(radii, dtype=np.float64).reshape(-1)
+        self._lats_rad = np.radians(self.lats)
+        self._longs_rad = np.radians(self.longs)
+        self._cos_lats = np.cos(self._lats_rad)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        :param rows: (latitude, longitude, radius) of each fence, or dicts with those keys.
+        :return: FenceSet
+        """
+        rows = [(row['latitude'], row['longitude'], row['radius']) if isinstance(row, dict) else row
+                for row in rows]
+        if not rows:
+            return cls((), (), ())
+        lats, longs, radii = zip(*rows)
+        return cls(lats, longs, radii)
+
+    def __len__(self):
+        return len(self.radii)
+
+    def distances(self, latitude, longitude):
+        """
+        :param latitude: latitude of the point.
+        :param longitude: longitude of the point.
+        :return: numpy array of the distance in meters from the point to the center of each fence.
+        """
+        lat = math.radians(latitude)
+        return _haversine(self._lats_rad, self._longs_rad, self._cos_lats, lat, math.radians(longitude),
+                          math.cos(lat))
+
+    def contains(self, latitude, longitude):
+        """
+        :return: True if the point is inside at least one fence.
+        """
+        return bool(len(self) and (self.distances(latitude, longitude) <= self.radii).any())
+
+    def distance_matrix(self, lats, longs):
+        """
+        :param lats: latitudes of the points.
+        :param longs: longitudes of the points.
+        :return: numpy array of shape (points, fences) of distances in meters.
+        """
+        lats = np.radians(np.asarray(lats, dtype=np.float64).reshape(-1, 1))
+        longs = np.radians(np.asarray(longs, dtype=np.float64).reshape(-1, 1))
+        return _haversine(lats, longs, np.cos(lats), self._lats_rad, self._longs_rad, self._cos_lats)
+
+    def _inside_chunks(self, lats, longs):
+        # Yields (first point, points x fences inside mask) over chunks of at most GEO_CHUNK_CELLS cells.
+        lats = np.asarray(lats, dtype=np.float64).reshape(-1)
+        longs = np.asarray(longs, dtype=np.float64).reshape(-1)
+        step = max(1, GEO_CHUNK_CELLS // max(1, len(self)))
+        for start in range(0, len(lats), step):
+            yield start, self.distance_matrix(lats[start:start + step], longs[start:start + step]) <= self.radii
+
+    def contains_many(self, lats, longs):
+        """
+        :param lats: latitudes of the points.
+        :param longs: longitudes of the points.
+        :return: numpy array of booleans, True for each point inside at least one fence.
+        """
+        inside = np.zeros(len(np.asarray(lats).reshape(-1)), dtype=bool)
+        if len(self):
+            for start, chunk in self._inside_chunks(lats, longs):
+                inside[start:start + len(chunk)] = chunk.any(axis=1)
+        return inside
+
+    def count_within(self, lats, longs):
+        """
+        :param lats: latitudes of the points.
+        :param longs: longitudes of the points.
+        :return: numpy array of how many of the points fall inside each fence.
+        """
+        counts = np.zeros(len(self), dtype=np.int64)
+        for _, chunk in self._inside_chunks(lats, longs):
+            counts += chunk.sum(axis=0)
+        return counts